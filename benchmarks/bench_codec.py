@@ -0,0 +1,55 @@
+"""
+Compares saving and loading cog state with python object yaml (CLoader and
+CDumper when available) against SchemaCodec in binary and json formats for a
+registration with many users.
+
+Run from the repository root: python -m benchmarks.bench_codec
+"""
+from time import perf_counter
+
+from bot.common.user_custom import UserCustom
+from bot.registration.registration import Registration
+from utils.codec import YAML, SchemaCodec
+
+USER_COUNT = 100_000
+CATEGORY_COUNT = 10
+
+
+def build_registration() -> Registration:
+    result = Registration(are_mutually_exclusive_events=True)
+    for number in range(2, CATEGORY_COUNT + 1):
+        result.category_new(f'Category {number}', number)
+    # Filled directly as register checks for duplicates (O(n) per user)
+    for i in range(USER_COUNT):
+        user = UserCustom(10 ** 17 + i, f'user {i}')
+        number = i % CATEGORY_COUNT + 1
+        result.categories[number].users.append(user)
+        result.user_cat_dict[user] = number
+    return result
+
+
+def timed(function):
+    start = perf_counter()
+    result = function()
+    return perf_counter() - start, result
+
+
+def main():
+    registration = build_registration()
+    codecs = {
+        'yaml': YAML,
+        'schema json': SchemaCodec(Registration, SchemaCodec.JSON),
+        'schema binary': SchemaCodec(Registration, SchemaCodec.BINARY),
+    }
+    print(f'{USER_COUNT} users in {CATEGORY_COUNT} categories')
+    print(f'{"codec":<15}{"encode s":>10}{"decode s":>10}{"bytes":>12}')
+    for name, codec in codecs.items():
+        encode_time, text = timed(lambda: codec.encode(registration))
+        decode_time, decoded = timed(lambda: codec.decode(text))
+        assert len(decoded.user_cat_dict) == USER_COUNT
+        print(f'{name:<15}{encode_time:>10.3f}{decode_time:>10.3f}'
+              f'{len(text):>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Compares the cost of setting values in DictPersistent (rewrite everything on
+each set), DictPersistentJournaled (append each set to a journal) and
+DictSQLite (one row per key) for stores of different sizes.
+
+Run from the repository root: python -m benchmarks.bench_dict_persistent
+"""
+import os
+import tempfile
+from time import perf_counter
+
+import yaml
+
+from utils.dict_persistent import DictPersistent, DictPersistentJournaled
+from utils.dict_sqlite import DictSQLite
+
+try:
+    from yaml import CDumper as Dumper
+except ImportError:
+    from yaml import Dumper
+
+STORE_SIZES = [1_000, 10_000, 100_000]
+SETS_PER_RUN = 20
+VALUE = 'x' * 100
+
+
+def create_store_file(fn: str, size: int):
+    with open(fn, 'w') as f:
+        f.write(yaml.dump({f'key{i}': VALUE for i in range(size)},
+                          Dumper=Dumper))
+
+
+def create_sqlite_store(fn: str, size: int) -> DictSQLite:
+    db = DictSQLite(fn)
+    db.write_many({f'key{i}': VALUE for i in range(size)})
+    return db
+
+
+def time_sets(db, size: int) -> float:
+    """
+    Sets SETS_PER_RUN existing keys and makes sure they are on disk
+    :return: Average seconds per set
+    """
+    start = perf_counter()
+    for i in range(SETS_PER_RUN):
+        db[f'key{(i * 7919) % size}'] = f'{VALUE}{i}'
+    db.save()
+    return (perf_counter() - start) / SETS_PER_RUN
+
+
+def main():
+    print(f'{"keys":>8} {"rewrite ms/set":>16} {"journal ms/set":>16} '
+          f'{"sqlite ms/set":>16}')
+    with tempfile.TemporaryDirectory() as dir_name:
+        for size in STORE_SIZES:
+            results = []
+            for constructor in [DictPersistent, DictPersistentJournaled]:
+                fn = os.path.join(dir_name, f'{constructor.__name__}{size}')
+                create_store_file(fn, size)
+                db = constructor(fn)
+                results.append(time_sets(db, size))
+                if isinstance(db, DictPersistentJournaled):
+                    db.close()
+            db = create_sqlite_store(
+                os.path.join(dir_name, f'sqlite{size}'), size)
+            results.append(time_sets(db, size))
+            db.close()
+            print(f'{size:>8}'
+                  + ''.join(f' {x * 1000:>16.3f}' for x in results))
+
+
+if __name__ == '__main__':
+    main()
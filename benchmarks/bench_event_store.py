@@ -0,0 +1,159 @@
+"""
+Compares Alert (an Event dataclass per event in an EventQueue, or in an
+EventColumnQueue with Conf.Alert.EVENT_STORE = 'columns') with
+EventColumns (epoch second int64 arrays, stdlib array and NumPy if
+installed) for the scheduling work done with many events:
+    - build: creating the store from the events
+    - next due: finding the event due first after a change
+    - due: listing every event whose alert is due
+    - catch up: moving every passed event to its next occurrence (events
+        are created with next times from DOWNTIME ago, as if the bot was
+        down)
+    - lead: changing the lead time and finding the events now due
+Memory is the size allocated while building (tracemalloc).
+
+Run from the repository root: python -m benchmarks.bench_event_store
+"""
+import random
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from bot.alert.alert import Alert
+from bot.alert.event import Event
+from bot.alert.event_columns import EventColumns, np
+from bot.common.user_custom import UserCustom
+from conf import Conf
+
+EVENT_COUNTS = [10_000, 100_000]
+DOWNTIME = timedelta(days=3)
+LEAD_TIME = 60  # Minutes
+INTERVALS = [0, 1, 7, 30]  # Days
+
+
+def build_events(count: int, now: datetime) -> list:
+    random.seed(count)
+    user = UserCustom(10 ** 17, 'user')
+    return [Event(i, user, timedelta(days=random.choice(INTERVALS)),
+                  f'Event {i}',
+                  now + timedelta(seconds=random.randint(
+                      -int(DOWNTIME.total_seconds()), 10 ** 7)))
+            for i in range(count)]
+
+
+def measure(function: callable):
+    """
+    :return: Result of function, seconds taken and bytes allocated
+    """
+    tracemalloc.start()
+    start = perf_counter()
+    result = function()
+    elapsed = perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, elapsed, memory
+
+
+def time_it(function: callable) -> float:
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+
+def bench_alert(events: list, now: datetime, store: str) -> dict:
+    def build():
+        Conf.Alert.EVENT_STORE = store
+        result = Alert()
+        result.lead_time = LEAD_TIME
+        for event in events:
+            result.data.add(event.snapshot())  # Changed by catch up
+        result.find_next_event()
+        return result
+
+    alert, build_time, memory = measure(build)
+    lead = timedelta(minutes=LEAD_TIME)
+
+    def next_due():
+        event = alert.data.peek()
+        event.next_time += timedelta(seconds=1)
+        alert.data.update(event)
+        alert.find_next_event()
+
+    def catch_up():
+        # As the alert loop would after downtime (without sending)
+        for event in alert.data.until(now):
+            if event.expired:
+                alert.data.remove(event.id_)
+            else:
+                event.advance_alert_time()
+                alert.data.update(event)
+        alert.find_next_event()
+
+    def lead_change():
+        alert.set_lead_time(2 * LEAD_TIME)
+        alert.data.until(now + 2 * lead)
+
+    return {
+        'build': build_time,
+        'next due': time_it(next_due),
+        'due': time_it(lambda: alert.data.until(now + lead)),
+        'catch up': time_it(catch_up),
+        'lead': time_it(lead_change),
+        'memory': memory,
+    }
+
+
+def bench_columns(events: list, now: datetime, use_numpy: bool) -> dict:
+    columns, build_time, memory = measure(
+        lambda: EventColumns.from_events(events, LEAD_TIME, use_numpy))
+    epoch = int(now.timestamp())
+
+    def next_due():
+        id_, _ = columns.next_due()
+        columns.advance([id_], epoch)
+        columns.next_due()
+
+    def catch_up():
+        for id_ in columns.catch_up(epoch):
+            columns.remove(id_)
+        columns.next_due()
+
+    def lead_change():
+        columns.set_lead_time(2 * LEAD_TIME)
+        columns.due(epoch)
+
+    return {
+        'build': build_time,
+        'next due': time_it(next_due),
+        'due': time_it(lambda: columns.due(epoch)),
+        'catch up': time_it(catch_up),
+        'lead': time_it(lead_change),
+        'memory': memory,
+    }
+
+
+def main():
+    now = datetime.now(timezone.utc)
+    stores = [('Alert', lambda e, n: bench_alert(e, n, 'heap')),
+              ('Alert columns', lambda e, n: bench_alert(e, n, 'columns')),
+              ('EventColumns', lambda e, n: bench_columns(e, n, False))]
+    if np is not None:
+        stores.append(('EventColumns np',
+                       lambda e, n: bench_columns(e, n, True)))
+    else:
+        print('NumPy not installed, only stdlib arrays measured')
+    columns = ['build', 'next due', 'due', 'catch up', 'lead']
+    print('Times in ms, memory in MB')
+    print(f'{"events":>8} {"store":<16}'
+          + ''.join(f'{x:>10}' for x in columns) + f'{"memory":>10}')
+    for count in EVENT_COUNTS:
+        events = build_events(count, now)
+        for name, bench in stores:
+            result = bench(events, now)
+            print(f'{count:>8} {name:<16}'
+                  + ''.join(f'{result[x] * 1000:>10.2f}' for x in columns)
+                  + f'{result["memory"] / 1024 ** 2:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
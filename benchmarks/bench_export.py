@@ -0,0 +1,77 @@
+"""
+Measures export and import throughput for each export format on a
+generated db of several hundred MB. Imports go into an in memory sink that
+supports write_many.
+
+Run from the repository root: python -m benchmarks.bench_export [--mb 300]
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+from utils.export_stream import export, import_
+
+VALUE_BYTES = 1024
+FILE_NAMES = ['export.jsonl', 'export.jsonl.gz', 'export.yaml']
+
+
+class GeneratedDB:
+    """
+    Yields count generated values without keeping them in memory
+    """
+
+    def __init__(self, count: int):
+        self.count = count
+
+    def items(self):
+        for i in range(self.count):
+            yield f'key{i}', f'{i:010d}' * (VALUE_BYTES // 10)
+
+
+class Sink:
+    """
+    Counts the values written without keeping them
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.batches = 0
+
+    def write_many(self, items: dict):
+        self.batches += 1
+        self.count += len(items)
+        self.bytes += sum(len(x) for x in items.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mb', type=int, default=300,
+                        help='Size of the values to export in MB')
+    args = parser.parse_args()
+    count = args.mb * 1024 * 1024 // VALUE_BYTES
+    size_mb = count * VALUE_BYTES / 1024 ** 2
+    print(f'{count} keys, {size_mb:.0f} MB of values')
+    print(f'{"file":<18}{"export MB/s":>12}{"import MB/s":>12}'
+          f'{"file MB":>10}{"batches":>9}')
+    with tempfile.TemporaryDirectory() as directory:
+        for file_name in FILE_NAMES:
+            fn = os.path.join(directory, file_name)
+            start = perf_counter()
+            export(fn, GeneratedDB(count))
+            export_time = perf_counter() - start
+            sink = Sink()
+            start = perf_counter()
+            import_(fn, sink)
+            import_time = perf_counter() - start
+            assert sink.count == count
+            print(f'{file_name:<18}{size_mb / export_time:>12.1f}'
+                  f'{size_mb / import_time:>12.1f}'
+                  f'{os.path.getsize(fn) / 1024 ** 2:>10.1f}'
+                  f'{sink.batches:>9}')
+            os.remove(fn)
+
+
+if __name__ == '__main__':
+    main()
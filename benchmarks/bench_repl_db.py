@@ -0,0 +1,66 @@
+"""
+Compares REPL DB access with one request (and connection) per key, like the
+replit library, against ReplDBClient (pooled keep-alive connections, bulk and
+concurrent requests) using the local stand in server.
+
+Run from the repository root: python -m benchmarks.bench_repl_db
+"""
+import json
+import urllib.request
+from time import perf_counter
+from urllib.parse import quote, urlencode
+
+from utils.repl_db_client import ReplDBClient
+from utils.repl_db_standin import ReplDBStandIn
+
+LATENCY = 0.005  # Seconds added by the server to each request
+KEY_COUNT = 200
+VALUE = 'x' * 1000
+
+
+def naive_set(url: str, key: str, value):
+    body = urlencode({key: json.dumps(value)}).encode()
+    urllib.request.urlopen(url, body).read()
+
+
+def naive_get(url: str, key: str):
+    with urllib.request.urlopen(f'{url}/{quote(key, safe="")}') as response:
+        return json.loads(response.read())
+
+
+def timed(function) -> float:
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+
+def main():
+    server = ReplDBStandIn(latency=LATENCY).start()
+    url = server.url
+    keys = [f'key{i}' for i in range(KEY_COUNT)]
+    items = {key: VALUE for key in keys}
+
+    results = {
+        'naive write': timed(
+            lambda: [naive_set(url, key, VALUE) for key in keys]),
+        'naive read': timed(
+            lambda: [naive_get(url, key) for key in keys]),
+    }
+    client = ReplDBClient(url)
+    results['pooled write_many'] = timed(lambda: client.write_many(items))
+    client = ReplDBClient(url)  # New client so nothing is cached
+    results['pooled sequential read'] = timed(
+        lambda: [client[key] for key in keys])
+    client = ReplDBClient(url)
+    results['pooled prefetch'] = timed(lambda: client.prefetch(keys))
+    client.close()
+
+    print(f'{KEY_COUNT} keys, {LATENCY * 1000:.0f}ms simulated latency')
+    for name, seconds in results.items():
+        print(f'{name:>24}: {seconds * 1000:>8.1f} ms '
+              f'({KEY_COUNT / seconds:>8.0f} keys/s)')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
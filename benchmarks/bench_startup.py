@@ -0,0 +1,124 @@
+"""
+Measures cold start. Reports the import time of the modules imported by
+main.py (python -X importtime) and, for a db holding a large registration,
+the time until the bot could start logging in and until the first command
+is handled with Conf.FAST_START on and off. Commands only arrive once the
+bot has logged in, which is stood in for by waiting LOGIN_SECONDS on the
+loop (the cog data is warmed meanwhile with FAST_START). Each run is a
+fresh process using a local db in a temporary directory.
+
+Run from the repository root: python -m benchmarks.bench_startup
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+USER_COUNT = 50_000
+LOGIN_SECONDS = 0.5  # Connecting to the gateway usually takes longer
+TOP_IMPORTS = 15
+REPEAT = 3
+
+# Run in the child processes (cwd is the temporary directory)
+SETUP_SCRIPT = f'''
+from conf import Conf
+Conf.DB.USE_REPL_DB = False
+from bot.common.user_custom import UserCustom
+from bot.registration.registration import Registration
+from utils.db_cache import DBCache
+from utils.op_log_state import OpLogState
+from utils.repl_support import get_db
+registration = Registration(are_mutually_exclusive_events=True)
+for i in range({USER_COUNT}):
+    user = UserCustom(10 ** 17 + i, f'user {{i}}')
+    registration.categories[1].users.append(user)
+    registration.user_cat_dict[user] = 1
+db = DBCache(get_db())
+OpLogState(db, 'registration', Registration).save(registration)
+db._write_to_backing()
+'''
+
+MEASURE_SCRIPT = f'''
+from time import perf_counter
+start = perf_counter()
+import asyncio
+import sys
+from conf import Conf
+Conf.DB.USE_REPL_DB = False
+Conf.Backup.ENABLED = False
+Conf.FAST_START = sys.argv[1] == 'True'
+import main
+imported = perf_counter()
+from utils.db_cache import DBCache
+bot = main.Bot(db=DBCache(main.get_db()), command_prefix='cb')
+constructed = perf_counter()
+
+
+class Author:
+    id = 1
+
+
+class Context:
+    guild = None
+    author = Author()
+
+    async def send(self, msg):
+        pass
+
+
+async def first_command():
+    await asyncio.sleep({LOGIN_SECONDS})  # Logging in
+    cog = bot.cog_registration
+    ctx = Context()
+    await cog.cog_before_invoke(ctx)  # As invoking the command does
+    await cog.display.callback(cog, ctx)
+
+
+bot.loop.run_until_complete(first_command())
+handled = perf_counter()
+print(imported - start, constructed - start, handled - start)
+'''
+
+
+def run_child(directory: str, *args) -> str:
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    return subprocess.run([sys.executable, *args], cwd=directory, env=env,
+                          check=True, capture_output=True, text=True)
+
+
+def report_imports(directory: str):
+    result = run_child(directory, '-X', 'importtime', '-c', 'import main')
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:  # Only direct imports of main
+            imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+    print('Slowest imports by main.py (cumulative ms):')
+    for cumulative, name in imports[:TOP_IMPORTS]:
+        print(f'{cumulative / 1000:>10.1f}  {name}')
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        report_imports(directory)
+        run_child(directory, '-c', SETUP_SCRIPT)
+        print(f'\n{USER_COUNT} registered users, login taking '
+              f'{LOGIN_SECONDS}s, seconds since process start:')
+        print(f'{"FAST_START":<12}{"imported":>10}{"login can start":>17}'
+              f'{"first command":>15}')
+        for fast_start in (False, True):
+            runs = [[float(x) for x in run_child(
+                directory, '-c', MEASURE_SCRIPT,
+                str(fast_start)).stdout.split()] for _ in range(REPEAT)]
+            # Best of REPEAT for each column
+            imported, constructed, handled = (min(x) for x in zip(*runs))
+            print(f'{str(fast_start):<12}{imported:>10.3f}'
+                  f'{constructed:>17.3f}{handled:>15.3f}')
+
+
+if __name__ == '__main__':
+    main()
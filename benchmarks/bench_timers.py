@@ -0,0 +1,87 @@
+"""
+Schedules TIMER_COUNT timers with the heap based TimerService, cancels half
+of them and waits for the rest to run. Reports the time to schedule and
+cancel, how late the timers ran and the thread count and memory allocated
+while they are pending. For comparison the same is done with one
+threading.Timer per timer (the previous implementation of set_timeout) for
+THREAD_TIMER_COUNT timers as a thread per timer does not scale to
+TIMER_COUNT.
+
+Run from the repository root: python -m benchmarks.bench_timers
+"""
+import threading
+import tracemalloc
+from time import monotonic, perf_counter, sleep
+
+from utils.timer_funcs import TimerService
+
+TIMER_COUNT = 100_000
+THREAD_TIMER_COUNT = 1_000
+DELAY = 2  # Seconds, timers are spread over [DELAY, 2 * DELAY)
+
+
+def run(count: int, schedule: callable):
+    """
+    :param schedule: Called with the delay and the function, returns an
+        object with a cancel method
+    """
+    fired = []
+    lock = threading.Lock()
+
+    def callback(due):
+        late = monotonic() - due
+        with lock:
+            fired.append(late)
+
+    threads_before = threading.active_count()
+    tracemalloc.start()
+    start = perf_counter()
+    handles = []
+    for i in range(count):
+        delay = DELAY + DELAY * i / count
+        handles.append(schedule(delay, callback, monotonic() + delay))
+    scheduled = perf_counter()
+    for handle in handles[::2]:
+        handle.cancel()
+    cancelled = perf_counter()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    threads = threading.active_count() - threads_before
+
+    expected = count - len(handles[::2])
+    deadline = monotonic() + 3 * DELAY + 10
+    while len(fired) < expected and monotonic() < deadline:
+        sleep(0.1)
+    fired.sort()
+    p99 = fired[int(len(fired) * 0.99) - 1] if len(fired) > 0 else 0
+    print(f'{count:>8}{(scheduled - start) * 1e6 / count:>12.2f}'
+          f'{(cancelled - scheduled) * 1e6 / (count - expected):>12.2f}'
+          f'{threads:>10}{memory / count:>12.0f}'
+          f'{len(fired):>8}/{expected:<8}{p99 * 1000:>10.2f}')
+
+
+def schedule_thread(delay, function, due):
+    timer = threading.Timer(delay, function, [due])
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def main():
+    service = TimerService()
+    print('Per timer: schedule and cancel in µs, memory in bytes. Threads '
+          'are those added while pending. p99 lateness in ms')
+    print(f'{"":<16}{"timers":>8}{"schedule":>12}{"cancel":>12}'
+          f'{"threads":>10}{"memory":>12}{"ran":>17}{"p99 late":>10}')
+    print(f'{"TimerService":<16}', end='')
+    run(TIMER_COUNT, lambda delay, function, due: service.schedule(
+        delay, function, [due]))
+    print(f'{"TimerService":<16}', end='')
+    run(THREAD_TIMER_COUNT, lambda delay, function, due: service.schedule(
+        delay, function, [due]))
+    print(f'{"threading.Timer":<16}', end='')
+    run(THREAD_TIMER_COUNT, schedule_thread)
+
+
+if __name__ == '__main__':
+    main()
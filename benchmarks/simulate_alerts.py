@@ -0,0 +1,178 @@
+"""
+Replays a year (see --days) of recurring events through the alert loop in
+simulated time (FakeClock) with a fake channel, so it runs in seconds.
+Reports how late alerts were sent relative to their targets, alerts missed
+or sent twice, the number of sends and wakeups and the CPU used per
+simulated day. Useful to benchmark and regression test scheduling changes
+offline.
+
+Alerts are matched to occurrences by parsing the event name and time from
+the messages (assumes the default Conf.Alert.ALERT_MSG).
+
+Run from the repository root: python -m benchmarks.simulate_alerts
+"""
+import argparse
+import asyncio
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from bot.alert.cog_alert import CogAlert
+from bot.common.user_custom import UserCustom
+from utils.clock import Clock, FakeClock
+from utils.db_cache import DBCache
+
+ALERT_PATTERN = re.compile(r'"(?P<name>[^"]+)" starts at (?P<time>[^\n]+)\.\n')
+INTERVALS = [0, 1, 7, 14, 30]  # Days (0 for once only)
+START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeChannel:
+    def __init__(self, clock: FakeClock, fail_rate: float):
+        self.clock = clock
+        self.fail_rate = fail_rate
+        self.sends = []  # (time, message)
+        self.failures = 0
+
+    async def send(self, msg: str):
+        if random.random() < self.fail_rate:
+            self.failures += 1
+            raise ConnectionError('Simulated failure')
+        self.sends.append((self.clock.now(timezone.utc), msg))
+
+
+class FakeBot:
+    def __init__(self, loop: asyncio.AbstractEventLoop, channel: FakeChannel):
+        self.loop = loop
+        self.channel = channel
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_channel(self, _):
+        return self.channel
+
+    async def fetch_channel(self, _):
+        return self.channel
+
+
+def create_events(cog: CogAlert, count: int, days: int) -> dict:
+    """
+    :return: The occurrences expected before the end as (name, time) -> alert
+        target
+    """
+    user = UserCustom(10 ** 17, 'Simulator')
+    lead = timedelta(minutes=cog.data.lead_time)
+    end = START + timedelta(days=days)
+    expected = {}
+    for i in range(count):
+        name = f'Event {i}'
+        interval = timedelta(days=random.choice(INTERVALS))
+        # Whole minutes so several events share alert targets
+        next_time = START + lead + timedelta(
+            minutes=random.randint(1, 30 * 24 * 60))
+        cog.data.create(user, interval.days, name, next_time)
+        occurrence = next_time
+        while occurrence - lead < end:
+            expected[name, occurrence] = occurrence - lead
+            if interval.days == 0:
+                break
+            occurrence += interval
+    cog.save()
+    cog.wake()
+    return expected
+
+
+async def run(cog: CogAlert, clock: FakeClock, days: int) -> list:
+    """
+    Lets the alert loop run until the end of the simulation
+    :return: CPU seconds used for each simulated day
+    """
+    end = START + timedelta(days=days)
+    cpu_per_day = []
+    last_cpu = time.process_time()
+    while clock.now(timezone.utc) < end \
+            and cog.data.next_alert_target is not None:
+        await asyncio.sleep(0)  # The alert loop sleeps by advancing clock
+        day = (clock.now(timezone.utc) - START).days
+        while len(cpu_per_day) < min(day, days):
+            cpu = time.process_time()
+            cpu_per_day.append(cpu - last_cpu)
+            last_cpu = cpu
+    cog.cog_unload()
+    return cpu_per_day
+
+
+def percentile(values: list, fraction: float) -> float:
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(expected: dict, channel: FakeChannel, clock: FakeClock,
+           cpu_per_day: list, days: int, wall: float):
+    end = START + timedelta(days=days)
+    lateness = []
+    alerted = {}
+    sends_per_day = [0] * days
+    for sent_at, msg in channel.sends:
+        if sent_at >= end:
+            continue
+        sends_per_day[(sent_at - START).days] += 1
+        for match in ALERT_PATTERN.finditer(msg):
+            key = match['name'], datetime.fromisoformat(match['time'])
+            alerted[key] = alerted.get(key, 0) + 1
+            if key in expected:
+                lateness.append((sent_at - expected[key]).total_seconds())
+    missed = [x for x in expected if x not in alerted]
+    duplicates = sum(x - 1 for x in alerted.values())
+    unexpected = [x for x in alerted if x not in expected]
+
+    print(f'Simulated {days} days in {wall:.2f}s')
+    print(f'Alerts expected {len(expected)}, sent {len(lateness)}, missed '
+          f'{len(missed)}, duplicates {duplicates}, unexpected '
+          f'{len(unexpected)}')
+    print(f'Lateness (s): p50 {percentile(lateness, 0.5):.1f} p99 '
+          f'{percentile(lateness, 0.99):.1f} max '
+          f'{max(lateness, default=0):.1f}')
+    print(f'Sends: {sum(sends_per_day)} ({channel.failures} failed), per '
+          f'day mean {sum(sends_per_day) / days:.2f} max '
+          f'{max(sends_per_day)}')
+    print(f'Sleeps (wakeups): {clock.sleeps}, per day '
+          f'{clock.sleeps / days:.1f}')
+    cpu_ms = [x * 1000 for x in cpu_per_day]
+    print(f'CPU per simulated day (ms): mean '
+          f'{sum(cpu_ms) / max(len(cpu_ms), 1):.2f} p99 '
+          f'{percentile(cpu_ms, 0.99):.2f} max {max(cpu_ms, default=0):.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fail-rate', type=float, default=0,
+                        help='Fraction of sends that fail')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    clock = FakeClock(START)
+    Clock.set_instance(clock)
+    channel = FakeChannel(clock, args.fail_rate)
+    db = DBCache({})
+    cog = CogAlert(db, FakeBot(loop, channel))
+    expected = create_events(cog, args.events, args.days)
+
+    start = time.perf_counter()
+    cpu_per_day = loop.run_until_complete(run(cog, clock, args.days))
+    wall = time.perf_counter() - start
+    loop.run_until_complete(db.aclose())
+    report(expected, channel, clock, cpu_per_day, args.days, wall)
+
+
+if __name__ == '__main__':
+    main()
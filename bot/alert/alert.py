@@ -1,87 +1,178 @@
+import copy
 import logging
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import Iterable, Union
 
 from discord.ext import commands
 
 from bot.alert.event import Event
+from bot.alert.event_columns import EventColumnQueue
+from bot.alert.event_queue import EventQueue
 from bot.common.user_custom import UserCustom
 from conf import Conf
+from utils.clock import Clock
 from utils.datetime_sup import make_aware
 from utils.log import log
+from utils.misc import pack_messages
+from utils.op_log_state import OpRecorder
 
 
-class Alert:
+def new_event_queue(events: Iterable[Event] = ()) \
+        -> Union[EventQueue, EventColumnQueue]:
+    """
+    :param events: The events to add
+    :return: A store of the type set in Conf.Alert.EVENT_STORE holding events
+    """
+    if Conf.Alert.EVENT_STORE == 'heap':
+        return EventQueue(events)
+    elif Conf.Alert.EVENT_STORE == 'columns':
+        return EventColumnQueue(events)
+    else:
+        raise ValueError(
+            f'Unknown event store: {Conf.Alert.EVENT_STORE}')
+
+
+class Alert(OpRecorder):
+    SCHEMA_VERSION = 2  # See SchemaCodec
+    SCHEMA_MIGRATIONS = {
+        1: lambda data: {**data, 'events': [
+            Event.SCHEMA_MIGRATIONS[1](x) for x in data['events']]},
+    }
+    PARTITION_TYPES = {'event': Event}  # See PartitionedState
+
     def __init__(self):
         self.lead_time = 60
-        self.data: List[Event] = []
+        self.data = new_event_queue()
         self._next_event = None
         self._next_alert_target = None
         self.next_id = 0
         self.def_tz = Conf.Alert.DEF_TZ
 
     def create(self, user: UserCustom, repeat_interval: int, name: str,
-               next_time: datetime):
+               next_time: datetime, channels: list = None,
+               roles: list = None):
         next_time = make_aware(next_time, self.def_tz)
         if repeat_interval < 0:
             raise commands.errors.UserInputError(
                 f'Repeat interval must be 0 for once only or greater but '
                 f'{repeat_interval} received')
-        self.data.append(
-            Event(self.get_next_id(), user,
-                  timedelta(days=repeat_interval), name,
-                  next_time))
+        event = Event(self.get_next_id(), user,
+                      timedelta(days=repeat_interval), name, next_time,
+                      [] if channels is None else list(channels),
+                      [] if roles is None else list(roles))
+        self.data.add(event)
         self.find_next_event()
+        self.record_op('create', event.to_dict())
 
     def remove(self, id_):
-        element_to_rem = None
-        for event in self.data:
-            if event.id_ is id_:
-                element_to_rem = event
-                break
-        if element_to_rem is None:
+        if self.data.get(id_) is None:
             raise commands.errors.UserInputError(
                 f'No event found with id {id_}')
         else:
-            self.data.remove(element_to_rem)
-            if element_to_rem == self.next_event:
+            element_to_rem = self.data.remove(id_)
+            if element_to_rem is self.next_event:
                 self.find_next_event()
+            self.record_op('rm', id_)
+
+    def set_targets(self, id_, channels: list, roles: list):
+        """
+        Sets the channels alerted and roles mentioned for an event (empty to
+        use the defaults)
+        """
+        event = self.data.get(id_)
+        if event is None:
+            raise commands.errors.UserInputError(
+                f'No event found with id {id_}')
+        if event.channels == list(channels) and event.roles == list(roles):
+            return  # Nothing changed so nothing to record
+        event.channels = list(channels)
+        event.roles = list(roles)
+        event.version += 1
+        self.record_op('targets', id_, event.channels, event.roles)
 
     def set_lead_time(self, value: int):
+        if self.lead_time == value:
+            return  # Nothing changed so nothing to record
         self.lead_time = value
+        self.next_event = self.next_event  # Update the alert target
+        self.record_op('lead', value)
 
     def find_next_event(self):
-        if len(self.data) <= 0:
-            self.next_event = None
-        else:
-            next_event = self.data[0]
-            for event in self.data:
-                if event < next_event:
-                    next_event = event
-            self.next_event = next_event
+        self.next_event = self.data.peek()
 
-    async def check_next_event(self, bot) -> bool:
+    def due_events(self) -> list:
+        """
+        :return: Every event whose alert target has been reached, in the order
+            their alerts are due (each event at most once)
         """
-        Checks to see if the next event should be alerted now
-        :param bot: handle to the bot to use to send the message
-        :return: True if an alert was fired else false
+        return self.data.until(Clock.get_instance().now(self.def_tz)
+                               + timedelta(minutes=self.lead_time))
+
+    async def send_due_alerts(self, delivery) -> int:
         """
-        result = False
+        Sends the alerts of every event that is due (eg. several in the same
+        lead window or after the bot was down) to each event's channels in
+        as few messages per channel as Conf.Alert.MAX_MSG_LEN allows then
+        advances each event once. Events not sent to any of their channels
+        stay due.
+        :param delivery: The AlertDelivery used to send the messages
+        :return: Number of events alerted
+        """
+        now = Clock.get_instance().now(self.def_tz)
+        if self._next_alert_target is None or now < self._next_alert_target:
+            return 0
+        events = self.due_events()
+        by_channel = {}  # channel id -> events
+        for event in events:
+            for channel_id in event.target_channels:
+                by_channel.setdefault(channel_id, []).append(event)
+        texts = {event.id_: event.alert_text() for event in events}
+        messages = {}  # channel id -> messages
+        message_events = {}  # channel id -> events in each message
+        for channel_id, channel_events in by_channel.items():
+            groups = pack_messages([texts[x.id_] for x in channel_events],
+                                   Conf.Alert.MAX_MSG_LEN)
+            messages[channel_id] = ['\n'.join(x) for x in groups]
+            message_events[channel_id] = []
+            for group in groups:
+                message_events[channel_id].append(
+                    channel_events[:len(group)])
+                channel_events = channel_events[len(group):]
+
+        try:
+            sent = await delivery.deliver(messages)
+        except Exception as e:
+            log(f'Exception sending alerts: {e}', logging.ERROR)
+            return 0
+        alerted = set()
+        for channel_id, count in sent.items():
+            for group in message_events[channel_id][:count]:
+                alerted.update(x.id_ for x in group)
+        for event in events:
+            if event.id_ in alerted:
+                # One bad event must not stop the others that were sent
+                # from advancing (they would be alerted again)
+                try:
+                    self._advance(event)
+                except Exception as e:
+                    log(f'Exception advancing event {event.id_}: {e}',
+                        logging.ERROR)
         try:
-            if self._next_alert_target is not None:
-                if datetime.now(self.def_tz) > self._next_alert_target:
-                    channel = bot.get_channel(Conf.Alert.ALERT_CHANNEL_ID)
-                    await channel.send(self.next_event.alert_text())
-                    result = True
-                    self.next_event.advance_alert_time()
-                    if self.next_event.expired:
-                        log(f'Event Expired: {self.next_event}')
-                        self.remove(self.next_event.id_)
-                    self.find_next_event()
-            return result
+            self.find_next_event()
         except Exception as e:
             log(f'Exception checking next event: {e}', logging.ERROR)
-            return False
+        return len(alerted)
+
+    def _advance(self, event: Event):
+        """
+        Moves event to its next occurrence (removed if it does not repeat)
+        """
+        event.advance_alert_time()
+        self.data.update(event)
+        self.record_op('adv', event.id_, event.next_time.isoformat())
+        if event.expired:
+            log(f'Event Expired: {event}')
+            self.remove(event.id_)
 
     def get_next_id(self):
         result = self.next_id
@@ -89,11 +180,10 @@ class Alert:
         return result
 
     def __str__(self):
-        result = f"Bot's time in default timezone is " \
-                 f"{datetime.now(self.def_tz)}\n\n"
+        now = Clock.get_instance().now(self.def_tz)
+        result = f"Bot's time in default timezone is {now}\n\n"
         if self.next_event is not None:
-            time_to_target = self._next_alert_target - datetime.now(
-                self.def_tz)
+            time_to_target = self._next_alert_target - now
             result += f'Next alert at {self._next_alert_target}' \
                       f' for event ID: {self.next_event.id_}' \
                       f' in {time_to_target}\n\n'
@@ -103,6 +193,14 @@ class Alert:
         result += '---'
         return result
 
+    @property
+    def next_alert_target(self) -> datetime:
+        """
+        :return: When the alert for the next event is due (None if there
+            are no events)
+        """
+        return self._next_alert_target
+
     @property
     def next_event(self):
         return self._next_event
@@ -116,6 +214,70 @@ class Alert:
             self._next_alert_target = self.next_event.next_time \
                                       - timedelta(minutes=self.lead_time)
 
+    def snapshot(self) -> 'Alert':
+        """
+        Returns a copy that will not be affected by later changes (eg. to be
+        saved on another thread).
+        """
+        result = copy.copy(self)
+        # Events are changed in place when they fire so they are copied
+        events = {event.id_: event.snapshot() for event in self.data}
+        result.data = new_event_queue(events.values())
+        if self.next_event is not None:
+            result._next_event = events[self.next_event.id_]
+        return result
+
+    def to_dict(self) -> dict:
+        """
+        :return: The alerts as plain values (see SchemaCodec)
+        """
+        return {**self.root_dict(),
+                'events': [event.to_dict() for event in self.data]}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Alert':
+        result = cls()
+        result.lead_time = data['lead_time']
+        result.next_id = data['next_id']
+        result.def_tz = timezone(timedelta(seconds=data['def_tz']))
+        result.data = new_event_queue(Event.from_dict(event)
+                                      for event in data['events'])
+        result.find_next_event()
+        return result
+
+    def partitions(self) -> dict:
+        """
+        :return: Events by partition name (see PartitionedState)
+        """
+        return {f'event/{event.id_}': event for event in self.data}
+
+    def root_dict(self) -> dict:
+        """
+        :return: Fields not saved with the events (see PartitionedState)
+        """
+        return {
+            'lead_time': self.lead_time,
+            'next_id': self.next_id,
+            'def_tz': self.def_tz.utcoffset(None).total_seconds(),
+        }
+
+    @classmethod
+    def from_partitions(cls, root: dict, partitions: dict) -> 'Alert':
+        result = cls()
+        result.lead_time = root['lead_time']
+        result.next_id = root['next_id']
+        result.def_tz = timezone(timedelta(seconds=root['def_tz']))
+        result.data = new_event_queue(
+            sorted(partitions.values(), key=lambda x: x.id_))
+        result.find_next_event()
+        return result
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not isinstance(self.data, (EventQueue, EventColumnQueue)):
+            # Saved when events were kept in a list (or CowList)
+            self.data = new_event_queue(self.data)
+
     def set_def_tz(self, tz_offset_hours, tz_offset_minutes):
         if abs(tz_offset_hours) >= 24:
             raise commands.errors.UserInputError(
@@ -125,5 +287,38 @@ class Alert:
             raise commands.errors.UserInputError(
                 f'Minutes must be in range -59 to 59 but {tz_offset_minutes} '
                 f'received')
-        self.def_tz = timezone(
+        tz = timezone(
             timedelta(hours=tz_offset_hours, minutes=tz_offset_minutes))
+        if tz == self.def_tz:
+            return  # Nothing changed so nothing to record
+        self.def_tz = tz
+        self.record_op('tz', self.def_tz.utcoffset(None).total_seconds())
+
+    def apply(self, op):
+        """
+        Applies an operation recorded by this class (see OpRecorder)
+        """
+        name, *args = op
+        if name == 'create':
+            # Operations recorded before events had targets lack them
+            event = Event.from_dict({'channels': [], 'roles': [], **args[0]})
+            self.data.add(event)
+            self.next_id = max(self.next_id, event.id_ + 1)
+            self.find_next_event()
+        elif name == 'rm':
+            self.remove(args[0])
+        elif name == 'adv':
+            event = self.data.get(args[0])
+            if event is not None:
+                event.next_time = datetime.fromisoformat(args[1])
+                event.version += 1
+                self.data.update(event)
+            self.find_next_event()
+        elif name == 'targets':
+            self.set_targets(*args)
+        elif name == 'lead':
+            self.set_lead_time(args[0])
+        elif name == 'tz':
+            self.def_tz = timezone(timedelta(seconds=args[0]))
+        else:
+            raise ValueError(f'Unknown operation: {op}')
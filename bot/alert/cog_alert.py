@@ -1,12 +1,18 @@
+import asyncio
+import logging
 from datetime import datetime
+from typing import Union
 
-from discord.ext import commands, tasks
+import discord
+from discord.ext import commands
 
 from bot.alert.alert import Alert
+from bot.alert.delivery import AlertDelivery
 from bot.common.cog_common import CogCommon
 from bot.common.user_custom import UserCustom
 from conf import Conf, DBKeys
 from utils import db_cache
+from utils.clock import Clock
 from utils.log import log
 
 conf = Conf.Alert
@@ -20,21 +26,89 @@ class CogAlert(CogCommon, name='Alert'):
         super().__init__(db, conf=conf, db_key=DBKeys.ALERT,
                          data_def_constructor=Alert)
         self.bot = bot
-        self.poll_events.start()
+        self.delivery = AlertDelivery(bot)
+        self._wake_event = asyncio.Event()
+        self._alert_task = self.bot.loop.create_task(self.alert_loop())
 
-    @tasks.loop(seconds=conf.ALERT_POLL_INTERVAL)
-    async def poll_events(self):
-        if await self.data.check_next_event(self.bot):
-            # Save if an alert was sent
-            self.save()
-        if self.data.next_event is None:
-            log('No pending Alerts - Polling Stopping')
-            self.poll_events.cancel()
+    def cog_unload(self):
+        self._alert_task.cancel()
+
+    def wake(self):
+        """
+        Makes alert_loop check the next alert target again (call after the
+        events, lead time or timezone change)
+        """
+        self._wake_event.set()
+
+    async def _sleep(self, seconds: float):
+        """
+        Sleeps until seconds pass or wake is called
+        """
+        await Clock.get_instance().wait(self._wake_event, seconds)
+
+    @staticmethod
+    def _sleep_time(delay: float) -> float:
+        """
+        Targets up to conf.ALERT_EXACT_SLEEP away are slept to directly.
+        Longer waits stop halfway (but not closer than ALERT_EXACT_SLEEP) to
+        check the wall clock again, so drift from the monotonic clock or a
+        clock change is corrected with a few wakeups per target (about
+        log2(delay / ALERT_EXACT_SLEEP)) instead of polling. Drift is then
+        only left uncorrected over the last ALERT_EXACT_SLEEP seconds.
+        :param delay: Seconds left until the target (wall clock)
+        :return: Seconds to sleep
+        """
+        if delay <= conf.ALERT_EXACT_SLEEP:
+            return delay
+        return max(delay / 2, conf.ALERT_EXACT_SLEEP)
+
+    async def alert_loop(self):
+        """
+        Sleeps until the next alert is due then sends it. Does not wake while
+        there are no events.
 
-    @poll_events.before_loop
-    async def before_poll_alerts(self):
+        The sleep is measured on the loop's monotonic clock but targets are
+        wall clock times, so the time left is worked out again from the wall
+        clock after every wake (see _sleep_time). Time is read and slept
+        through Clock so the loop can run in simulated time.
+
+        Exceptions are logged and the loop continues after
+        conf.ALERT_RETRY_DELAY so one failure does not stop all alerts.
+        """
         await self.bot.wait_until_ready()
-        log('Poll Alerts Loop Started')
+        await self.warm()
+        log('Alert Loop Started')
+        while True:
+            try:
+                await self._alert_loop_step()
+            except Exception as e:
+                log(f'Exception in alert loop: {e!r}', logging.ERROR)
+                await self._sleep(conf.ALERT_RETRY_DELAY)
+
+    async def _alert_loop_step(self):
+        """
+        Waits for the next alert target (or a wake) and sends the alerts due
+        """
+        self._wake_event.clear()
+        target = self.data.next_alert_target
+        if target is None:
+            log('No pending Alerts - Waiting for a new event', logging.DEBUG)
+            await Clock.get_instance().wait(self._wake_event)
+            return
+        delay = (target - Clock.get_instance().now(target.tzinfo)) \
+            .total_seconds()
+        if delay > 0:
+            await self._sleep(self._sleep_time(delay))
+            return
+        count = await self.data.send_due_alerts(self.delivery)
+        if count > 0:
+            # Save once for all the alerts sent
+            self.save()
+            log(f'{count} alerts sent, first {-delay:.3f} seconds after '
+                f'target', logging.DEBUG)
+        elif self.data.next_alert_target == target:
+            # Failed to send, wait before trying again
+            await self._sleep(conf.ALERT_RETRY_DELAY)
 
     ##########################################################################
     # BASE GROUP
@@ -46,41 +120,60 @@ class CogAlert(CogCommon, name='Alert'):
     # NORMAL COMMANDS
     @base.command(**conf.Command.DISPLAY)
     async def display(self, ctx):
-        await self.send_data_str(ctx,
-                                 f'Alerts sent {self.data.lead_time} minutes '
-                                 f'before event.')
+        await self.send_display(ctx,
+                                f'Alerts sent {self.data.lead_time} minutes '
+                                f'before event.')
 
     ##########################################################################
     # PRIVILEGED COMMANDS
     @base.command(**conf.Command.CREATE)
     @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
     async def create(self, ctx, interval_in_days: int, next_time: str,
-                     name: str):
+                     name: str,
+                     *targets: Union[discord.TextChannel, discord.Role]):
         next_time = datetime.fromisoformat(next_time)
+        channels, roles = self.split_targets(targets)
         self.data.create(
             UserCustom.get_user_custom(ctx.author),
             interval_in_days,
             name,
-            next_time)
+            next_time,
+            channels,
+            roles)
         self.save()
+        self.wake()
         await self.send_data_str(ctx, f'New event "{name}" added.')
 
-        # Ensure the timer is started
-        if not self.poll_events.is_running():
-            self.poll_events.start()
-
     @base.command(**conf.Command.REMOVE)
     @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
     async def remove(self, ctx, alert_id: int):
         self.data.remove(alert_id)
         self.save()
+        self.wake()
         await self.send_data_str(ctx, f'Alert With ID: {alert_id} removed')
 
+    @base.command(**conf.Command.SET_TARGETS)
+    @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
+    async def set_targets(self, ctx, alert_id: int,
+                          *targets: Union[discord.TextChannel, discord.Role]):
+        self.data.set_targets(alert_id, *self.split_targets(targets))
+        self.save()
+        await self.send_data_str(ctx, f'Targets of {alert_id} updated')
+
+    @staticmethod
+    def split_targets(targets) -> tuple:
+        """
+        :return: Ids of the channels and of the roles in targets
+        """
+        return [x.id for x in targets if isinstance(x, discord.TextChannel)], \
+               [x.id for x in targets if isinstance(x, discord.Role)]
+
     @base.command(**conf.Command.SET_LEAD)
     @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
     async def set_lead(self, ctx, lead_time_in_min: int):
         self.data.set_lead_time(lead_time_in_min)
         self.save()
+        self.wake()
         await ctx.send(
             f'Lead time set to {lead_time_in_min} minutes before the event')
 
@@ -90,4 +183,20 @@ class CogAlert(CogCommon, name='Alert'):
                      tz_offset_minutes: int = 0):
         self.data.set_def_tz(tz_offset_hours, tz_offset_minutes)
         self.save()
+        self.wake()
         await self.send_data_str(ctx, f'Timezone updated')
+
+    @base.command(**conf.Command.HISTORY)
+    @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
+    async def history(self, ctx, count: int = 10):
+        await self.send_history(ctx, count)
+
+    @base.command(**conf.Command.RESTORE)
+    @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
+    async def restore_cmd(self, ctx, seq: int, confirm: bool = False):
+        if not await self.should_exec(ctx, confirm):
+            return
+
+        self.restore(seq)
+        self.wake()
+        await self.send_data_str(ctx, f'Restored to {seq}')
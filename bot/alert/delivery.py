@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from collections import deque
+
+import discord
+
+from conf import Conf
+from utils.clock import Clock
+from utils.log import log
+
+conf = Conf.Alert
+
+
+class ChannelStats:
+    __slots__ = ('sent', 'failed', 'retries', 'latencies')
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        # Seconds from the start of a delivery to each message being sent
+        self.latencies = deque(maxlen=conf.LATENCY_HISTORY)
+
+    def __str__(self):
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] if len(latencies) > 0 else 0
+        worst = latencies[-1] if len(latencies) > 0 else 0
+        return f'sent={self.sent} failed={self.failed} ' \
+               f'retries={self.retries} p50={p50:.3f}s max={worst:.3f}s'
+
+
+class AlertDelivery:
+    """
+    Sends messages to several channels at once. Each channel is sent to
+    from its own task so a slow or failing channel does not hold up the
+    others. Per channel:
+        - Messages are sent in order, at most one every
+            conf.CHANNEL_SEND_INTERVAL seconds
+        - A failed send is retried up to conf.SEND_RETRIES times with
+            exponential backoff (conf.SEND_BACKOFF doubled each retry) and
+            each attempt times out after conf.SEND_TIMEOUT seconds
+        - Channel objects are cached (fetched from the API if not in the
+            client's cache)
+        - Counts and delivery latencies are kept (see stats)
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.stats = {}  # channel id -> ChannelStats
+        self._channels = {}  # channel id -> channel
+        self._locks = {}  # channel id -> asyncio.Lock
+        self._last_send = {}  # channel id -> Clock monotonic time of send
+
+    async def get_channel(self, channel_id: int):
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                channel = await self.bot.fetch_channel(channel_id)
+            self._channels[channel_id] = channel
+        return channel
+
+    async def deliver(self, messages: dict) -> dict:
+        """
+        Sends the messages for every channel concurrently
+        :param messages: channel id -> list of messages (sent in order)
+        :return: channel id -> number of messages sent (sending to a channel
+            stops at the first message that could not be sent)
+        """
+        start = Clock.get_instance().monotonic()
+        channel_ids = list(messages.keys())
+        counts = await asyncio.gather(
+            *(self._deliver_to(x, messages[x], start) for x in channel_ids))
+        return dict(zip(channel_ids, counts))
+
+    async def _deliver_to(self, channel_id: int, messages: list,
+                          start: float) -> int:
+        stats = self.stats.setdefault(channel_id, ChannelStats())
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        async with lock:  # Keep messages to a channel in order
+            for i, msg in enumerate(messages):
+                if not await self._send(channel_id, msg, stats):
+                    stats.failed += len(messages) - i
+                    return i
+                stats.sent += 1
+                stats.latencies.append(
+                    Clock.get_instance().monotonic() - start)
+        log(f'[Alert] Channel {channel_id}: {stats}', logging.DEBUG)
+        return len(messages)
+
+    async def _send(self, channel_id: int, msg: str,
+                    stats: ChannelStats) -> bool:
+        """
+        :return: True if sent (retrying as needed) else False
+        """
+        clock = Clock.get_instance()
+        for attempt in range(conf.SEND_RETRIES + 1):
+            if attempt > 0:
+                stats.retries += 1
+                await clock.sleep(conf.SEND_BACKOFF * 2 ** (attempt - 1))
+            wait = self._last_send.get(channel_id, float('-inf')) \
+                + conf.CHANNEL_SEND_INTERVAL - clock.monotonic()
+            if wait > 0:
+                await clock.sleep(wait)
+            try:
+                channel = await self.get_channel(channel_id)
+                self._last_send[channel_id] = clock.monotonic()
+                await asyncio.wait_for(channel.send(msg), conf.SEND_TIMEOUT)
+                return True
+            except (discord.NotFound, discord.Forbidden) as e:
+                # Retrying will not help
+                self._channels.pop(channel_id, None)
+                log(f'[Alert] Unable to send to channel {channel_id}: {e}',
+                    logging.ERROR)
+                return False
+            except Exception as e:
+                self._channels.pop(channel_id, None)
+                log(f'[Alert] Send to channel {channel_id} failed (attempt '
+                    f'{attempt + 1}): {e!r}', logging.WARNING)
+        return False
@@ -1,9 +1,10 @@
-from dataclasses import dataclass
+import copy
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta, tzinfo
-from math import ceil
 
 from bot.common.user_custom import UserCustom
 from conf import Conf
+from utils.clock import Clock
 
 
 @dataclass
@@ -13,32 +14,88 @@ class Event:
     repeat_interval: timedelta  # Interval in days
     name: str
     next_time: datetime
+    # Ids of the channels alerted and roles mentioned (Conf.Alert defaults
+    # used if empty)
+    channels: list = field(default_factory=list)
+    roles: list = field(default_factory=list)
+    SCHEMA_VERSION = 2  # See SchemaCodec
+    SCHEMA_MIGRATIONS = {
+        1: lambda data: {**data, 'channels': [], 'roles': []},
+    }
+    version = 0  # Incremented on every change (not a dataclass field)
+
+    def to_dict(self) -> dict:
+        """
+        :return: The event as plain values (see SchemaCodec)
+        """
+        return {
+            'id': self.id_,
+            'created_by': self.created_by.to_list(),
+            'repeat_interval': self.repeat_interval.total_seconds(),
+            'name': self.name,
+            'next_time': None if self.next_time is None
+            else self.next_time.isoformat(),
+            'channels': self.channels,
+            'roles': self.roles,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'Event':
+        return Event(
+            data['id'],
+            UserCustom.from_list(data['created_by']),
+            timedelta(seconds=data['repeat_interval']),
+            data['name'],
+            None if data['next_time'] is None
+            else datetime.fromisoformat(data['next_time']),
+            list(data['channels']),
+            list(data['roles']))
+
+    def __setstate__(self, state):
+        # Saved before events had targets
+        self.__dict__.update({'channels': [], 'roles': [], **state})
 
     def __lt__(self, other):
         if isinstance(other, Event):
             return self.next_time < other.next_time
         return NotImplemented
 
+    @property
+    def target_channels(self) -> list:
+        return self.channels if len(self.channels) > 0 \
+            else [Conf.Alert.ALERT_CHANNEL_ID]
+
+    @property
+    def target_roles(self) -> list:
+        return self.roles if len(self.roles) > 0 \
+            else [Conf.Alert.ALERT_ROLE_ID]
+
     def alert_text(self):
         return Conf.Alert.ALERT_MSG.substitute(
+            roles=' '.join(f'<@&{x}>' for x in self.target_roles),
             event_name=self.name,
             next_time=self.next_time,
-            time_delta=self.next_time - datetime.now(self.tz),
+            time_delta=self.next_time - Clock.get_instance().now(self.tz),
             final_notice=
             '' if not self.expired else
             ' (FINAL OCCURRENCE)')
 
+    def snapshot(self) -> 'Event':
+        result = copy.copy(self)
+        result.channels = list(self.channels)
+        result.roles = list(self.roles)
+        return result
+
     def advance_alert_time(self):
+        self.version += 1
         if not self.expired:
             self.next_time += self.repeat_interval
-            if self.next_time < datetime.now(self.tz):
-                diff = datetime.now(self.tz) - self.next_time
-                multiple = ceil(
-                    diff.total_seconds() /
-                    self.repeat_interval.total_seconds())
-                temp = self.repeat_interval * multiple
-                self.next_time += temp
-                assert self.next_time > datetime.now(self.tz)
+            now = Clock.get_instance().now(self.tz)
+            if self.next_time <= now:
+                # First occurrence after now (exact timedelta arithmetic)
+                multiple = (now - self.next_time) // self.repeat_interval + 1
+                self.next_time += self.repeat_interval * multiple
+                assert self.next_time > now
 
     @property
     def expired(self):
@@ -49,6 +106,11 @@ class Event:
         return None if self.next_time is None else self.next_time.tzinfo
 
     def __str__(self):
-        return f'ID: {self.id_}, "{self.name}" every ' \
-               f'{self.repeat_interval.days} days. Next occurs at ' \
-               f'{self.next_time}'
+        result = f'ID: {self.id_}, "{self.name}" every ' \
+                 f'{self.repeat_interval.days} days. Next occurs at ' \
+                 f'{self.next_time}'
+        if len(self.channels) > 0:
+            result += f' in {", ".join(f"<#{x}>" for x in self.channels)}'
+        if len(self.roles) > 0:
+            result += f' for {", ".join(f"<@&{x}>" for x in self.roles)}'
+        return result
@@ -0,0 +1,302 @@
+from array import array
+from datetime import datetime
+from itertools import compress
+from typing import Iterable, Optional, Tuple
+
+from bot.alert.event import Event
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class EventColumns:
+    """
+    Alternative store for the scheduling data of very many events (tens or
+    hundreds of thousands). Instead of an Event object per event the ids,
+    next times, repeat intervals and alert targets are kept in int64 arrays
+    (stdlib array, times as epoch seconds) so whole columns are updated at
+    once:
+        - due: ids of every event whose alert target has passed
+        - catch_up: moves every passed event to its next occurrence (eg.
+            after downtime)
+        - set_lead_time: recomputes every alert target
+    With NumPy installed these work on zero copy views of the arrays,
+    without it they use the C loops of the builtins (min, index, compress,
+    map) over the arrays.
+
+    Rows are in no particular order (removing swaps the last row in) and are
+    found by id through a dict.
+
+    NB: Only the scheduling fields are kept, names etc. stay with the events
+    (see EventColumnQueue to use it as the store of Alert)
+    """
+
+    def __init__(self, lead_time: int = 60, use_numpy: bool = None):
+        """
+        :param lead_time: Minutes before an event that its alert is due
+        :param use_numpy: Use NumPy (Default: if installed)
+        """
+        if use_numpy and np is None:
+            raise ValueError('NumPy is not installed')
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        self.lead_seconds = lead_time * 60
+        self._ids = array('q')
+        self._next_times = array('q')
+        self._intervals = array('q')  # 0 for events that do not repeat
+        self._targets = array('q')  # next time - lead
+        self._rows = {}  # id -> row
+
+    @classmethod
+    def from_events(cls, events: Iterable[Event], lead_time: int = 60,
+                    use_numpy: bool = None) -> 'EventColumns':
+        result = cls(lead_time, use_numpy)
+        for event in events:
+            result.add(event.id_, int(event.next_time.timestamp()),
+                       int(event.repeat_interval.total_seconds()))
+        return result
+
+    def add(self, id_: int, next_time: int, interval: int):
+        """
+        :param id_: Id of the event
+        :param next_time: When the event next occurs (epoch seconds)
+        :param interval: Seconds between occurrences (0 for once only)
+        """
+        if id_ in self._rows:
+            raise ValueError(f'Event {id_} already added')
+        self._rows[id_] = len(self._ids)
+        self._ids.append(id_)
+        self._next_times.append(next_time)
+        self._intervals.append(interval)
+        self._targets.append(next_time - self.lead_seconds)
+
+    def remove(self, id_: int):
+        """
+        :raises KeyError: If no event has the id
+        """
+        row = self._rows.pop(id_)
+        last = len(self._ids) - 1
+        for column in self._columns():
+            value = column.pop()
+            if row != last:
+                column[row] = value  # Last row moved into the gap
+        if row != last:
+            self._rows[self._ids[row]] = row
+
+    def _columns(self) -> tuple:
+        return self._ids, self._next_times, self._intervals, self._targets
+
+    def _views(self) -> tuple:
+        """
+        NumPy arrays sharing memory with the columns. NB: The columns can not
+        change size while a view exists
+        """
+        return tuple(np.frombuffer(x, dtype=np.int64)
+                     for x in self._columns())
+
+    def next_time(self, id_: int) -> int:
+        return self._next_times[self._rows[id_]]
+
+    def set_next_time(self, id_: int, next_time: int):
+        """
+        :param next_time: When the event next occurs (epoch seconds)
+        :raises KeyError: If no event has the id
+        """
+        row = self._rows[id_]
+        self._next_times[row] = next_time
+        self._targets[row] = next_time - self.lead_seconds
+
+    def next_due(self) -> Optional[Tuple[int, int]]:
+        """
+        :return: The id and alert target of the event due first or None if
+            there are no events
+        """
+        if len(self._ids) == 0:
+            return None
+        if self.use_numpy:
+            *_, targets = self._views()
+            row = int(targets.argmin())
+        else:
+            row = self._targets.index(min(self._targets))
+        return self._ids[row], self._targets[row]
+
+    def due(self, now: int) -> list:
+        """
+        :param now: Current time (epoch seconds)
+        :return: Ids of the events whose alert target is not after now
+        """
+        if len(self._ids) == 0:
+            return []
+        if self.use_numpy:
+            ids, _, _, targets = self._views()
+            return ids[targets <= now].tolist()
+        return list(compress(self._ids, map(now.__ge__, self._targets)))
+
+    def set_lead_time(self, lead_time: int):
+        """
+        Recomputes the alert targets
+        :param lead_time: Minutes before an event that its alert is due
+        """
+        self.lead_seconds = lead_time * 60
+        if self.use_numpy and len(self._ids) > 0:
+            _, next_times, _, targets = self._views()
+            np.subtract(next_times, self.lead_seconds, out=targets)
+        else:
+            self._targets = array('q', map((-self.lead_seconds).__add__,
+                                           self._next_times))
+
+    def advance(self, ids: Iterable[int], now: int):
+        """
+        Moves the events to their next occurrence after now (at least one
+        interval on), like Event.advance_alert_time
+        :param ids: Ids of the events (eg. after their alerts were sent)
+        :param now: Current time (epoch seconds)
+        :return: Ids of the events that did not repeat (left unchanged for
+            the caller to remove)
+        """
+        rows = [self._rows[x] for x in ids]
+        if len(rows) == 0:
+            return []
+        return self._advance_rows(rows, now, at_least_once=True)
+
+    def catch_up(self, now: int) -> list:
+        """
+        Moves every repeating event whose next time has passed to its first
+        occurrence after now (eg. after the bot was down)
+        :param now: Current time (epoch seconds)
+        :return: Ids of the passed events that do not repeat
+        """
+        if len(self._ids) == 0:
+            return []
+        if self.use_numpy:
+            _, next_times, _, _ = self._views()
+            rows = np.nonzero(next_times <= now)[0]
+        else:
+            rows = list(compress(range(len(self._ids)),
+                                 map(now.__ge__, self._next_times)))
+        return self._advance_rows(rows, now, at_least_once=False)
+
+    def _advance_rows(self, rows, now: int, at_least_once: bool) -> list:
+        """
+        :param at_least_once: If False rows with next time after now are not
+            changed
+        """
+        lead = self.lead_seconds
+        if self.use_numpy:
+            ids, next_times, intervals, targets = self._views()
+            rows = np.asarray(rows, dtype=np.int64)
+            row_intervals = intervals[rows]
+            repeats = row_intervals > 0
+            expired = ids[rows[~repeats]].tolist()
+            rows, row_intervals = rows[repeats], row_intervals[repeats]
+            behind = np.maximum(now - next_times[rows], -1)
+            steps = behind // row_intervals + 1
+            if at_least_once:
+                steps = np.maximum(steps, 1)
+            next_times[rows] += steps * row_intervals
+            targets[rows] = next_times[rows] - lead
+            return expired
+
+        expired = []
+        next_times, intervals = self._next_times, self._intervals
+        for row in rows:
+            interval = intervals[row]
+            if interval == 0:
+                expired.append(self._ids[row])
+                continue
+            steps = max(now - next_times[row], -1) // interval + 1
+            if at_least_once and steps < 1:
+                steps = 1
+            next_times[row] += steps * interval
+            self._targets[row] = next_times[row] - lead
+        return expired
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, id_: int):
+        return id_ in self._rows
+
+
+class EventColumnQueue:
+    """
+    EventQueue backed by EventColumns (selected with Conf.Alert.EVENT_STORE,
+    see Alert). The events are kept by id for lookups and iteration and
+    their next times in the columns (lead time 0) for scheduling. Adding,
+    updating and removing are O(1) but peek scans the column (O(n) through
+    the C loops or NumPy). It saves the memory of the heap entries of
+    EventQueue (see benchmarks/bench_event_store.py for the trade off).
+
+    NB: update must be called after an event's next_time is changed
+    """
+
+    def __init__(self, events: Iterable[Event] = ()):
+        self._events = {}  # id -> Event
+        self._columns = EventColumns(lead_time=0)
+        for event in events:
+            self.add(event)
+
+    def add(self, event: Event):
+        """
+        Adds event (replacing any event with the same id)
+        """
+        if event.id_ in self._events:
+            self.remove(event.id_)
+        self._events[event.id_] = event
+        self._columns.add(event.id_, self._epoch(event.next_time),
+                          int(event.repeat_interval.total_seconds()))
+
+    def update(self, event: Event):
+        """
+        Reorders event after its next_time changed
+        """
+        self._columns.set_next_time(event.id_, self._epoch(event.next_time))
+
+    def remove(self, id_: int) -> Event:
+        """
+        :return: The event removed
+        :raises KeyError: If no event has the id
+        """
+        event = self._events.pop(id_)
+        self._columns.remove(id_)
+        return event
+
+    def get(self, id_: int) -> Optional[Event]:
+        return self._events.get(id_)
+
+    def peek(self) -> Optional[Event]:
+        """
+        :return: The event with the earliest next_time or None if empty
+        """
+        due = self._columns.next_due()
+        if due is None:
+            return None
+        # Several events can share the earliest second
+        candidates = self._columns.due(due[1])
+        return min((self._events[x] for x in candidates),
+                   key=lambda x: (x.next_time, x.id_))
+
+    def until(self, time: datetime) -> list:
+        """
+        :return: Events with next_time at or before time, earliest first
+        """
+        # The columns only have whole seconds so the last second is checked
+        # against the exact times
+        result = [self._events[x] for x in self._columns.due(
+            self._epoch(time))]
+        return sorted((x for x in result if x.next_time <= time),
+                      key=lambda x: (x.next_time, x.id_))
+
+    @staticmethod
+    def _epoch(time: datetime) -> int:
+        """
+        :return: time as whole epoch seconds (rounded down)
+        """
+        return int(time.timestamp() // 1)
+
+    def __iter__(self):
+        return iter(self._events.values())
+
+    def __len__(self):
+        return len(self._events)
@@ -0,0 +1,107 @@
+import heapq
+from datetime import datetime
+from typing import Iterable, Optional
+
+from bot.alert.event import Event
+
+
+class EventQueue:
+    """
+    Events indexed by id and ordered by next_time. Adding, updating and
+    removing are O(log n), the next event is O(1) (amortized) and lookups by
+    id are O(1). Iteration is in the order the events were added.
+
+    Uses lazy deletion: removing or updating an event only replaces its
+    entry in the index and the old heap entry is skipped when it reaches the
+    top. The heap is rebuilt if stale entries outnumber the events.
+
+    NB: update must be called after an event's next_time is changed
+    """
+    COMPACT_MIN_STALE = 64
+
+    def __init__(self, events: Iterable[Event] = ()):
+        self._events = {}  # id -> Event
+        self._stamps = {}  # id -> stamp of the valid heap entry
+        self._heap = []  # (next_time, id, stamp)
+        self._next_stamp = 0
+        for event in events:
+            self.add(event)
+
+    def add(self, event: Event):
+        """
+        Adds event (replacing any event with the same id)
+        """
+        self._events[event.id_] = event
+        self._push(event)
+
+    def update(self, event: Event):
+        """
+        Reorders event after its next_time changed
+        """
+        self._push(event)
+
+    def remove(self, id_: int) -> Event:
+        """
+        :return: The event removed
+        :raises KeyError: If no event has the id
+        """
+        event = self._events.pop(id_)
+        del self._stamps[id_]
+        self._maybe_compact()
+        return event
+
+    def get(self, id_: int) -> Optional[Event]:
+        return self._events.get(id_)
+
+    def peek(self) -> Optional[Event]:
+        """
+        :return: The event with the earliest next_time or None if empty
+        """
+        heap = self._heap
+        while len(heap) > 0:
+            _, id_, stamp = heap[0]
+            if self._stamps.get(id_) == stamp:
+                return self._events[id_]
+            heapq.heappop(heap)
+        return None
+
+    def until(self, time: datetime) -> list:
+        """
+        :return: Events with next_time at or before time, earliest first.
+            Only the heap entries up to time are visited (O(k log k) for k
+            events)
+        """
+        heap = self._heap
+        result = []
+        candidates = [] if len(heap) == 0 else [(heap[0], 0)]
+        while len(candidates) > 0:
+            entry, i = heapq.heappop(candidates)
+            if entry[0] > time:
+                continue  # Children are not earlier
+            _, id_, stamp = entry
+            if self._stamps.get(id_) == stamp:
+                result.append(self._events[id_])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(candidates, (heap[child], child))
+        return result
+
+    def _push(self, event: Event):
+        stamp = self._next_stamp
+        self._next_stamp += 1
+        self._stamps[event.id_] = stamp
+        heapq.heappush(self._heap, (event.next_time, event.id_, stamp))
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        stale = len(self._heap) - len(self._events)
+        if stale > self.COMPACT_MIN_STALE and stale > len(self._events):
+            self._heap = [x for x in self._heap
+                          if self._stamps.get(x[1]) == x[2]]
+            heapq.heapify(self._heap)
+
+    def __iter__(self):
+        return iter(self._events.values())
+
+    def __len__(self):
+        return len(self._events)
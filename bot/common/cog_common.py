@@ -1,10 +1,16 @@
+import asyncio
 import logging
 from abc import abstractmethod
 
 from discord.ext import commands
 
+from conf import Conf
 from utils import db_cache
+from utils.codec import SchemaCodec
+from utils.keyed_scheduler import KeyedScheduler, TokenBucket
 from utils.log import log
+from utils.op_log_state import OpLogState, OpRecorder
+from utils.partitioned_state import PartitionedState
 
 
 class CogCommon(commands.Cog):
@@ -13,8 +19,67 @@ class CogCommon(commands.Cog):
         self.data_def_constructor = data_def_constructor
         self.db_key = db_key
         self.db = db
+        self.codec = None if data_def_constructor is None \
+            else SchemaCodec(data_def_constructor)
+        # Saves changes only if supported (see Conf.DB.COG_STATE)
+        self.state = None
+        if db_key is not None and Conf.DB.COG_STATE != 'whole' \
+                and hasattr(data_def_constructor, 'PARTITION_TYPES'):
+            self.state = PartitionedState(db, db_key, data_def_constructor)
+        if db_key is not None and Conf.DB.COG_STATE == 'oplog' \
+                and hasattr(data_def_constructor, 'apply'):
+            self.state = OpLogState(db, db_key, data_def_constructor,
+                                    fallback=self.state)
         self.conf = conf
-        self.data = self.load()
+        self.display_policy = TokenBucket(Conf.DISPLAY_RATE,
+                                          Conf.DISPLAY_BURST)
+        self._data = None
+        self._is_loaded = False
+        self._warming = None  # Future of the load started by warm
+        if not Conf.FAST_START:
+            self.data = self.load()
+
+    @property
+    def data(self):
+        """
+        The cog's data. With Conf.FAST_START it is loaded on first access
+        unless already warmed (see warm). Async code should await warm first
+        so it does not load on the loop while warm is loading
+        """
+        if not self._is_loaded:
+            self.data = self.load()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._is_loaded = True
+
+    async def warm(self):
+        """
+        Loads the data on another thread if not loaded yet so the loop is
+        not blocked. The db is read through a DBCacheReader (the DBCache is
+        only changed from the loop) and the data is assigned on the loop.
+        Callers arriving while it loads wait for the same load
+        """
+        if self._is_loaded:
+            return
+        if self._warming is None:
+            self._warming = asyncio.get_running_loop().run_in_executor(
+                None, self.load, self.db.reader())
+        warming = self._warming
+        try:
+            # Shielded so a cancelled caller does not cancel the others
+            result = await asyncio.shield(warming)
+        finally:
+            if self._warming is warming and warming.done():
+                self._warming = None  # Retried by the next caller if failed
+        if not self._is_loaded:
+            self.data = result
+
+    async def cog_before_invoke(self, ctx):
+        # Commands wait for the data instead of loading it on the loop
+        await self.warm()
 
     # GLOBALLY APPLIED FUNCTIONS
     def cog_check(self, ctx):
@@ -32,11 +97,26 @@ class CogCommon(commands.Cog):
         if self.db_key is not None:
             log(f'[{self.__class__.__name__}] Call to save',
                 logging.DEBUG)
-            self.db[self.db_key, True] = self.data
+            if self.state is not None:
+                self.state.save(self.data)
+            else:
+                self.db[self.db_key, self.codec] = self.data
+            if isinstance(self.data, OpRecorder) \
+                    and not isinstance(self.state, OpLogState):
+                # Only OpLogState saves the operations, drop them so they do
+                # not pile up
+                self.data.take_ops()
 
-    def load(self):
+    def load(self, db=None):
+        """
+        :param db: Read from this instead of self.db (see warm)
+        """
+        db = self.db if db is None else db
         if self.db_key is not None and self.data_def_constructor is not None:
-            result = self.db.get(self.db_key, should_yaml=True)
+            if self.state is not None:
+                result = self.state.load(db=db)
+            else:
+                result = db.get(self.db_key, codec=self.codec)
             if result is None:
                 # Create new empty instance of data
                 result = self.data_def_constructor()
@@ -44,6 +124,33 @@ class CogCommon(commands.Cog):
         else:
             return None
 
+    async def send_history(self, ctx, count: int = 10):
+        if not isinstance(self.state, OpLogState):
+            await ctx.send('History is not kept (see Conf.DB.COG_STATE)')
+            return
+        msg = ''
+        for seq, ops in self.state.history(count):
+            if ops is None:
+                msg += f'{seq}: Snapshot\n'
+            else:
+                msg += f'{seq}: {"; ".join(str(op) for op in ops)}\n'
+        await ctx.send(f'```\n{msg if msg != "" else "No changes"}```')
+
+    def restore(self, seq: int):
+        """
+        Replaces the data with the data as it was after seq (saved as a new
+        snapshot so the restore can also be undone)
+        :param seq: Sequence number from the history
+        """
+        if not isinstance(self.state, OpLogState):
+            raise commands.errors.UserInputError(
+                'History is not kept (see Conf.DB.COG_STATE)')
+        try:
+            self.data = self.state.load(seq)
+        except ValueError as e:
+            raise commands.errors.UserInputError(str(e))
+        self.save()
+
     @staticmethod
     async def should_exec(ctx, confirm):
         if confirm:
@@ -59,3 +166,15 @@ class CogCommon(commands.Cog):
         msg = '' if msg_prefix is None else f'{msg_prefix}\n\n'
         msg += str(self.data)
         await ctx.send(msg)
+
+    async def send_display(self, ctx, msg_prefix: str = None):
+        """
+        send_data_str limited per user and guild (see Conf.DISPLAY_RATE).
+        Requests over the limit are ignored
+        """
+        guild_id = None if ctx.guild is None else ctx.guild.id
+        future = KeyedScheduler.get_instance().submit(
+            self.display_policy, self.send_data_str, [ctx, msg_prefix],
+            key=(self.send_data_str, guild_id, ctx.author.id))
+        if future is not None:
+            await future
@@ -41,6 +41,16 @@ class UserCustom:
     def __str__(self):
         return f'{self.display}'
 
+    def to_list(self) -> list:
+        """
+        :return: Compact form used by SchemaCodec (is_dummy not saved)
+        """
+        return [self.id, self.display]
+
+    @staticmethod
+    def from_list(data: list) -> 'UserCustom':
+        return UserCustom(data[0], data[1])
+
     @staticmethod
     def get_user_custom(user: discord.User):
         # TODO Add a converter to use this function to auto convert to user
@@ -1,8 +1,10 @@
+import copy
 from abc import abstractmethod
 from dataclasses import dataclass, field
-from typing import List, Union
+from typing import Union
 
 from bot.common.user_custom import UserCustom
+from utils.cow import CowList
 
 
 @dataclass
@@ -11,8 +13,9 @@ class UserList:
     Stores a list of users. Does not allow duplicates. Users stored in
     order added.
     """
-    users: List[UserCustom] = field(default_factory=list)
+    users: CowList = field(default_factory=CowList)  # of UserCustom
     _str_disp: Union[str, None] = None
+    version = 0  # Incremented on every change (not a dataclass field)
 
     def add(self, user: UserCustom):
         """
@@ -37,6 +40,30 @@ class UserList:
 
     def _invalidate_calculated(self):
         self._str_disp = None
+        self.version += 1
+        self.__dict__.pop('_snapshot', None)
+
+    def snapshot(self):
+        """
+        Returns a copy of this list that will not be affected by later
+        changes. Unchanged lists return the same snapshot and the users are
+        only copied if this list is changed later.
+        """
+        if '_snapshot' not in self.__dict__:
+            result = copy.copy(self)
+            result.users = self.users.copy()
+            self.__dict__['_snapshot'] = result
+        return self.__dict__['_snapshot']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_snapshot', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not isinstance(self.users, CowList):
+            self.users = CowList(self.users)  # Saved before CowList was used
 
     def __str__(self):
         if self._str_disp is None:
@@ -1,15 +1,16 @@
 import logging
+import time
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from bot.alert.cog_alert import CogAlert
 from bot.registration.cog_registration import CogRegistration
 from bot.settings.cog_settings import CogSettings
-from conf import Conf
+from conf import Conf, DBKeys
+from utils.backup import BackupStore
 from utils.log import log
-from utils.misc import export
-from utils.rate_limited_execution import RateLimitedExecution
+from utils.keyed_scheduler import Debounce, KeyedScheduler, Throttle
 
 conf = Conf.TopLevel
 """Map class with setting for this cog to variable"""
@@ -20,12 +21,25 @@ class Bot(commands.Bot):
         super().__init__(**args)
 
         self.db = args['db']
+        self.backups = BackupStore()
         self.cog_settings = CogSettings(self.db)
         self.cog_registration = CogRegistration(self.db)
         self.cog_alert = CogAlert(self.db, self)
         self.add_cog(self.cog_settings)
         self.add_cog(self.cog_registration)
         self.add_cog(self.cog_alert)
+        if Conf.Backup.ENABLED:
+            self.backup_loop.start()
+        if Conf.FAST_START:
+            self.loop.create_task(self.warm_cogs())
+
+        # Jobs that can be requested through KeyedScheduler by intent
+        self.jobs = {'export': self.export}
+        # Runs a fixed time after the first request (later ones merged)
+        self.export_policy = Debounce(Conf.EXPORT_DELAY,
+                                      max_wait=Conf.EXPORT_DELAY)
+        KeyedScheduler.get_instance().persist_to(self.db, DBKeys.PENDING_JOBS)
+        self.resume_jobs()
 
         @self.check
         def check_channel(ctx):
@@ -72,8 +86,9 @@ class Bot(commands.Bot):
             Requests that the bot saves to secondary storage immediately
             :param ctx: The Context
             """
-            self.cog_registration.save()
-            self.cog_alert.save()
+            await KeyedScheduler.get_instance().submit(
+                Throttle(1, Conf.SAVE_COMMAND_INTERVAL, trailing=True),
+                self.save_now)
             await ctx.author.send("Saved")
 
         def is_dm_or_priv_role(ctx):
@@ -88,11 +103,11 @@ class Bot(commands.Bot):
         @commands.check(is_dm_or_priv_role)
         async def export_cmd(ctx):
             """
-            Requests that the bot saves to a file
+            Requests that the bot takes a backup
             :param ctx: The Context
             """
-            RateLimitedExecution.get_instance().register(Conf.EXPORT_DELAY,
-                                                         self.export)
+            KeyedScheduler.get_instance().submit(
+                self.export_policy, self.export, intent='export')
             await ctx.author.send("Export Request Acknowledged")
 
         @self.event
@@ -121,5 +136,80 @@ class Bot(commands.Bot):
         async def on_ready():
             log(f'Successfully logged in as {self.user}')
 
-    def export(self):
-        export(Conf.EXPORT_FILE_NAME, self.db)
+    async def warm_cogs(self):
+        """
+        Loads the cogs' data in the background while logging in. One at a
+        time so the db is only used from one extra thread
+        """
+        for cog in (self.cog_settings, self.cog_registration,
+                    self.cog_alert):
+            try:
+                await cog.warm()
+            except Exception as e:
+                log(f'[Bot] Failed to load {cog.qualified_name}: {e}',
+                    logging.ERROR)
+        log('[Bot] Cog data loaded')
+
+    def resume_jobs(self):
+        """
+        Registers the jobs that were still pending when the bot last stopped
+        """
+        scheduler = KeyedScheduler.get_instance()
+        for intent, due in scheduler.load_intents().items():
+            if intent in self.jobs:
+                log(f'[Bot] Resuming pending job: {intent}')
+                delay = max(due - time.time(), 0)
+                scheduler.submit(Debounce(delay, max_wait=delay),
+                                 self.jobs[intent], intent=intent)
+            else:
+                log(f'[Bot] Unknown pending job dropped: {intent}',
+                    logging.WARNING)
+
+    async def close(self):
+        """
+        Runs pending jobs and writes out the db cache before closing
+        (discord.py calls this on SIGINT/SIGTERM as well)
+        """
+        log('[Bot] Closing')
+        scheduler = KeyedScheduler.get_instance()
+        await scheduler.run_pending()
+        scheduler.log_stats()
+        await self.db.aclose()
+        await super().close()
+
+    async def export(self):
+        """
+        Takes a backup (requested through KeyedScheduler)
+        """
+        await self.backup()
+
+    def save(self):
+        self.cog_registration.save()
+        self.cog_alert.save()
+
+    async def save_now(self):
+        """
+        Saves the cogs and waits for the values to reach the db instead of
+        leaving them in the write cache for up to Conf.SAVE_CACHE_DELAY
+        """
+        self.save()
+        await self.db.flush()
+
+    async def backup(self):
+        """
+        Takes a backup of the db on the db worker thread (see
+        DBCache.run_exclusive)
+        """
+        try:
+            await self.db.run_exclusive(self.backups.create,
+                                        self.db.db_backing)
+        except Exception as e:
+            log(f'[Backup] Failed: {e}', logging.ERROR)
+
+    @tasks.loop(seconds=Conf.Backup.INTERVAL)
+    async def backup_loop(self):
+        await self.backup()
+
+    @backup_loop.before_loop
+    async def before_backup_loop(self):
+        await self.wait_until_ready()
@@ -1,20 +1,18 @@
 from dataclasses import dataclass, field
 
+from bot.common.user_custom import UserCustom
 from bot.common.user_list import UserList
+from utils.cow import CowList
 
 
 @dataclass
 class Category(UserList):
+    SCHEMA_VERSION = 1  # See SchemaCodec
+
     number: int = 1
     name: str = 'General'
     _name: str = field(init=False, repr=False)
 
-    def __post_init__(self):
-        # Just so that we don't create the property a second time.
-        if not isinstance(getattr(Category, "name", False), property):
-            self._name = self.name
-            Category.name = property(Category._get_name, Category._set_name)
-
     def _get_name(self):
         return self._name
 
@@ -22,7 +20,33 @@ class Category(UserList):
         self._name = val
         self._invalidate_calculated()
 
+    def to_dict(self, users_by_id: dict = None) -> dict:
+        """
+        :param users_by_id: Not used, for symmetry with from_dict
+        """
+        return {'number': self.number, 'name': self.name,
+                'users': [user.to_list() for user in self.users]}
+
+    @staticmethod
+    def from_dict(data: dict, users_by_id: dict = None) -> 'Category':
+        """
+        :param users_by_id: Users already created (shared between categories)
+            added to as new users are found
+        """
+        users_by_id = {} if users_by_id is None else users_by_id
+        result = Category(number=data['number'], name=data['name'])
+        for user in data['users']:
+            if user[0] not in users_by_id:
+                users_by_id[user[0]] = UserCustom.from_list(user)
+        result.users = CowList(users_by_id[user[0]] for user in data['users'])
+        return result
+
     def get_str_rep(self):
         users = self.users_as_str("\n")
         return f'Category: {self.number} - {self.name} ({len(self)})\n' \
                f'{users}\n'
+
+
+# Replaces the field default once the dataclass has captured it so that
+# objects not created by __init__ (eg. loaded from yaml) also read _name
+Category.name = property(Category._get_name, Category._set_name)
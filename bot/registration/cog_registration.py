@@ -31,7 +31,7 @@ class CogRegistration(CogCommon, name='Registration'):
     # NORMAL COMMANDS
     @base.command(**conf.Command.DISPLAY)
     async def display(self, ctx):
-        await self.send_data_str(ctx)
+        await self.send_display(ctx)
 
     @base.command(**conf.Command.REGISTER)
     async def register(self, ctx, cat_number: Union[int, str] = None):
@@ -107,3 +107,17 @@ class CogRegistration(CogCommon, name='Registration'):
         self.data.set_msg(msg)
         self.save()
         await self.send_data_str(ctx, 'Message Set')
+
+    @base.command(**conf.Command.HISTORY)
+    @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
+    async def history(self, ctx, count: int = 10):
+        await self.send_history(ctx, count)
+
+    @base.command(**conf.Command.RESTORE)
+    @commands.has_any_role(*conf.Permissions.PRIV_ROLES)
+    async def restore_cmd(self, ctx, seq: int, confirm: bool = False):
+        if not await self.should_exec(ctx, confirm):
+            return
+
+        self.restore(seq)
+        await self.send_data_str(ctx, f'Restored to {seq}')
@@ -1,27 +1,35 @@
+import copy
 from typing import List, Union
 
 from discord.ext import commands
 
 from bot.common.user_custom import UserCustom
 from bot.registration.category import Category
+from utils.cow import CowDict
+from utils.op_log_state import OpRecorder
 
 
-class Registration:
+class Registration(OpRecorder):
+    SCHEMA_VERSION = 1  # See SchemaCodec
+    PARTITION_TYPES = {'cat': Category}  # See PartitionedState
+
     def __init__(self, are_mutually_exclusive_events: bool = False):
         self.message = ""
-        self.categories = {1: Category(number=1)}
+        self.categories = CowDict({1: Category(number=1)})
         self.max_cat_num = 1
         self.are_mutually_exclusive_events = are_mutually_exclusive_events
-        self.user_cat_dict = {}
+        self.user_cat_dict = CowDict()
 
     def category_new(self, name: str, number: int):
         if number < 0:
             number = self.max_cat_num + 1
-            self.max_cat_num = number
 
         self.confirm_cat_exists(number, False)
 
         self.categories[number] = Category(number=number, name=name)
+        # Also when replayed (the op records the number chosen)
+        self.max_cat_num = max(self.max_cat_num, number)
+        self.record_op('cat_new', name, number)
 
     def category_remove(self, number: int):
         self.confirm_cat_exists(number, True)
@@ -30,16 +38,20 @@ class Registration:
                 'Unable to remove only one category left')
         if self.are_mutually_exclusive_events:
             # Clear out users from dict
-            for user in self.categories[number]:
+            for user in self.categories[number].users:
                 self.user_cat_dict.pop(user)
         self.categories.pop(number)
         if number == self.max_cat_num:
             # Max removed find new max
             self.max_cat_num = max(self.categories.keys())
+        self.record_op('cat_rm', number)
 
     def category_rename(self, number: int, new_name: str):
         self.confirm_cat_exists(number, True)
+        if self.categories[number].name == new_name:
+            return  # Nothing changed so nothing to record
         self.categories[number].name = new_name
+        self.record_op('cat_rn', number, new_name)
 
     def resolve_cat_number(self,
                            cat_number:
@@ -87,12 +99,15 @@ class Registration:
                 self.register(user, x)
             return  # Do nothing more already called
         self.confirm_cat_exists(cat_number, True)
+        if user in self.categories[cat_number].users:
+            return  # Already registered so nothing to record
         if self.are_mutually_exclusive_events:
             # Check if user is already registered
             if user in self.user_cat_dict:
                 self.unregister(user, self.user_cat_dict[user])
             self.user_cat_dict[user] = cat_number
         self.categories[cat_number].add(user)
+        self.record_op('reg', user.id, user.display, cat_number)
 
     def unregister(self, user: UserCustom, cat_number: Union[int, str, None]):
         cat_number = self.resolve_cat_number(cat_number)
@@ -102,11 +117,37 @@ class Registration:
             return  # Do nothing more already called
 
         self.confirm_cat_exists(cat_number, True)
+        if user not in self.categories[cat_number].users:
+            return  # Not registered so nothing to record
         self.categories[cat_number].remove(user)
         self.user_cat_dict.pop(user, "No Exception If Not Present")
+        self.record_op('unreg', user.id, cat_number)
 
     def set_msg(self, msg: str):
+        if self.message == msg:
+            return  # Nothing changed so nothing to record
         self.message = msg
+        self.record_op('msg', msg)
+
+    def apply(self, op):
+        """
+        Applies an operation recorded by this class (see OpRecorder)
+        """
+        name, *args = op
+        if name == 'reg':
+            self.register(UserCustom(args[0], args[1]), args[2])
+        elif name == 'unreg':
+            self.unregister(UserCustom(args[0], ''), args[1])
+        elif name == 'cat_new':
+            self.category_new(*args)
+        elif name == 'cat_rm':
+            self.category_remove(*args)
+        elif name == 'cat_rn':
+            self.category_rename(*args)
+        elif name == 'msg':
+            self.set_msg(*args)
+        else:
+            raise ValueError(f'Unknown operation: {op}')
 
     def __str__(self):
 
@@ -121,6 +162,83 @@ class Registration:
         result += f'Total Number of Users: {total_users}'
         return result
 
+    def snapshot(self) -> 'Registration':
+        """
+        Returns a copy that will not be affected by later changes (eg. to be
+        saved on another thread). Unchanged parts are shared with this object.
+        """
+        result = copy.copy(self)
+        result.categories = CowDict(
+            {key: cat.snapshot() for key, cat in self.categories.items()})
+        result.user_cat_dict = self.user_cat_dict.copy()
+        return result
+
+    def to_dict(self) -> dict:
+        """
+        :return: The registration as plain values (see SchemaCodec)
+        """
+        return {
+            **self.root_dict(),
+            'categories': [cat.to_dict() for cat in self.categories.values()],
+            'user_cat': [[user.id, cat] for user, cat in
+                         self.user_cat_dict.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Registration':
+        result = cls(data['are_mutually_exclusive_events'])
+        result.message = data['message']
+        result.max_cat_num = data['max_cat_num']
+        users_by_id = {}
+        result.categories = CowDict()
+        for cat_data in data['categories']:
+            cat = Category.from_dict(cat_data, users_by_id)
+            result.categories[cat.number] = cat
+        result.user_cat_dict = CowDict(
+            {users_by_id[user_id]: cat for user_id, cat in data['user_cat']})
+        return result
+
+    def partitions(self) -> dict:
+        """
+        :return: Categories by partition name (see PartitionedState)
+        """
+        return {f'cat/{number}': cat
+                for number, cat in self.categories.items()}
+
+    def root_dict(self) -> dict:
+        """
+        :return: Fields not saved with the categories (see PartitionedState)
+        """
+        return {
+            'message': self.message,
+            'are_mutually_exclusive_events':
+                self.are_mutually_exclusive_events,
+            'max_cat_num': self.max_cat_num,
+        }
+
+    @classmethod
+    def from_partitions(cls, root: dict, partitions: dict) -> 'Registration':
+        result = cls(root['are_mutually_exclusive_events'])
+        result.message = root['message']
+        result.max_cat_num = root['max_cat_num']
+        result.categories = CowDict(
+            {cat.number: cat for cat in sorted(partitions.values(),
+                                               key=lambda x: x.number)})
+        if result.are_mutually_exclusive_events:
+            # Each user is in only one category
+            result.user_cat_dict = CowDict(
+                {user: cat.number for cat in result.categories.values()
+                 for user in cat.users})
+        return result
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Convert containers saved before CowDict was used
+        if not isinstance(self.categories, CowDict):
+            self.categories = CowDict(self.categories)
+        if not isinstance(self.user_cat_dict, CowDict):
+            self.user_cat_dict = CowDict(self.user_cat_dict)
+
     def confirm_cat_exists(self, number: int, should_exist: bool):
         """
         Checks if a category exists or not based on the number and raises a
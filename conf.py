@@ -21,6 +21,7 @@ class MasterPermissions:
 class DBKeys:  # Database key values
     REGISTRATION = 'registration'
     ALERT = 'alert'
+    PENDING_JOBS = 'pending_jobs'  # See KeyedScheduler.persist_to
 
 
 class Conf:
@@ -28,14 +29,68 @@ class Conf:
     VERSION = '1.3.1'
     LOG_LEVEL = logging.INFO
     COMMAND_PREFIX = 'cb'  # CubeBot
-    SAVE_CACHE_DELAY = 30  # Minimum number of seconds between saves
-    EXPORT_FILE_NAME = 'export.yaml'
+    # Minimum number of seconds between saves (cache written out on close)
+    SAVE_CACHE_DELAY = 5 * 60
+    # Cog data loaded in the background during login (or on first use)
+    FAST_START = True
+    WEB_INTERFACE_ENABLED = True  # flask and waitress only imported if true
+    EXPORT_FILE_NAME = 'export.jsonl.gz'  # Format from name see export_stream
     EXPORT_DELAY = 15
+    SAVE_COMMAND_INTERVAL = 10  # Min seconds between saves by save command
+    # Display commands per user and guild (see KeyedScheduler TokenBucket)
+    DISPLAY_RATE = 1 / 10  # Per second
+    DISPLAY_BURST = 3
+    EXPORT_GZIP_LEVEL = 6
+    EXPORT_PROGRESS_INTERVAL = 5  # Seconds between progress logs
+    EXPORT_IMPORT_BATCH_BYTES = 64 * 1024 * 1024  # Max bytes per write_many
     URL = 'https://summerproject.lassat.repl.co/'
     EMBED_COLOR = 0x373977
 
     class ENV:  # Environment variable names
         TOKEN = 'TOKEN_LASSAT'
+        REPL_DB_URL = 'REPLIT_DB_URL'
+
+    class DB:
+        # Write cache flushed early once this many serialized bytes are dirty
+        # (otherwise after SAVE_CACHE_DELAY)
+        MAX_DIRTY_BYTES = 1024 * 1024
+        READ_CACHE_SIZE = 1000  # Max decoded objects kept (None = unbounded)
+        COMPRESSION = 'zlib'  # 'zlib', 'lzma' or None
+        COMPRESS_MIN_BYTES = 4 * 1024  # Smaller values stored as is
+        MAX_VALUE_BYTES = 4 * 1024 * 1024  # Larger values split into chunks
+        CODEC = 'json'  # Cog state format 'json' or 'binary' (SchemaCodec)
+
+        # How cogs save their data. 'oplog' (OpLogState), 'partitioned'
+        # (PartitionedState) or 'whole' (one key)
+        COG_STATE = 'oplog'
+        OPLOG_SNAPSHOT_INTERVAL = 1000  # Operations between snapshots
+        OPLOG_KEEP_SNAPSHOTS = 10  # Older snapshots and operations deleted
+
+        USE_REPL_DB = True  # If false LOCAL_BACKEND used even on REPL
+
+        # REPL DB client settings
+        REPL_CLIENT = 'pooled'  # 'pooled' (ReplDBClient) or 'replit' library
+        REPL_POOL_SIZE = 8  # Max open connections (and concurrent requests)
+        REPL_BULK_MAX_BYTES = 512 * 1024  # Max body of a single bulk write
+        REPL_TIMEOUT = 10  # Seconds
+        REPL_PREFETCH = True  # Load all values concurrently at startup
+        LOCAL_BACKEND = 'journal'  # Used when REPL DB unavailable (see get_db)
+        LOCAL_FILE_NAME = 'dict_persistent.yaml'
+
+        # Journal settings (LOCAL_BACKEND = 'journal')
+        JOURNAL_FSYNC = 'group'  # One of 'always', 'group', 'never'
+        JOURNAL_GROUP_SIZE = 64  # Max records buffered before a commit
+        JOURNAL_GROUP_DELAY = 0.05  # Max seconds a record waits for commit
+        JOURNAL_COMPACT_RATIO = 2  # Compact when journal > ratio * base file
+        JOURNAL_COMPACT_MIN_BYTES = 64 * 1024  # Never compact below this
+
+        # Segment settings (LOCAL_BACKEND = 'segment')
+        SEGMENT_FILE_NAME = 'dict_persistent.seg'
+        SEGMENT_COMPACT_RATIO = 1  # Compact when dead bytes > ratio * live
+
+        # SQLite settings (LOCAL_BACKEND = 'sqlite')
+        SQLITE_FILE_NAME = 'dict_persistent.sqlite3'
+        SQLITE_SYNCHRONOUS = 'NORMAL'  # PRAGMA synchronous (FULL is safest)
 
     class TopLevel:
         class Permissions:
@@ -119,18 +174,49 @@ class Conf:
                 'name': 'msg',
                 'help': 'Sets a general message that is displayed at the top.'}
 
+            HISTORY = {
+                'name': 'history',
+                'help': 'Shows the latest changes with their sequence numbers'}
+
+            RESTORE = {
+                'name': 'restore',
+                'help': 'Restores the data as it was after the change with '
+                        'the sequence number passed (see history)'}
+
         class Permissions:
             PRIV_ROLES = MasterPermissions.PRIV.REGISTRATION
             ALLOWED_CHANNELS = MasterPermissions.Channels.REGISTRATION
 
+    class Backup:
+        ENABLED = True  # Take backups on a schedule while the bot runs
+        DIR = 'backups'
+        INTERVAL = 6 * 60 * 60  # Seconds between scheduled backups
+        FULL_INTERVAL = 10  # Backups per chain (full backup then deltas)
+        KEEP = 20  # Min backups kept (whole chains deleted, oldest first)
+
     class Alert:
         DEF_TZ = timezone.utc
         ALERT_MSG = Template(
-            '<@&747938666667835393> "$event_name" starts at $next_time.\n'
+            '$roles "$event_name" starts at $next_time.\n'
             'This event is in $time_delta from now\n'
             '$final_notice')
+        # Used for events without channels / roles of their own
         ALERT_CHANNEL_ID = 747915319149854890
-        ALERT_POLL_INTERVAL = 60
+        ALERT_ROLE_ID = 747938666667835393
+        # Seconds the alert loop sleeps straight to a target, longer waits
+        # are slept in halves to check the wall clock again (see alert_loop)
+        ALERT_EXACT_SLEEP = 5 * 60
+        ALERT_RETRY_DELAY = 60  # Seconds before retrying a failed alert
+        MAX_MSG_LEN = 2000  # Discord's limit, alerts sent together
+        # Store ordering the events: 'heap' (EventQueue) or 'columns'
+        # (EventColumnQueue, less memory with very many events)
+        EVENT_STORE = 'heap'
+        # Delivery (see AlertDelivery)
+        CHANNEL_SEND_INTERVAL = 1  # Min seconds between sends to a channel
+        SEND_TIMEOUT = 10  # Seconds per attempt
+        SEND_RETRIES = 3
+        SEND_BACKOFF = 1  # Seconds before the first retry (doubled after)
+        LATENCY_HISTORY = 100  # Delivery latencies kept per channel
         BASE_GROUP = {'name': 'a',
                       'help': 'Grouping for Alert Commands',
                       'invoke_without_command': True}
@@ -138,7 +224,12 @@ class Conf:
         class Command:
             CREATE = {
                 'name': 'create',
-                'help': 'Creates a new event'}
+                'help': 'Creates a new event. Channels and roles mentioned '
+                        'after the name are alerted (Defaults used if none)'}
+            SET_TARGETS = {
+                'name': 'targets',
+                'help': 'Sets the channels and roles alerted for an event '
+                        '(none to use the defaults)'}
 
             REMOVE = {
                 'name': 'rem',
@@ -154,6 +245,13 @@ class Conf:
                 'name': 'set_tz',
                 'help': 'Sets default timezone to be used by the bot if a '
                         'timezone for an event is not provided'}
+            HISTORY = {
+                'name': 'history',
+                'help': 'Shows the latest changes with their sequence numbers'}
+            RESTORE = {
+                'name': 'restore',
+                'help': 'Restores the data as it was after the change with '
+                        'the sequence number passed (see history)'}
 
         class Permissions:
             PRIV_ROLES = MasterPermissions.PRIV.ALERT
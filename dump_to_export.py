@@ -1,25 +1,37 @@
 """
-Simple script to clear out data from the DB. Saved to export as precaution
+Simple script to save the DB to an export (see import_from_file.py to load
+it) and take a backup (see utils.backup to restore). With --clear the DB is
+then emptied.
 """
+import argparse
 
 from conf import Conf
-from utils.misc import export
+from utils.backup import BackupStore
+from utils.export_stream import export
+from utils.log import setup_logging
 from utils.repl_support import get_db
 
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
-
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file_name', nargs='?', default=Conf.EXPORT_FILE_NAME,
+                        help='File to export to (format from the file name '
+                             'see utils.export_stream)')
+    parser.add_argument('--clear', action='store_true',
+                        help='Remove every key from the DB after the export '
+                             'and backup')
+    args = parser.parse_args()
+    setup_logging()
     db = get_db()
-    export(Conf.EXPORT_FILE_NAME, db)
-    print("Export Completed")
-    keys = [x for x in db.keys()]
-    for key in keys:
-        db.pop(key)
-    print("DB Emptied")
+    count = export(args.file_name, db)
+    print(f"Export Completed ({count} keys)")
+    name = BackupStore().create(db)
+    print(f"Backup Completed: {name}")
+    if args.clear:
+        keys = [x for x in db.keys()]
+        for key in keys:
+            db.pop(key)
+        print("DB Emptied")
 
 
 if __name__ == '__main__':
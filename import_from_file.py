@@ -1,24 +1,23 @@
 """
 Simple script to load the export into the DB
 """
-import yaml
+import argparse
 
 from conf import Conf
+from utils.export_stream import import_
+from utils.log import setup_logging
 from utils.repl_support import get_db
 
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
-
 
 def main():
-    with open(Conf.EXPORT_FILE_NAME, 'r') as f:
-        data = yaml.load(f, Loader=Loader)
-    db = get_db()
-    for key in data.keys():
-        db[key] = data[key]
-    print('Import Completed')
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('file_name', nargs='?', default=Conf.EXPORT_FILE_NAME,
+                        help='Export to load (format from the file name see '
+                             'utils.export_stream)')
+    args = parser.parse_args()
+    setup_logging()
+    count = import_(args.file_name, get_db())
+    print(f'Import Completed ({count} keys)')
 
 
 if __name__ == '__main__':
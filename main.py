@@ -1,9 +1,9 @@
 import os
+import signal
+import sys
 from threading import Thread
 
-import flask
 from discord.ext import commands
-from waitress import serve
 
 from bot.custom_bot import Bot
 from conf import Conf
@@ -24,16 +24,21 @@ bot: Bot
     Had to put them in the same file to resolve issues with getting 
     access to current tournament variable values
     
+    flask and waitress are imported on the web thread so they do not delay
+    startup (and not at all if Conf.WEB_INTERFACE_ENABLED is false)
 """
-web_interface = flask.Flask('Board')
 
 
-@web_interface.route('/')
-def home():
-    return flask.render_template('index.html')
+def run():
+    import flask
+    from waitress import serve
 
+    web_interface = flask.Flask('Board')
+
+    @web_interface.route('/')
+    def home():
+        return flask.render_template('index.html')
 
-def run():
     serve(web_interface, host="0.0.0.0", port=80)
 
 
@@ -48,11 +53,17 @@ def main():
     global bot
     log('Main Started')
 
+    # Exit normally on SIGTERM so the db cache is written out at exit
+    # (replaced by discord.py's handlers once the bot is running which close
+    # the bot instead)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
     bot = Bot(db=DBCache(get_db()),
               command_prefix=commands.when_mentioned_or(Conf.COMMAND_PREFIX),
               description=Conf.BOT_DESCRIPTION)
 
-    display_start()
+    if Conf.WEB_INTERFACE_ENABLED:
+        display_start()
     bot.run(os.getenv(Conf.ENV.TOKEN))
 
 
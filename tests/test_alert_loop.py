@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bot.alert.cog_alert import CogAlert
+from bot.common.user_custom import UserCustom
+from conf import Conf
+from utils.clock import Clock, FakeClock
+from utils.db_cache import DBCache
+
+START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+class DriftingClock(FakeClock):
+    """
+    Wall clock that runs faster than the monotonic clock
+    """
+
+    def __init__(self, start: datetime, drift: float):
+        super().__init__(start)
+        self.drift = drift
+
+    def advance(self, seconds: float):
+        super().advance(seconds)
+        self._now += timedelta(seconds=seconds * self.drift)
+
+
+class FakeChannel:
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.sends = []
+
+    async def send(self, msg: str):
+        self.sends.append(self.clock.now(timezone.utc))
+
+
+class FakeBot:
+    def __init__(self, loop, channel):
+        self.loop = loop
+        self.channel = channel
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_channel(self, _):
+        return self.channel
+
+    async def fetch_channel(self, _):
+        return self.channel
+
+
+def run_single_alert(clock: FakeClock, days_ahead: int) -> timedelta:
+    """
+    :return: How late the alert of an event days_ahead away was sent
+    """
+    Clock.set_instance(clock)
+    loop = asyncio.new_event_loop()
+    channel = FakeChannel(clock)
+    db = DBCache({})
+    cog = CogAlert(db, FakeBot(loop, channel))
+    target = START + timedelta(days=days_ahead)
+    cog.data.create(UserCustom(1, 'user'), 0, 'Event',
+                    target + timedelta(minutes=cog.data.lead_time))
+    cog.wake()
+
+    async def until_sent():
+        while len(channel.sends) == 0:
+            await asyncio.sleep(0)
+        cog.cog_unload()
+
+    try:
+        loop.run_until_complete(until_sent())
+        loop.run_until_complete(db.aclose())
+    finally:
+        loop.close()
+        Clock.set_instance(None)
+    return channel.sends[0] - target
+
+
+def test_far_target_takes_few_wakeups():
+    clock = FakeClock(START)
+    lateness = run_single_alert(clock, 30)
+    assert lateness == timedelta(0)
+    # Halving from 30 days down to ALERT_EXACT_SLEEP (polling every
+    # ALERT_EXACT_SLEEP would take 8640)
+    assert clock.sleeps <= 20
+
+
+def test_drift_corrected_before_target():
+    # 0.05% fast wall clock is 21 minutes over 30 days
+    clock = DriftingClock(START, drift=0.0005)
+    lateness = run_single_alert(clock, 30)
+    # Only the drift over the last exact sleep is left
+    max_lateness = timedelta(seconds=Conf.Alert.ALERT_EXACT_SLEEP * 0.0005)
+    assert timedelta(0) <= lateness <= max_lateness
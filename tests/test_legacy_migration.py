@@ -0,0 +1,50 @@
+import subprocess
+import sys
+from os import path
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+# Registration as saved by yaml before SchemaCodec. Category 1 was created
+# first so it also has the plain name attribute left from before the name
+# property existed.
+BASELINE_REGISTRATION = '''\
+!!python/object:bot.registration.registration.Registration
+are_mutually_exclusive_events: false
+categories:
+  1: !!python/object:bot.registration.category.Category
+    _name: One
+    _str_disp: null
+    name: General
+    number: 1
+    users: []
+  2: !!python/object:bot.registration.category.Category
+    _name: Two
+    _str_disp: null
+    number: 2
+    users:
+    - !!python/object:bot.common.user_custom.UserCustom
+      _id: 5
+      display: five
+      is_dummy: false
+max_cat_num: 2
+message: ''
+user_cat_dict: {}
+'''
+
+MIGRATE = '''\
+import sys
+from bot.registration.registration import Registration
+from utils.codec import SchemaCodec
+codec = SchemaCodec(Registration)
+reg = codec.decode(codec.encode(codec.decode(sys.stdin.read())))
+for number, cat in reg.categories.items():
+    print(number, cat.name, [user.id for user in cat.users])
+'''
+
+
+def test_migrate_baseline_registration_in_fresh_interpreter():
+    # Fresh interpreter so no Category was created before the yaml is loaded
+    result = subprocess.run([sys.executable, '-c', MIGRATE], cwd=ROOT,
+                            input=BASELINE_REGISTRATION, text=True,
+                            capture_output=True, check=True)
+    assert result.stdout.splitlines() == ['1 One []', '2 Two [5]']
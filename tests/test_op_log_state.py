@@ -0,0 +1,30 @@
+from bot.common.cog_common import CogCommon
+from bot.registration.registration import Registration
+from conf import Conf
+from utils.db_cache import DBCache
+from utils.op_log_state import OpLogState
+
+
+def test_auto_numbered_category_after_reload():
+    db = DBCache({})
+    reg = Registration()
+    state = OpLogState(db, 'reg', Registration)
+    state.save(reg)  # Snapshot
+    reg.category_new('A', 2)
+    state.save(reg)  # Operation replayed on load
+
+    loaded = OpLogState(db, 'reg', Registration).load()
+    assert loaded.max_cat_num == 2
+    loaded.category_new('B', -1)
+    assert sorted(loaded.categories) == [1, 2, 3]
+
+
+def test_ops_dropped_when_not_saved_as_log(monkeypatch):
+    for mode in ['partitioned', 'whole']:
+        monkeypatch.setattr(Conf.DB, 'COG_STATE', mode)
+        monkeypatch.setattr(Conf, 'FAST_START', False)
+        cog = CogCommon(DBCache({}), conf=None, db_key='reg',
+                        data_def_constructor=Registration)
+        cog.data.set_msg('hello')
+        cog.save()
+        assert cog.data.take_ops() == []
@@ -0,0 +1,272 @@
+"""
+Incremental content addressed backups of the raw values in a db.
+
+Layout of the backup directory:
+    - objects/<hash[:2]>/<hash>: A value (zlib compressed), stored once no
+        matter how many keys or backups use it
+    - manifests/<name>.json: A backup. Either full (every key and the hash of
+        its value) or a delta against the previous backup (only the keys set
+        or deleted since). Each full backup starts a chain of deltas.
+
+A full backup is taken every Conf.Backup.FULL_INTERVAL backups. Whole chains
+are deleted, oldest first, while more than Conf.Backup.KEEP backups would
+still remain, followed by objects no longer used.
+
+Run from the repository root:
+    python -m utils.backup list
+    python -m utils.backup create
+    python -m utils.backup restore <name>
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import zlib
+from datetime import datetime, timezone
+
+import yaml
+
+from conf import Conf
+from utils.log import log, setup_logging
+
+try:
+    from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+    from yaml import Loader, Dumper
+
+
+class BackupStore:
+    _TYPE_STR = b's'
+    _TYPE_YAML = b'y'
+
+    def __init__(self, directory: str = None):
+        """
+        :param directory: Where backups are kept (Default Conf.Backup.DIR)
+        """
+        self.directory = Conf.Backup.DIR if directory is None else directory
+        self._objects_dir = os.path.join(self.directory, 'objects')
+        self._manifests_dir = os.path.join(self.directory, 'manifests')
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._manifests_dir, exist_ok=True)
+
+    def names(self) -> list:
+        """
+        :return: Names of the backups oldest first
+        """
+        return sorted(fn[:-len('.json')]
+                      for fn in os.listdir(self._manifests_dir)
+                      if fn.endswith('.json'))
+
+    def create(self, db) -> str:
+        """
+        Backs up every key in db. NB: db must not change while this runs
+        (see DBCache.run_exclusive) for the backup to be consistent
+        :param db: The dict like db to back up (raw values are saved as is)
+        :return: Name of the backup created
+        """
+        names = self.names()
+        is_full = len(names) == 0 \
+            or self._chain_length(names) >= Conf.Backup.FULL_INTERVAL
+        previous = {} if len(names) == 0 else self.state(names[-1])
+
+        state = {}
+        new_objects = 0
+        for key in list(db.keys()):
+            value = db.get(key)
+            if value is None:
+                continue  # Removed while listing
+            data = self._encode(value)
+            digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+            state[key] = digest
+            if previous.get(key) != digest and self._write_object(digest,
+                                                                  data):
+                new_objects += 1
+
+        seq = 1 if len(names) == 0 else int(names[-1].split('-')[0]) + 1
+        name = f'{seq:08d}-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}'
+        if is_full:
+            manifest = {'full': True, 'set': state, 'deleted': []}
+        else:
+            manifest = {
+                'full': False,
+                'set': {key: digest for key, digest in state.items()
+                        if previous.get(key) != digest},
+                'deleted': [key for key in previous if key not in state],
+            }
+        self._write_atomic(os.path.join(self._manifests_dir, f'{name}.json'),
+                           json.dumps(manifest).encode())
+        log(f'[Backup] Created {"full" if is_full else "delta"} backup '
+            f'{name}: {len(state)} keys, {len(manifest["set"])} changed, '
+            f'{len(manifest["deleted"])} deleted, {new_objects} new objects')
+        self._rotate()
+        return name
+
+    def state(self, name: str) -> dict:
+        """
+        :param name: Name of the backup
+        :return: Key -> hash of every key in the backup
+        """
+        names = self.names()
+        if name not in names:
+            raise ValueError(f'No backup named {name}')
+        chain = []
+        for x in reversed(names[:names.index(name) + 1]):
+            manifest = self._read_manifest(x)
+            chain.append(manifest)
+            if manifest['full']:
+                break
+        result = {}
+        for manifest in reversed(chain):
+            result.update(manifest['set'])
+            for key in manifest['deleted']:
+                result.pop(key, None)
+        return result
+
+    def restore(self, name: str, db):
+        """
+        Makes db the same as it was when the backup was taken. Keys not in
+        the backup are removed.
+        :param name: Name of the backup
+        :param db: The dict like db to restore into
+        """
+        state = self.state(name)
+        for key in [x for x in list(db.keys()) if x not in state]:
+            db.pop(key)
+        batch = {}
+        batch_bytes = 0
+        for key, digest in state.items():
+            batch[key] = self._read_object(digest)
+            batch_bytes += len(batch[key]) \
+                if isinstance(batch[key], str) else 0
+            if batch_bytes >= Conf.EXPORT_IMPORT_BATCH_BYTES:
+                self._write_batch(db, batch)
+                batch = {}
+                batch_bytes = 0
+        self._write_batch(db, batch)
+        log(f'[Backup] Restored {name} ({len(state)} keys)')
+
+    @staticmethod
+    def _write_batch(db, batch: dict):
+        if hasattr(db, 'write_many'):
+            db.write_many(batch)
+        else:
+            for key, value in batch.items():
+                db[key] = value
+
+    def is_full(self, name: str) -> bool:
+        """
+        :return: True if the backup is full (not a delta)
+        """
+        return self._read_manifest(name)['full']
+
+    def _chain_length(self, names: list) -> int:
+        """
+        :return: Number of backups in the last chain
+        """
+        result = 0
+        for name in reversed(names):
+            result += 1
+            if self.is_full(name):
+                break
+        return result
+
+    def _rotate(self):
+        """
+        Deletes the oldest chains while more than Conf.Backup.KEEP backups
+        would remain then deletes objects no longer used
+        """
+        names = self.names()
+        chains = []
+        for name in names:
+            if self.is_full(name) or len(chains) == 0:
+                chains.append([])
+            chains[-1].append(name)
+        removed = False
+        while len(chains) > 1 \
+                and len(names) - len(chains[0]) >= Conf.Backup.KEEP:
+            for name in chains.pop(0):
+                os.remove(os.path.join(self._manifests_dir, f'{name}.json'))
+                names.remove(name)
+                removed = True
+        if not removed:
+            return
+
+        in_use = set()
+        for name in names:
+            in_use.update(self._read_manifest(name)['set'].values())
+        count = 0
+        for prefix in os.listdir(self._objects_dir):
+            directory = os.path.join(self._objects_dir, prefix)
+            for digest in os.listdir(directory):
+                if digest not in in_use:
+                    os.remove(os.path.join(directory, digest))
+                    count += 1
+        log(f'[Backup] Rotated, {len(names)} backups kept and {count} '
+            f'objects deleted', logging.DEBUG)
+
+    def _read_manifest(self, name: str) -> dict:
+        with open(os.path.join(self._manifests_dir, f'{name}.json'),
+                  'rb') as f:
+            return json.loads(f.read())
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def _write_object(self, digest: str, data: bytes) -> bool:
+        """
+        :return: True if the object was not already stored
+        """
+        fn = self._object_path(digest)
+        if os.path.exists(fn):
+            return False
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        self._write_atomic(fn, zlib.compress(data))
+        return True
+
+    def _read_object(self, digest: str):
+        with open(self._object_path(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if data[:1] == self._TYPE_STR:
+            return data[1:].decode()
+        return yaml.load(data[1:].decode(), Loader=Loader)
+
+    def _encode(self, value) -> bytes:
+        if isinstance(value, str):
+            return self._TYPE_STR + value.encode()
+        return self._TYPE_YAML + yaml.dump(value, Dumper=Dumper).encode()
+
+    @staticmethod
+    def _write_atomic(fn: str, data: bytes):
+        temp_fn = f'{fn}.tmp'
+        with open(temp_fn, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_fn, fn)
+
+
+def main():
+    from utils.repl_support import get_db  # Loads the db backends
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('command', choices=['list', 'create', 'restore'])
+    parser.add_argument('name', nargs='?', help='Backup to restore')
+    args = parser.parse_args()
+    setup_logging()
+    store = BackupStore()
+    if args.command == 'list':
+        for name in store.names():
+            kind = 'full' if store.is_full(name) else 'delta'
+            print(f'{name} ({kind})')
+    elif args.command == 'create':
+        print(f'Created {store.create(get_db())}')
+    else:
+        if args.name is None:
+            parser.error('name is required to restore')
+        store.restore(args.name, get_db())
+        print(f'Restored {args.name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, tzinfo
+
+
+class Clock:
+    """
+    Source of the current time and of sleeps for code that schedules work
+    (the alert subsystem) so it can be run in simulated time (see
+    FakeClock). Uses a singleton like KeyedScheduler, replaced with
+    set_instance.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls) -> 'Clock':
+        if cls._instance is None:
+            cls._instance = Clock()
+        return cls._instance
+
+    @classmethod
+    def set_instance(cls, clock: 'Clock'):
+        cls._instance = clock
+
+    def now(self, tz: tzinfo = None) -> datetime:
+        return datetime.now(tz)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    async def wait(self, event: asyncio.Event, timeout: float = None) -> bool:
+        """
+        Waits until event is set or timeout seconds pass
+        :return: True if the event was set
+        """
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class FakeClock(Clock):
+    """
+    Simulated time that only moves when advanced. Sleeps and timed waits
+    advance it by their full duration straight away (so a year of sleeping
+    takes no time).
+
+    NB: Tasks sleeping at the same time each advance the clock so it runs
+    ahead when several tasks sleep concurrently
+    """
+
+    def __init__(self, start: datetime):
+        """
+        :param start: The time to start at (timezone aware)
+        """
+        self._now = start
+        self._monotonic = 0.0
+        self.sleeps = 0  # Number of sleeps and timed waits
+
+    def advance(self, seconds: float):
+        self._now += timedelta(seconds=seconds)
+        self._monotonic += seconds
+
+    def now(self, tz: tzinfo = None) -> datetime:
+        if tz is None:
+            # Naive local time like datetime.now()
+            return self._now.astimezone().replace(tzinfo=None)
+        return self._now.astimezone(tz)
+
+    def monotonic(self) -> float:
+        return self._monotonic
+
+    async def sleep(self, seconds: float):
+        self.sleeps += 1
+        if seconds > 0:
+            self.advance(seconds)
+        await asyncio.sleep(0)
+
+    async def wait(self, event: asyncio.Event, timeout: float = None) -> bool:
+        if event.is_set():
+            return True
+        if timeout is None:
+            await event.wait()  # Until another task sets it
+            return True
+        await self.sleep(timeout)
+        return event.is_set()
@@ -0,0 +1,115 @@
+"""
+Codecs convert objects to the strings stored in the db and back. DBCache
+accepts any object with encode and decode methods (see DBCache.__setitem__).
+"""
+import base64
+import json
+import marshal
+
+import yaml
+
+from conf import Conf
+
+try:
+    from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+    from yaml import Loader, Dumper
+
+
+class YamlCodec:
+    """
+    Python objects as yaml (including !!python/object tags). Format used
+    before SchemaCodec.
+    """
+
+    @staticmethod
+    def encode(obj) -> str:
+        return yaml.dump(obj, Dumper=Dumper)
+
+    @staticmethod
+    def decode(text: str):
+        return yaml.load(text, Loader=Loader)
+
+
+YAML = YamlCodec()
+
+
+class SchemaCodec:
+    """
+    Converts objects through an explicit schema instead of saving their
+    python attributes. The class passed must provide:
+        - SCHEMA_VERSION: int incremented when the output of to_dict changes
+        - to_dict(self): Returns the object as dicts, lists, str, int,
+            float, bool and None only
+        - from_dict(cls, data): Class method that rebuilds the object
+        - SCHEMA_MIGRATIONS (Optional): dict of version -> function that
+            converts data from to_dict at that version into the format of the
+            next version
+
+    Stored form: MARKER<format>:<schema version>:<payload> where format is
+        - j: JSON (default, readable)
+        - b: base64 encoded marshal of the dict (decodes a little faster
+            but base64 makes it larger than JSON)
+    Anything without MARKER is treated as yaml saved before this codec was
+    used. It is loaded with YamlCodec and passed through to_dict/from_dict to
+    normalize it.
+
+    NB: marshal data is only read back from our own db (it is not safe for
+    untrusted input) and is tied to the python version's marshal format
+    (version 4 used).
+    """
+    MARKER = '!sc:'
+    BINARY = 'binary'
+    JSON = 'json'
+    _FORMAT_TAGS = {BINARY: 'b', JSON: 'j'}
+
+    def __init__(self, cls, format_: str = None):
+        """
+        :param cls: The class being encoded (See class docstring)
+        :param format_: SchemaCodec.BINARY or SchemaCodec.JSON (Default
+            Conf.DB.CODEC)
+        """
+        self.cls = cls
+        self.format = Conf.DB.CODEC if format_ is None else format_
+        if self.format not in self._FORMAT_TAGS:
+            raise ValueError(f'Unknown codec format: {self.format}')
+
+    def encode(self, obj) -> str:
+        data = obj.to_dict()
+        if self.format == self.BINARY:
+            payload = base64.b64encode(marshal.dumps(data, 4)).decode()
+        else:
+            payload = json.dumps(data, separators=(',', ':'))
+        return f'{self.MARKER}{self._FORMAT_TAGS[self.format]}:' \
+               f'{self.cls.SCHEMA_VERSION}:{payload}'
+
+    def decode(self, text: str):
+        if not text.startswith(self.MARKER):
+            return self.from_legacy(YAML.decode(text))
+        tag, version, payload = text[len(self.MARKER):].split(':', 2)
+        if tag == self._FORMAT_TAGS[self.BINARY]:
+            data = marshal.loads(base64.b64decode(payload))
+        else:
+            data = json.loads(payload)
+        return self.cls.from_dict(self.migrate(data, int(version)))
+
+    def migrate(self, data: dict, version: int) -> dict:
+        """
+        Converts data saved at version to the current schema version
+        """
+        if version > self.cls.SCHEMA_VERSION:
+            raise ValueError(
+                f'{self.cls.__name__} saved with schema version {version} '
+                f'but only up to {self.cls.SCHEMA_VERSION} is supported')
+        migrations = getattr(self.cls, 'SCHEMA_MIGRATIONS', {})
+        while version < self.cls.SCHEMA_VERSION:
+            data = migrations[version](data)
+            version += 1
+        return data
+
+    def from_legacy(self, obj):
+        """
+        Migration hook for objects loaded from yaml saved before this codec
+        was used
+        """
+        return self.cls.from_dict(obj.to_dict())
@@ -0,0 +1,147 @@
+from typing import Iterable
+
+
+class CowList:
+    """
+    List like container that supports O(1) copies by sharing its storage
+    until one of the copies is changed (copy-on-write). Used to take
+    point-in-time snapshots of state that is being changed by the bot.
+
+    version is incremented on every change.
+
+    NB: Only the container is copied on write, items are shared.
+    """
+
+    def __init__(self, items: Iterable = ()):
+        self._items = list(items)
+        self._shared = False  # If true _items must be copied before changing
+        self.version = 0
+
+    def copy(self) -> 'CowList':
+        result = CowList.__new__(CowList)
+        result._items = self._items
+        result._shared = True
+        result.version = self.version
+        self._shared = True
+        return result
+
+    def append(self, item):
+        self._before_change()
+        self._items.append(item)
+
+    def remove(self, item):
+        self._before_change()
+        self._items.remove(item)
+
+    def _before_change(self):
+        if self._shared:
+            self._items = list(self._items)
+            self._shared = False
+        self.version += 1
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __eq__(self, other):
+        if isinstance(other, CowList):
+            return self._items == other._items
+        if isinstance(other, list):
+            return self._items == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f'CowList({self._items!r})'
+
+    def __getstate__(self):
+        return {'items': self._items, 'version': self.version}
+
+    def __setstate__(self, state):
+        self._items = list(state['items'])
+        self._shared = False
+        self.version = state['version']
+
+
+class CowDict:
+    """
+    Dict like container with O(1) copies, see CowList.
+    """
+
+    def __init__(self, items: dict = None):
+        self._items = {} if items is None else dict(items)
+        self._shared = False  # If true _items must be copied before changing
+        self.version = 0
+
+    def copy(self) -> 'CowDict':
+        result = CowDict.__new__(CowDict)
+        result._items = self._items
+        result._shared = True
+        result.version = self.version
+        self._shared = True
+        return result
+
+    def __setitem__(self, key, value):
+        self._before_change()
+        self._items[key] = value
+
+    def pop(self, key, *default):
+        if key not in self._items:
+            return self._items.pop(key, *default)  # Default or KeyError
+        self._before_change()
+        return self._items.pop(key)
+
+    def _before_change(self):
+        if self._shared:
+            self._items = dict(self._items)
+            self._shared = False
+        self.version += 1
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def get(self, key, default=None):
+        return self._items.get(key, default)
+
+    def keys(self):
+        return self._items.keys()
+
+    def values(self):
+        return self._items.values()
+
+    def items(self):
+        return self._items.items()
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __eq__(self, other):
+        if isinstance(other, CowDict):
+            return self._items == other._items
+        if isinstance(other, dict):
+            return self._items == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f'CowDict({self._items!r})'
+
+    def __getstate__(self):
+        return {'items': self._items, 'version': self.version}
+
+    def __setstate__(self, state):
+        self._items = dict(state['items'])
+        self._shared = False
+        self.version = state['version']
@@ -1,140 +1,643 @@
+import asyncio
+import atexit
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 
-import yaml
-
 from conf import Conf
+from utils.codec import YAML
 from utils.log import log
 from utils.timer_funcs import set_timeout
+from utils.value_packing import chunk_count, chunk_key, is_chunk_key, pack, \
+    unpack
 
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
+# Placeholder value for keys deleted but not removed from the db yet
+_DELETED = object()
 
 
 class DBCache:
     """
     Provides a write cache for dict like databases.
+
+    Sets are coalesced and written out together at most every
+    Conf.SAVE_CACHE_DELAY seconds, or sooner if more than
+    Conf.DB.MAX_DIRTY_BYTES are waiting. When called from a running asyncio
+    loop the write out is scheduled on that loop and the serialization and
+    writing happen on a single worker thread so the loop is not blocked.
+    Without a running loop a timer thread is used instead.
+
     ASSUMPTIONS:
-        - Keys are not tuples (they are used to trigger conversion to yaml
-            (see __setitem__ for more info)
+        - Keys are not tuples (they are used to pass a codec (see
+            __setitem__ for more info)
         - Database is not updated elsewhere
-        - Thead safety is not an issue, uses blocking routines expected to
-            complete in a single pass (operations are not atomic)
+        - Values set with a codec are either not mutated while they are
+            being encoded on the worker thread or provide a snapshot
+            method returning a copy unaffected by later changes (taken on the
+            thread that triggers the write out)
+
+    Objects decoded are kept after the cache is written out so later reads
+    do not decode them again. Setting a key already in this read cache
+    replaces the object kept, keys only written (eg. OpLogState snapshots)
+    are not added. The read cache is bounded to Conf.DB.READ_CACHE_SIZE
+    entries (least recently used dropped first) if that is not None. NB: The
+    same object is returned on each read, use invalidate to force the value
+    to be decoded again.
+
+    A fingerprint of each string written to (or read from) the db is kept
+    and writes of unchanged values are skipped. Counts are kept in stats.
+
+    Large strings are compressed and if needed split across several keys
+    before being written (see value_packing). stats records the bytes before
+    (raw_bytes) and after (stored_bytes) this for the values written.
+
+    Deletes (see delete) are cached and written out with the sets.
+
+    If a write out fails its values are put back in the cache (unless set
+    again since) and written with the next one, which from the loop is
+    retried after Conf.SAVE_CACHE_DELAY.
+
+    close (or aclose from the loop) writes out anything still cached. It is
+    also registered to run at exit so values set inside the
+    Conf.SAVE_CACHE_DELAY window are not lost on a normal exit.
     """
 
     def __init__(self, db_backing: dict):
         self.db_backing = db_backing
-        self.cache = {}  # Values sent but not written to db yet
+        # Values sent but not written to db yet. key -> (value, codec) with
+        # codec None for values that are not converted before submitting to
+        # db. Kept together so another thread reads both at once
+        self.cache = {}
+
+        # Values handed to the worker but not written to db yet (same form)
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+        # Size of each key when last written (used to estimate dirty bytes)
+        self._sizes = {}
+        # Bytes counted for each key in the cache (see _dirty_bytes)
+        self._dirty_sizes = {}
+        self._dirty_total = 0
+
+        # Single worker so writes reach the db in the order they were taken
+        self._executor = ThreadPoolExecutor(max_workers=1,
+                                            thread_name_prefix='DBCache')
+        self._flush_lock = None  # Created on first use inside the loop
+
+        # Objects already decoded (Read cache)
+        self._decoded = OrderedDict()
+
+        # Fingerprint of the value currently in the db for each key
+        self._fingerprints = {}
+        self.stats = {'writes': 0, 'skipped_writes': 0, 'raw_bytes': 0,
+                      'stored_bytes': 0}
 
-        # values that need to be converted before submitting to db
-        self.to_yaml = set()
+        # Number of chunk keys used by each key in the db (if known)
+        self._chunk_counts = {}
 
         self._timer_write_out = None
         self.last_write_time = datetime.now()
+        self._is_closed = False
+        atexit.register(self.close)
 
     def __contains__(self, item):
-        return item in self.cache or item in self.db_backing
+        pending = self._pending(item)
+        if pending is not None:
+            return pending[0] is not _DELETED
+        return item in self.db_backing
+
+    def _pending(self, key):
+        """
+        :return: (value, codec) of a key set but not written to the db yet or
+            None. Each dict is read once without a lock as the loop can swap
+            the cache and the worker can remove in flight values at any time
+            (a key is added to the in flight values before it leaves the
+            cache and only removed after it is written)
+        """
+        pending = self.cache.get(key)
+        if pending is not None:
+            return pending
+        return self._in_flight.get(key)
 
     def __setitem__(self, key, value):
         """
-        Sets the value for key to the value passed. NB: If yaml is needed then
-            a tuple should be passed as the key. The first element of the tuple
-            should be the key and the second the value of should_yaml EG. db[
-            'key', True] = 'apple'
-        :param key: The key to set or tuple of form (key, should_yaml)
+        Sets the value for key to the value passed. NB: If the value needs to
+            be encoded then a tuple should be passed as the key. The first
+            element of the tuple should be the key and the second the codec
+            EG. db['key', True] = 'apple'
+        :param key: The key to set or tuple of form (key, codec). codec is an
+            object with encode and decode methods (see utils.codec), True for
+            yaml or False for none
         :param value: The value to set
         """
         log(f'[DB Cache] received request to set {key}', logging.DEBUG)
         if isinstance(key, tuple):
-            key, should_yaml = key
+            key, codec = key
+        else:
+            codec = None
+        codec = self._resolve_codec(codec)
+        self.cache[key] = (value, codec)
+        self._count_dirty(key, value)
+        if codec is not None and key in self._decoded:
+            self._remember(key, value)  # Keep reads of this key up to date
         else:
-            should_yaml = False
-        self.cache[key] = value
-        if should_yaml:
-            self.to_yaml.add(key)
-
-        if not self.is_write_pending:
-            sec_before_save_allowed = \
-                Conf.SAVE_CACHE_DELAY \
-                - (datetime.now() - self.last_write_time).total_seconds()
+            self.invalidate(key)
+        self._after_change()
+
+    def delete(self, key):
+        """
+        Removes the key from the db (with the other cached writes). Does
+        nothing if the key does not exist.
+        :param key: The key to remove
+        """
+        log(f'[DB Cache] received request to delete {key}', logging.DEBUG)
+        self.cache[key] = (_DELETED, None)
+        self._count_dirty(key, _DELETED)
+        self.invalidate(key)
+        self._after_change()
+
+    def _after_change(self):
+        """
+        Makes sure the cache will be written out after a set or delete
+        """
+        loop = self._get_running_loop()
+        if loop is not None:
+            self._schedule_flush(loop)
+        elif not self.is_write_pending:
+            sec_before_save_allowed = self._sec_before_save_allowed()
             if sec_before_save_allowed < 0:
                 self._write_to_backing()
             else:
                 self._timer_write_out = set_timeout(sec_before_save_allowed,
                                                     self._write_to_backing)
 
-    def get(self, key, should_yaml=False):
+    def get(self, key, codec=None):
         """
         Retrieves a value corresponding to the key passed if not present
             returns None.
         :param key: The key to use to retrieve the value
-        :param should_yaml: if the value need to be converted from yaml
+        :param codec: Codec to decode the value with, True for yaml or None
         :return: The value corresponding to the key passed
         """
-        if key in self.cache:
-            result = self.cache[key]
+        codec = self._resolve_codec(codec)
+        pending = self._pending(key)
+        if pending is not None:
+            result, is_decoded = pending[0], pending[1] is not None
+        elif codec is not None and key in self._decoded:
+            self._decoded.move_to_end(key)
+            return self._decoded[key]
         else:
-            result = self.db_backing.get(key)
+            result, chunks = self._read_backing(key)
+            is_decoded = False
+            if isinstance(result, str):
+                self._chunk_counts[key] = chunks
+                self._fingerprints[key] = self._fingerprint(result)
 
-        if should_yaml and result is not None:
-            return yaml.load(result, Loader=Loader)
+        if result is _DELETED:
+            return None
+        if codec is not None and result is not None and not is_decoded:
+            result = codec.decode(result)
+            self._remember(key, result)
+        return result
+
+    def _read_backing(self, key):
+        """
+        :return: The value for key in the db (unpacked) or None and the
+            number of chunk keys it uses
+        """
+        result = self.db_backing.get(key)
+        if not isinstance(result, str):
+            return result, 0
+        return unpack(result, self.db_backing.get, key), chunk_count(result)
+
+    def reader(self) -> 'DBCacheReader':
+        """
+        :return: Read only view for loading on another thread
+        """
+        return DBCacheReader(self)
+
+    @staticmethod
+    def _resolve_codec(codec):
+        """
+        Converts the shorthands True (yaml) and False (none) to codecs
+        """
+        if codec is True:
+            return YAML
+        if codec is False:
+            return None
+        return codec
+
+    def invalidate(self, key=None):
+        """
+        Removes decoded objects from the read cache so they are decoded from
+            the db again on the next read
+        :param key: The key to invalidate or None to invalidate all keys
+        """
+        if key is None:
+            self._decoded.clear()
         else:
-            return result
+            self._decoded.pop(key, None)
+
+    def _remember(self, key, value):
+        """
+        Adds a decoded object to the read cache, dropping the least recently
+            used objects if it is full
+        """
+        self._decoded[key] = value
+        self._decoded.move_to_end(key)
+        if Conf.DB.READ_CACHE_SIZE is not None:
+            while len(self._decoded) > Conf.DB.READ_CACHE_SIZE:
+                self._decoded.popitem(last=False)
 
     def __getitem__(self, key):
         """
-        Gets the value for they key specified. NB: If yaml is needed then
-            a tuple should be passed as the key. The first element
-            of the tuple should be the key and the second the value of
-            should_yaml EG. db['key', True] = 'apple'
-        :param key: The key to set or tuple of form (key, should_yaml)
+        Gets the value for they key specified. NB: If the value needs to be
+            decoded then a tuple should be passed as the key. The first
+            element of the tuple should be the key and the second the codec
+            EG. db['key', True]
+        :param key: The key to get or tuple of form (key, codec)
         :return:
         """
         if isinstance(key, tuple):
-            key, should_yaml = key
+            key, codec = key
         else:
-            should_yaml = False
+            codec = None
 
-        if key in self.cache:
-            # No concern for yaml because not written to db yet
-            return self.cache[key]
+        pending = self._pending(key)
+        if pending is not None and pending[0] is _DELETED:
+            raise KeyError(key)  # Delete not written out yet
+        elif key in self:
+            return self.get(key, codec=codec)
         else:
-            if key in self.db_backing:
-                # to make use of yaml code there
-                return self.get(key, should_yaml=should_yaml)
+            return self.db_backing[key]  # To trigger correct exception
+
+    async def flush(self):
+        """
+        Barrier that returns once every value set before the call has been
+        written to the db. Serialization and writing run on the worker thread.
+        """
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        self._cancel_timer()
+        async with self._flush_lock:
+            if len(self.cache) > 0:
+                cache = self.cache
+                try:
+                    await asyncio.wrap_future(self._submit_pending())
+                except Exception:
+                    self._restore_failed(cache)
+                    raise
             else:
-                return self.db_backing[key]  # To trigger correct exception
+                # Still wait for anything already handed to the worker
+                await asyncio.wrap_future(self._executor.submit(lambda: None))
 
-    def _write_to_backing(self):
+    async def run_exclusive(self, function, *args):
         """
-        Writes the cache to the db. Using existence in self.to_yaml to know
-            if that value has to converted to a yaml string before saving to db
-        ASSUMPTION: Function completes in its entirety without any other
-            thread calling any of the other functions
+        Flushes then runs function on the worker thread. No writes reach the
+        db while it runs so it sees a consistent point in time (eg. for a
+        backup) without blocking the loop.
+        :return: The result of function
+        """
+        await self.flush()
+        return await asyncio.wrap_future(
+            self._executor.submit(function, *args))
+
+    async def aclose(self):
+        """
+        Writes out everything still cached then closes (from the loop)
+        """
+        await self.flush()
+        self.close()
+
+    def close(self):
+        """
+        Writes out everything still cached, waits for the worker and closes
+        the backing db if it can be closed. Blocks, from the loop use aclose
+        """
+        if self._is_closed:
+            return
+        self._cancel_timer()
+        if len(self.cache) > 0:
+            log(f'[DB Cache] Writing {len(self.cache)} cached values before '
+                f'closing')
+            self._write_to_backing()
+        self._executor.shutdown(wait=True)
+        self._is_closed = True
+        if hasattr(self.db_backing, 'close'):
+            self.db_backing.close()
+
+    def _schedule_flush(self, loop: asyncio.AbstractEventLoop):
+        """
+        Makes sure a flush is scheduled on the loop. Flushes immediately if
+        too many bytes are dirty.
+        """
+        if self._dirty_bytes() >= Conf.DB.MAX_DIRTY_BYTES:
+            self._cancel_timer()
+            delay = 0
+        elif self.is_write_pending:
+            return  # Coalesced into the pending flush
+        else:
+            delay = max(self._sec_before_save_allowed(), 0)
+        self._timer_write_out = loop.call_later(
+            delay, lambda: loop.create_task(self._flush_from_timer()))
+
+    async def _flush_from_timer(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            log(f'[DB Cache] Exception writing to db: {e}', logging.ERROR)
+            if len(self.cache) > 0 and not self.is_write_pending:
+                # Values were put back in the cache, try again later
+                loop = asyncio.get_running_loop()
+                self._timer_write_out = loop.call_later(
+                    Conf.SAVE_CACHE_DELAY,
+                    lambda: loop.create_task(self._flush_from_timer()))
+
+    def _sec_before_save_allowed(self) -> float:
+        return Conf.SAVE_CACHE_DELAY \
+               - (datetime.now() - self.last_write_time).total_seconds()
+
+    def _count_dirty(self, key, value):
+        """
+        Updates the dirty bytes estimate for a value set in the cache
+        """
+        size = len(value) if isinstance(value, str) \
+            else self._sizes.get(key, 0)
+        self._dirty_total += size - self._dirty_sizes.get(key, 0)
+        self._dirty_sizes[key] = size
+
+    def _dirty_bytes(self) -> int:
+        """
+        Estimate of the bytes that would be written by a flush now (kept up
+        to date by each set so it is O(1)). Values not written before are
+        only counted if they are strings
+        """
+        return self._dirty_total
+
+    def _cancel_timer(self):
+        if self._timer_write_out is not None:
+            self._timer_write_out.cancel()
+            self._timer_write_out = None
+
+    def _submit_pending(self):
+        """
+        Hands the cache to the worker thread and starts a new empty cache.
+        :return: Future that completes when the values have been written
+        """
+        cache = self.cache
+        to_write = {}
+        with self._in_flight_lock:
+            for key, entry in cache.items():
+                self._in_flight[key] = entry
+                value, codec = entry
+                if codec is not None and hasattr(value, 'snapshot'):
+                    # Worker must not see changes made after this point
+                    to_write[key] = (value.snapshot(), codec)
+                else:
+                    to_write[key] = (value, codec)
+        # Only swapped once the values are in flight so readers on other
+        # threads always find them in one or the other
+        self.cache = {}
+        self._dirty_sizes = {}
+        self._dirty_total = 0
+        self._timer_write_out = None
+        try:
+            return self._executor.submit(self._write_items, to_write, cache)
+        except RuntimeError:
+            # Worker already stopped (executors are shut down before atexit
+            # functions run) so written on this thread instead
+            result = Future()
+            try:
+                result.set_result(self._write_items(to_write, cache))
+            except Exception as e:
+                result.set_exception(e)
+            return result
+
+    def _write_items(self, to_write: dict, cache: dict):
+        """
+        Writes the values passed to the db. Values with a codec are encoded
+            before saving to db
+        ASSUMPTION: Only run on the worker thread
+        :param to_write: The values to write and their codecs (None if the
+            value is not encoded)
+        :param cache: The values as they were set (used to tell when the key
+            is no longer in flight)
         """
         log('[DB Cache] Purging')
-        for key in self.cache.keys():
-            value = self.cache[key]
-            if key in self.to_yaml:
-                value = yaml.dump(value, Dumper=Dumper)
-            self.db_backing[key] = value
+        skipped = 0
+        changed = {}
+        fingerprints = {}
+        chunk_counts = {}
+        stale_chunks = []
+        deleted = []
+        for key, (value, codec) in to_write.items():
+            if value is _DELETED:
+                deleted.append(key)
+                self._load_chunk_count(key)
+                stale_chunks.extend(chunk_key(key, i) for i in
+                                    range(self._chunk_counts.pop(key, 0)))
+                self._fingerprints.pop(key, None)
+                self._sizes.pop(key, None)
+                continue
+            if codec is not None:
+                value = codec.encode(value)
+            if isinstance(value, str):
+                self._sizes[key] = len(value)
+                fingerprint = self._fingerprint(value)
+                if self._fingerprints.get(key) == fingerprint:
+                    skipped += 1
+                    continue  # Value in db is already the same
+                fingerprints[key] = fingerprint
+                self._load_chunk_count(key)
+                packed = pack(key, value)
+                chunk_counts[key] = chunk_count(packed[key])
+                stale_chunks.extend(
+                    chunk_key(key, i) for i in range(
+                        chunk_counts[key], self._chunk_counts.get(key, 0)))
+                self.stats['raw_bytes'] += len(value)
+                self.stats['stored_bytes'] += \
+                    sum(len(x) for x in packed.values())
+                changed.update(packed)
+            else:
+                self._sizes[key] = 0
+                changed[key] = value
+
+        if hasattr(self.db_backing, 'write_many'):
+            # Backing supports writing and removing all the keys in one
+            # transaction
+            self.db_backing.write_many(changed, deleted + stale_chunks)
+        else:
+            for key, value in changed.items():
+                self.db_backing[key] = value
+            for key in deleted + stale_chunks:
+                if key in self.db_backing:
+                    self.db_backing.pop(key)
+        for key in changed.keys():
+            self._fingerprints.pop(key, None)
+        self._fingerprints.update(fingerprints)
+        self._chunk_counts.update(chunk_counts)
 
-        # Register save time and clear timer variable
+        self.stats['writes'] += len(cache) - skipped
+        log(f'[DB Cache] Bytes written raw: {self.stats["raw_bytes"]} '
+            f'stored: {self.stats["stored_bytes"]}', logging.DEBUG)
+        self.stats['skipped_writes'] += skipped
+        if skipped > 0:
+            log(f'[DB Cache] Skipped {skipped} of {len(cache)} unchanged '
+                f'values (Total skipped: {self.stats["skipped_writes"]})',
+                logging.DEBUG)
+
+        # Register save time
         self.last_write_time = datetime.now()
-        self._timer_write_out = None
 
-        # reset cache and to_yaml
-        self.cache = {}
-        self.to_yaml = set()
+        with self._in_flight_lock:
+            for key, entry in cache.items():
+                if self._in_flight.get(key) is entry:
+                    self._in_flight.pop(key)
+
+    def _load_chunk_count(self, key):
+        """
+        Reads the number of chunk keys used by the value in the db if not
+            known (eg. written by an earlier run) so a write that uses fewer
+            chunks can remove the rest
+        ASSUMPTION: Only run on the worker thread
+        """
+        if key not in self._chunk_counts:
+            stored = self.db_backing.get(key)
+            self._chunk_counts[key] = \
+                chunk_count(stored) if isinstance(stored, str) else 0
+
+    def _write_to_backing(self):
+        """
+        Writes the cache to the db and waits for the write to complete
+        """
+        cache = self.cache
+        try:
+            self._submit_pending().result()
+        except Exception:
+            self._restore_failed(cache)
+            raise
+
+    def _restore_failed(self, cache: dict):
+        """
+        Puts the values of a failed write out back in the cache so they are
+            written with the next one. Keys set again since are left alone.
+        :param cache: The values (and codecs) as they were handed to the
+            worker
+        """
+        with self._in_flight_lock:
+            for key, entry in cache.items():
+                if self._in_flight.get(key) is not entry:
+                    continue  # Newer value already handed to the worker
+                self._in_flight.pop(key)
+                if key not in self.cache:
+                    self.cache[key] = entry
+                    self._count_dirty(key, entry[0])
+        log(f'[DB Cache] Kept {len(cache)} values after a failed write',
+            logging.WARNING)
+
+    @staticmethod
+    def _fingerprint(value: str) -> bytes:
+        return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+    @staticmethod
+    def _get_running_loop():
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
 
     @property
     def is_write_pending(self):
         return self._timer_write_out is not None
 
     def keys(self):
-        if self.is_write_pending:
-            self._timer_write_out.cancel()
-            self._write_to_backing()
-        return self.db_backing.keys()
+        return list(self.iter_keys())
+
+    def iter_keys(self, prefix: str = None):
+        """
+        Lazily lists the keys including those not written to the db yet.
+            Does not trigger a write out.
+        :param prefix: If not None only keys starting with prefix are listed
+        """
+        pending = set()
+        for key in list(self.cache.keys()) + list(self._in_flight.keys()):
+            if key not in pending \
+                    and (prefix is None or key.startswith(prefix)):
+                pending.add(key)
+                if key in self:
+                    yield key
+        for key in self._backing_keys(prefix):
+            if key not in pending and not is_chunk_key(key):
+                yield key
+
+    def items(self, prefix: str = None):
+        """
+        Lazily lists the keys and values with the values in the form they are
+            stored in the db (values set with a codec are encoded).
+            Values are read one at a time and a write out is not triggered.
+        :param prefix: If not None only keys starting with prefix are listed
+        """
+        for key in self.iter_keys(prefix):
+            value = self._stored_form(key)
+            if value is not None:
+                yield key, value
+
+    def _stored_form(self, key):
+        """
+        :return: The value for key encoded if needed (or None if the key does
+            not exist)
+        """
+        pending = self._pending(key)
+        if pending is None:
+            return self.get(key)
+        value, codec = pending
+        if value is _DELETED:
+            return None
+        if codec is not None:
+            if hasattr(value, 'snapshot'):
+                value = value.snapshot()
+            value = codec.encode(value)
+        return value
+
+    def _backing_keys(self, prefix: str = None):
+        if prefix is not None and hasattr(self.db_backing, 'prefix'):
+            # Let the db do the filtering
+            return self.db_backing.prefix(prefix)
+        return [key for key in list(self.db_backing.keys())
+                if prefix is None or key.startswith(prefix)]
+
+
+class DBCacheReader:
+    """
+    Read only view of a DBCache that can be used from another thread (eg. to
+    load a cog's data without blocking the loop). Values set but not written
+    yet are seen as with DBCache.get but nothing in the DBCache is changed
+    (values decoded are not added to its read cache).
+    """
+
+    def __init__(self, cache: DBCache):
+        self._cache = cache
+
+    def __contains__(self, item):
+        return item in self._cache
+
+    def iter_keys(self, prefix: str = None):
+        return self._cache.iter_keys(prefix)
+
+    def get(self, key, codec=None):
+        """
+        See DBCache.get
+        """
+        codec = DBCache._resolve_codec(codec)
+        pending = self._cache._pending(key)
+        if pending is not None:
+            result, is_decoded = pending[0], pending[1] is not None
+            if result is _DELETED:
+                return None
+        else:
+            result, is_decoded = self._cache._read_backing(key)[0], False
+        if codec is not None and result is not None and not is_decoded:
+            result = codec.decode(result)
+        return result
@@ -1,9 +1,18 @@
 # Couldn't use shelve because close is never called in client code
+import atexit
 import logging
+import os
+import struct
+import threading
 from os import path
+from typing import Iterable
 
 import yaml
 
+from conf import Conf
+from utils.log import log
+from utils.timer_funcs import set_timeout
+
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
 except ImportError:
@@ -28,6 +37,8 @@ class DictPersistent:
         else:
             with open(file_name, 'r') as f:
                 self.data = yaml.load(f, Loader=Loader)
+            if self.data is None:
+                self.data = {}  # Empty file
             if not isinstance(self.data, dict):
                 logging.log(logging.ERROR,
                             f'Data loaded from {file_name} was not a dict. '
@@ -55,6 +66,237 @@ class DictPersistent:
         self.save()
         return result
 
+    def write_many(self, items: dict, deletes: Iterable[str] = ()):
+        """
+        Sets all the values passed with a single write of the file
+        :param items: The keys and values to set
+        :param deletes: Keys to remove (keys not present are ignored)
+        """
+        self.data.update(items)
+        for key in deletes:
+            self.data.pop(key, None)
+        self.save()
+
     def save(self):
         with open(self.filename, 'w') as f:
             f.write(yaml.dump(self.data, Dumper=Dumper))
+
+
+class FsyncPolicy:
+    ALWAYS = 'always'  # Commit and fsync every record as it is written
+    GROUP = 'group'  # fsync once per group commit
+    NEVER = 'never'  # Leave flushing to disk up to the OS
+
+
+class DictPersistentJournaled(DictPersistent):
+    """
+    DictPersistent that appends each set/pop to a journal file instead of
+    rewriting the whole file. On object creation the journal is replayed on
+    top of the base file. Once the journal grows past compact_ratio times the
+    size of the base file it is folded into the base file on a background
+    thread.
+
+    Writes are group committed. Records are buffered and appended together
+    when group_size records are waiting or group_delay seconds after the
+    first one was buffered, whichever is first.
+
+    Journal record format: 4 byte big endian length followed by a yaml dump
+    of [op, key(, value)].
+    """
+    _SET = 's'
+    _POP = 'p'
+    _LEN_HEADER = struct.Struct('>I')
+
+    def __init__(self, file_name: str = 'dict_persistent.yaml', *,
+                 fsync_policy: str = None, group_size: int = None,
+                 group_delay: float = None, compact_ratio: float = None):
+        self.fsync_policy = \
+            Conf.DB.JOURNAL_FSYNC if fsync_policy is None else fsync_policy
+        self.group_size = \
+            Conf.DB.JOURNAL_GROUP_SIZE if group_size is None else group_size
+        self.group_delay = \
+            Conf.DB.JOURNAL_GROUP_DELAY if group_delay is None else group_delay
+        self.compact_ratio = \
+            Conf.DB.JOURNAL_COMPACT_RATIO if compact_ratio is None \
+            else compact_ratio
+
+        # Needed because commits and compaction finish on other threads
+        self._lock = threading.RLock()
+        self._pending = []  # Encoded records not yet written to the journal
+        self._timer_commit = None
+        self._compactor = None
+
+        super().__init__(file_name)
+        self.journal_filename = f'{file_name}.journal'
+        self._compacting_filename = f'{file_name}.journal.compacting'
+
+        # A compacting file only remains if compaction was interrupted
+        interrupted_compaction = path.exists(self._compacting_filename)
+        self._replay(self._compacting_filename)
+        self._replay(self.journal_filename)
+
+        self._journal = open(self.journal_filename, 'ab')
+        self._journal_bytes = self._journal.tell()
+        self._base_bytes = path.getsize(file_name)
+        if interrupted_compaction:
+            self._start_compaction(wait=True)
+
+        atexit.register(self.close)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self.data[key] = value
+            self._append([self._SET, key, value])
+
+    def pop(self, key):
+        with self._lock:
+            result = self.data.pop(key)
+            self._append([self._POP, key])
+            return result
+
+    def write_many(self, items: dict, deletes: Iterable[str] = ()):
+        """
+        Sets all the values passed and commits them as one group
+        :param items: The keys and values to set
+        :param deletes: Keys to remove in the same group (keys not present
+            are ignored)
+        """
+        with self._lock:
+            for key, value in items.items():
+                self.data[key] = value
+                self._pending.append(self._encode([self._SET, key, value]))
+            for key in deletes:
+                if key in self.data:
+                    del self.data[key]
+                    self._pending.append(self._encode([self._POP, key]))
+            self.commit()
+
+    def save(self):
+        """
+        Commits any buffered records to the journal
+        """
+        self.commit()
+
+    def commit(self):
+        """
+        Writes buffered records to the journal as a single group and starts a
+        compaction if the journal has grown too large
+        """
+        with self._lock:
+            if self._timer_commit is not None:
+                self._timer_commit.cancel()
+                self._timer_commit = None
+            if len(self._pending) == 0:
+                return
+            buffer = b''.join(self._pending)
+            self._pending = []
+            self._journal.write(buffer)
+            self._journal.flush()
+            if self.fsync_policy != FsyncPolicy.NEVER:
+                os.fsync(self._journal.fileno())
+            self._journal_bytes += len(buffer)
+            if self._should_compact():
+                self._start_compaction()
+
+    def close(self):
+        """
+        Commits outstanding records and waits for any compaction to finish
+        """
+        self.commit()
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if not self._journal.closed:
+                self._journal.close()
+
+    def _append(self, record: list):
+        self._pending.append(self._encode(record))
+        if self.fsync_policy == FsyncPolicy.ALWAYS \
+                or len(self._pending) >= self.group_size:
+            self.commit()
+        elif self._timer_commit is None:
+            self._timer_commit = set_timeout(self.group_delay, self.commit)
+
+    def _encode(self, record: list) -> bytes:
+        encoded = yaml.dump(record, Dumper=Dumper).encode()
+        return self._LEN_HEADER.pack(len(encoded)) + encoded
+
+    def _replay(self, file_name: str):
+        """
+        Applies the records in the journal file to self.data. A partially
+        written record at the end (eg. from a crash) is discarded
+        :param file_name: The journal to replay
+        """
+        if not path.exists(file_name):
+            return
+        with open(file_name, 'rb') as f:
+            buffer = f.read()
+        offset = 0
+        count = 0
+        while offset + self._LEN_HEADER.size <= len(buffer):
+            (length,) = self._LEN_HEADER.unpack_from(buffer, offset)
+            start = offset + self._LEN_HEADER.size
+            if start + length > len(buffer):
+                break
+            record = yaml.load(buffer[start:start + length], Loader=Loader)
+            if record[0] == self._SET:
+                self.data[record[1]] = record[2]
+            else:
+                self.data.pop(record[1], None)
+            offset = start + length
+            count += 1
+        if offset != len(buffer):
+            log(f'[DictPersistent] Discarding {len(buffer) - offset} bytes of '
+                f'incomplete record at end of {file_name}', logging.WARNING)
+            with open(file_name, 'r+b') as f:
+                f.truncate(offset)
+        log(f'[DictPersistent] Replayed {count} records from {file_name}',
+            logging.DEBUG)
+
+    def _should_compact(self) -> bool:
+        return self._compactor is None and self._journal_bytes > \
+            self.compact_ratio * max(self._base_bytes,
+                                     Conf.DB.JOURNAL_COMPACT_MIN_BYTES)
+
+    def _start_compaction(self, wait: bool = False):
+        """
+        Moves the current journal aside and writes a snapshot of the data to
+        the base file. Records written in the meantime go to a fresh journal.
+        ASSUMPTION: Called while holding self._lock
+        :param wait: If true compacts on this thread instead of a background
+            thread
+        """
+        snapshot = dict(self.data)
+        self._journal.close()
+        if path.exists(self._compacting_filename):
+            # Previous compaction never finished, snapshot covers both
+            with open(self.journal_filename, 'rb') as f:
+                extra = f.read()
+            with open(self._compacting_filename, 'ab') as f:
+                f.write(extra)
+            os.remove(self.journal_filename)
+        else:
+            os.replace(self.journal_filename, self._compacting_filename)
+        self._journal = open(self.journal_filename, 'ab')
+        self._journal_bytes = 0
+        if wait:
+            self._compact(snapshot)
+        else:
+            self._compactor = threading.Thread(target=self._compact,
+                                               args=(snapshot,), daemon=True)
+            self._compactor.start()
+
+    def _compact(self, snapshot: dict):
+        log(f'[DictPersistent] Compacting {self.filename}', logging.DEBUG)
+        temp_filename = f'{self.filename}.tmp'
+        with open(temp_filename, 'w') as f:
+            f.write(yaml.dump(snapshot, Dumper=Dumper))
+            f.flush()
+            if self.fsync_policy != FsyncPolicy.NEVER:
+                os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+        os.remove(self._compacting_filename)
+        with self._lock:
+            self._base_bytes = path.getsize(self.filename)
+            self._compactor = None
@@ -0,0 +1,346 @@
+import atexit
+import logging
+import mmap
+import os
+import struct
+import threading
+from os import path
+from typing import Iterable
+
+import yaml
+
+from conf import Conf
+from utils.dict_persistent import DictPersistentJournaled, FsyncPolicy
+from utils.log import log
+
+try:
+    from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+    from yaml import Loader, Dumper
+
+
+class DictSegmented:
+    """
+    Dict like store kept in an append-only segment file with a key to offset
+    index. Only the index is loaded on object creation, values are decoded
+    from a memory map of the segment on first access. keys and __contains__
+    are answered from the index alone.
+
+    Files:
+        - <file_name>: Records appended on every set/pop
+        - <file_name>.idx: Index saved on close covering the segment up to a
+            recorded offset. Records after that offset are indexed on open by
+            reading only their headers.
+
+    Segment record format: header (op, value type, key length, value length)
+    followed by the utf-8 key and then the value. str values are stored as
+    utf-8 and everything else as yaml.
+
+    NB: Like DictPersistent mutated objects are not written to disk. Decoded
+    values are cached and the same object is returned on each access until
+    the key is set again, so changing a returned value changes what later
+    reads see (but not the segment).
+    """
+    _OP_SET = 1
+    _OP_POP = 2
+    _TYPE_STR = 0
+    _TYPE_YAML = 1
+    _RECORD_HEADER = struct.Struct('>BBII')
+    _INDEX_HEADER = struct.Struct('>QI')  # covered offset, entry count
+    _INDEX_ENTRY = struct.Struct('>QIBI')  # offset, length, type, key length
+
+    def __init__(self, file_name: str = None, *,
+                 import_file_name: str = None, fsync_policy: str = None):
+        """
+        :param file_name: Segment file name (Default Conf.DB.SEGMENT_FILE_NAME)
+        :param import_file_name: A DictPersistent yaml file (and its
+            journal) to import if the segment file does not exist yet
+        :param fsync_policy: See FsyncPolicy (Default Conf.DB.JOURNAL_FSYNC)
+        """
+        self.filename = \
+            Conf.DB.SEGMENT_FILE_NAME if file_name is None else file_name
+        self.index_filename = f'{self.filename}.idx'
+        self.fsync_policy = \
+            Conf.DB.JOURNAL_FSYNC if fsync_policy is None else fsync_policy
+        self._lock = threading.RLock()
+
+        # key -> (offset of value, length of value, value type)
+        self._index = {}
+        self._decoded = {}  # Values already decoded
+        self._live_bytes = 0
+        self._dead_bytes = 0
+        self._mmap = None
+
+        is_new = not path.exists(self.filename)
+        self._file = open(self.filename, 'a+b')
+        covered = self._load_index()
+        self._index_tail(covered)
+        if is_new and import_file_name is not None \
+                and path.exists(import_file_name):
+            self._import(import_file_name)
+
+        atexit.register(self.close)
+
+    def __contains__(self, item):
+        return item in self._index
+
+    def __getitem__(self, item):
+        with self._lock:
+            if item not in self._decoded:
+                self._decoded[item] = self._decode(*self._index[item])
+            return self._decoded[item]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._append(self._OP_SET, key, value)
+            self._decoded.pop(key, None)
+            self._maybe_compact()
+
+    def get(self, key):
+        if key in self._index:
+            return self[key]
+        return None
+
+    def keys(self):
+        return self._index.keys()
+
+    def pop(self, key):
+        with self._lock:
+            result = self[key]
+            self._append(self._OP_POP, key)
+            self._decoded.pop(key, None)
+            self._maybe_compact()
+            return result
+
+    def write_many(self, items: dict, deletes: Iterable[str] = ()):
+        """
+        Sets all the values passed with a single flush (and fsync)
+        :param items: The keys and values to set
+        :param deletes: Keys to remove with the same flush (keys not present
+            are ignored)
+        """
+        with self._lock:
+            for key, value in items.items():
+                self._append(self._OP_SET, key, value, sync=False)
+                self._decoded.pop(key, None)
+            for key in deletes:
+                if key in self._index:
+                    self._append(self._OP_POP, key, sync=False)
+                    self._decoded.pop(key, None)
+            self._sync()
+            self._maybe_compact()
+
+    def save(self):
+        """
+        Writes the index so that the next open does not need to scan
+        """
+        with self._lock:
+            self._save_index()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._save_index()
+            self._unmap()
+            self._file.close()
+
+    def _append(self, op: int, key: str, value=None, sync: bool = True):
+        """
+        Appends a record to the segment and updates the index
+        ASSUMPTION: Called while holding self._lock
+        :param sync: If false the caller must call _sync
+        """
+        key_bytes = key.encode()
+        if op == self._OP_POP:
+            value_type, value_bytes = self._TYPE_STR, b''
+        elif isinstance(value, str):
+            value_type, value_bytes = self._TYPE_STR, value.encode()
+        else:
+            value_type = self._TYPE_YAML
+            value_bytes = yaml.dump(value, Dumper=Dumper).encode()
+        header = self._RECORD_HEADER.pack(op, value_type, len(key_bytes),
+                                          len(value_bytes))
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(header + key_bytes + value_bytes)
+        if sync:
+            self._sync()
+        record_len = len(header) + len(key_bytes) + len(value_bytes)
+        self._apply(op, key, offset + len(header) + len(key_bytes),
+                    len(value_bytes), value_type, record_len)
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync_policy != FsyncPolicy.NEVER:
+            os.fsync(self._file.fileno())
+
+    def _apply(self, op: int, key: str, value_offset: int, value_len: int,
+               value_type: int, record_len: int):
+        """
+        Updates the index for a record found at value_offset
+        """
+        old = self._index.pop(key, None)
+        if old is not None:
+            old_len = self._record_len(key, old[1])
+            self._live_bytes -= old_len
+            self._dead_bytes += old_len
+        if op == self._OP_SET:
+            self._index[key] = (value_offset, value_len, value_type)
+            self._live_bytes += record_len
+        else:
+            self._dead_bytes += record_len
+
+    def _record_len(self, key: str, value_len: int) -> int:
+        return self._RECORD_HEADER.size + len(key.encode()) + value_len
+
+    def _decode(self, offset: int, length: int, value_type: int):
+        if self._mmap is None or offset + length > len(self._mmap):
+            # Segment grew since it was mapped
+            self._remap()
+        # Decode straight from the map without copying into a bytes first
+        text = str(memoryview(self._mmap)[offset:offset + length], 'utf-8')
+        if value_type == self._TYPE_STR:
+            return text
+        return yaml.load(text, Loader=Loader)
+
+    def _remap(self):
+        self._unmap()
+        self._file.flush()
+        if path.getsize(self.filename) > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+
+    def _unmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _load_index(self) -> int:
+        """
+        Loads the saved index if it is usable
+        :return: The offset in the segment up to which the index is valid
+        """
+        if not path.exists(self.index_filename):
+            return 0
+        with open(self.index_filename, 'rb') as f:
+            buffer = f.read()
+        try:
+            covered, count = self._INDEX_HEADER.unpack_from(buffer, 0)
+            if covered > path.getsize(self.filename):
+                raise ValueError('Index is ahead of the segment')
+            pos = self._INDEX_HEADER.size
+            for _ in range(count):
+                offset, length, value_type, key_len = \
+                    self._INDEX_ENTRY.unpack_from(buffer, pos)
+                pos += self._INDEX_ENTRY.size
+                key = buffer[pos:pos + key_len].decode()
+                pos += key_len
+                self._index[key] = (offset, length, value_type)
+                self._live_bytes += self._record_len(key, length)
+        except (struct.error, ValueError, UnicodeDecodeError) as e:
+            log(f'[DictSegmented] Ignoring unusable index '
+                f'{self.index_filename}: {e}', logging.WARNING)
+            self._index = {}
+            self._live_bytes = 0
+            return 0
+        self._dead_bytes = covered - self._live_bytes
+        return covered
+
+    def _save_index(self):
+        self._file.flush()
+        parts = [self._INDEX_HEADER.pack(path.getsize(self.filename),
+                                         len(self._index))]
+        for key, (offset, length, value_type) in self._index.items():
+            key_bytes = key.encode()
+            parts.append(self._INDEX_ENTRY.pack(offset, length, value_type,
+                                                len(key_bytes)))
+            parts.append(key_bytes)
+        temp_filename = f'{self.index_filename}.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(temp_filename, self.index_filename)
+
+    def _index_tail(self, start: int):
+        """
+        Adds records after start to the index by reading only their headers
+        and keys. A partially written record at the end is discarded.
+        :param start: Offset to start reading from
+        """
+        self._remap()
+        if self._mmap is None:
+            return
+        size = len(self._mmap)
+        offset = start
+        count = 0
+        header_size = self._RECORD_HEADER.size
+        while offset + header_size <= size:
+            op, value_type, key_len, value_len = \
+                self._RECORD_HEADER.unpack_from(self._mmap, offset)
+            record_len = header_size + key_len + value_len
+            if offset + record_len > size:
+                break
+            key_start = offset + header_size
+            key = self._mmap[key_start:key_start + key_len].decode()
+            self._apply(op, key, key_start + key_len, value_len, value_type,
+                        record_len)
+            offset += record_len
+            count += 1
+        if offset != size:
+            log(f'[DictSegmented] Discarding {size - offset} bytes of '
+                f'incomplete record at end of {self.filename}',
+                logging.WARNING)
+            self._unmap()
+            self._file.truncate(offset)
+        if count > 0:
+            log(f'[DictSegmented] Indexed {count} records not in saved index',
+                logging.DEBUG)
+
+    def _import(self, file_name: str):
+        log(f'[DictSegmented] Importing {file_name}')
+        source = DictPersistentJournaled(file_name)
+        for key in source.keys():
+            self._append(self._OP_SET, key, source[key])
+        source.close()
+        self._save_index()
+
+    def _maybe_compact(self):
+        if self._dead_bytes > max(
+                Conf.DB.SEGMENT_COMPACT_RATIO * self._live_bytes,
+                Conf.DB.JOURNAL_COMPACT_MIN_BYTES):
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrites the segment with only live records. Values are copied as
+        bytes without being decoded.
+        ASSUMPTION: Called while holding self._lock
+        """
+        log(f'[DictSegmented] Compacting {self.filename}', logging.DEBUG)
+        self._remap()
+        temp_filename = f'{self.filename}.tmp'
+        new_index = {}
+        with open(temp_filename, 'wb') as f:
+            for key, (offset, length, value_type) in self._index.items():
+                key_bytes = key.encode()
+                f.write(self._RECORD_HEADER.pack(self._OP_SET, value_type,
+                                                 len(key_bytes), length))
+                f.write(key_bytes)
+                new_index[key] = (f.tell(), length, value_type)
+                f.write(self._mmap[offset:offset + length])
+            f.flush()
+            if self.fsync_policy != FsyncPolicy.NEVER:
+                os.fsync(f.fileno())
+        self._unmap()
+        self._file.close()
+        # The old index must not be paired with the new segment if the
+        # process stops before the new index is saved (its offsets would
+        # point into the rewritten file). Without an index the segment is
+        # scanned on open.
+        if path.exists(self.index_filename):
+            os.remove(self.index_filename)
+        os.replace(temp_filename, self.filename)
+        self._file = open(self.filename, 'a+b')
+        self._index = new_index
+        self._dead_bytes = 0
+        self._save_index()
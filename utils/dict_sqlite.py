@@ -0,0 +1,138 @@
+import atexit
+import sqlite3
+import threading
+from os import path
+from typing import Iterable
+
+import yaml
+
+from conf import Conf
+from utils.dict_persistent import DictPersistentJournaled
+from utils.log import log
+
+try:
+    from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+    from yaml import Loader, Dumper
+
+
+class DictSQLite:
+    """
+    Dict like store kept in an SQLite database (WAL mode) with one row per
+    key. write_many writes several keys in a single transaction so they are
+    saved together or not at all.
+
+    str values are stored as is and everything else as yaml.
+
+    NB: Like DictPersistent mutated objects are not written to disk and
+    values returned are decoded copies.
+    """
+
+    def __init__(self, file_name: str = None, *,
+                 import_file_name: str = None):
+        """
+        :param file_name: Database file name (Default
+            Conf.DB.SQLITE_FILE_NAME)
+        :param import_file_name: A DictPersistent yaml file (and its
+            journal) to import if the database does not exist yet
+        """
+        self.filename = \
+            Conf.DB.SQLITE_FILE_NAME if file_name is None else file_name
+        is_new = not path.exists(self.filename)
+
+        # Used from the DBCache worker as well as the main thread
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.filename, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(f'PRAGMA synchronous={Conf.DB.SQLITE_SYNCHRONOUS}')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kv ('
+                           'key TEXT PRIMARY KEY, '
+                           'value TEXT NOT NULL, '
+                           'is_yaml INTEGER NOT NULL)')
+
+        if is_new and import_file_name is not None \
+                and path.exists(import_file_name):
+            log(f'[DictSQLite] Importing {import_file_name}')
+            source = DictPersistentJournaled(import_file_name)
+            self.write_many({key: source[key] for key in source.keys()})
+            source.close()
+
+        atexit.register(self.close)
+
+    def __contains__(self, item):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM kv WHERE key = ?',
+                                      (item,)).fetchone() is not None
+
+    def __getitem__(self, item):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, is_yaml FROM kv WHERE key = ?',
+                (item,)).fetchone()
+        if row is None:
+            raise KeyError(item)
+        value, is_yaml = row
+        return yaml.load(value, Loader=Loader) if is_yaml else value
+
+    def __setitem__(self, key, value):
+        self.write_many({key: value})
+
+    def get(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            return None
+
+    def keys(self):
+        with self._lock:
+            return [row[0] for row in
+                    self._conn.execute('SELECT key FROM kv ORDER BY key')]
+
+    def prefix(self, prefix: str):
+        """
+        :return: Keys starting with prefix (Same as the replit library)
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                'SELECT key FROM kv WHERE substr(key, 1, ?) = ? '
+                'ORDER BY key', (len(prefix), prefix))]
+
+    def pop(self, key):
+        with self._lock:
+            result = self[key]
+            self._conn.execute('DELETE FROM kv WHERE key = ?', (key,))
+            return result
+
+    def write_many(self, items: dict, deletes: Iterable[str] = ()):
+        """
+        Sets all the values passed in a single transaction
+        :param items: The keys and values to set
+        :param deletes: Keys to remove in the same transaction (keys not
+            present are ignored)
+        """
+        rows = []
+        for key, value in items.items():
+            if isinstance(value, str):
+                rows.append((key, value, 0))
+            else:
+                rows.append((key, yaml.dump(value, Dumper=Dumper), 1))
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO kv (key, value, is_yaml) '
+                    'VALUES (?, ?, ?)', rows)
+                self._conn.executemany('DELETE FROM kv WHERE key = ?',
+                                       ((key,) for key in deletes))
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    def save(self):
+        pass  # Every write is already committed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
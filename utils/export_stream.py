@@ -0,0 +1,169 @@
+"""
+Streams db key/value pairs to and from export files one entry at a time so
+the whole db is never held in memory.
+
+The format is chosen by the file name:
+    - *.jsonl: One JSON object per line {"k": key, "v": value}
+    - *.yaml / *.yml: One yaml document per entry, each a single entry
+        mapping. Files written before documents were used (one mapping) can
+        still be imported
+    - Either followed by .gz: gzip compressed
+"""
+import gzip
+import json
+import logging
+from time import perf_counter
+from typing import Iterator, Tuple
+
+import yaml
+
+from conf import Conf
+from utils.log import log
+
+try:
+    from yaml import CLoader as Loader, CDumper as Dumper
+except ImportError:
+    from yaml import Loader, Dumper
+
+JSONL = 'jsonl'
+YAML = 'yaml'
+
+
+def _format(fn: str) -> Tuple[str, bool]:
+    """
+    :return: The format and if the file is gzip compressed
+    """
+    is_gzip = fn.endswith('.gz')
+    name = fn[:-len('.gz')] if is_gzip else fn
+    if name.endswith('.jsonl'):
+        return JSONL, is_gzip
+    if name.endswith(('.yaml', '.yml')):
+        return YAML, is_gzip
+    raise ValueError(f'Unable to tell export format from file name: {fn}')
+
+
+def _open(fn: str, mode: str, is_gzip: bool):
+    if is_gzip:
+        return gzip.open(fn, f'{mode}t', encoding='utf-8',
+                         compresslevel=Conf.EXPORT_GZIP_LEVEL)
+    return open(fn, mode, encoding='utf-8')
+
+
+class Progress:
+    """
+    Logs the number of entries and bytes processed at most every
+    Conf.EXPORT_PROGRESS_INTERVAL seconds
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.bytes = 0
+        self.start = perf_counter()
+        self._last_report = self.start
+
+    def add(self, size: int):
+        self.count += 1
+        self.bytes += size
+        if self.count % 1000 == 0:  # Avoid checking the time for every entry
+            now = perf_counter()
+            if now - self._last_report >= Conf.EXPORT_PROGRESS_INTERVAL:
+                self._last_report = now
+                self.report(logging.INFO)
+
+    def report(self, log_level=logging.INFO, done: bool = False):
+        elapsed = perf_counter() - self.start
+        rate = self.bytes / elapsed / 1024 ** 2 if elapsed > 0 else 0
+        log(f'[{self.name}] {"Completed " if done else ""}{self.count} '
+            f'entries {self.bytes / 1024 ** 2:.1f} MB in {elapsed:.1f}s '
+            f'({rate:.1f} MB/s)', log_level)
+
+
+def export(fn: str, data) -> int:
+    """
+    Saves the key value pairs from data to fn (format chosen by the file
+    name see module docstring). Values are read and written one at a time.
+    :param fn: Name of the file to export the values to
+    :param data: They dict like object to get the keys from (If it has an
+        items method it is expected to return an iterator like DBCache.items)
+    :return: Number of entries exported
+    """
+    format_, is_gzip = _format(fn)
+    if hasattr(data, 'items'):
+        items = data.items()
+    else:
+        items = ((key, data[key]) for key in list(data.keys()))
+    progress = Progress('Export')
+    with _open(fn, 'w', is_gzip) as f:
+        for key, value in items:
+            if format_ == JSONL:
+                line = json.dumps({'k': key, 'v': value},
+                                  separators=(',', ':')) + '\n'
+            else:
+                line = yaml.dump({key: value}, Dumper=Dumper,
+                                 explicit_start=True)
+            f.write(line)
+            progress.add(len(line))
+    progress.report(done=True)
+    return progress.count
+
+
+def iter_export(fn: str, progress: Progress = None) \
+        -> Iterator[Tuple[str, object]]:
+    """
+    Reads the entries of an export file one at a time
+    :param fn: Name of the file to read
+    :param progress: Updated as entries are read if not None
+    :return: Iterator of key, value
+    """
+    format_, is_gzip = _format(fn)
+    with _open(fn, 'r', is_gzip) as f:
+        if format_ == JSONL:
+            for line in f:
+                entry = json.loads(line)
+                if progress is not None:
+                    progress.add(len(line))
+                yield entry['k'], entry['v']
+        else:
+            for document in yaml.load_all(f, Loader=Loader):
+                if document is None:
+                    continue
+                for key, value in document.items():
+                    if progress is not None:
+                        # Document sizes are not known, values used instead
+                        progress.add(len(value) if isinstance(value, str)
+                                     else 0)
+                    yield key, value
+
+
+def import_(fn: str, db) -> int:
+    """
+    Loads the entries of an export file into db. Entries are written in
+    batches of up to Conf.EXPORT_IMPORT_BATCH_BYTES using db.write_many if
+    available (So most exports are written in one go)
+    :param fn: Name of the file to read
+    :param db: The db to write to
+    :return: Number of entries imported
+    """
+    progress = Progress('Import')
+    batch = {}
+    batch_bytes = 0
+    for key, value in iter_export(fn, progress):
+        batch[key] = value
+        batch_bytes += len(value) if isinstance(value, str) else 0
+        if batch_bytes >= Conf.EXPORT_IMPORT_BATCH_BYTES:
+            _write_batch(db, batch)
+            batch = {}
+            batch_bytes = 0
+    if len(batch) > 0:
+        _write_batch(db, batch)
+    progress.report(done=True)
+    return progress.count
+
+
+def _write_batch(db, batch: dict):
+    if hasattr(db, 'write_many'):
+        db.write_many(batch)
+    else:
+        for key, value in batch.items():
+            db[key] = value
@@ -0,0 +1,401 @@
+import asyncio
+import inspect
+import json
+import logging
+import time
+from dataclasses import dataclass
+
+from utils.log import log
+
+
+class Debounce:
+    """
+    Runs once calls stop for wait seconds (trailing) and/or on the first
+    call after a quiet period of wait seconds (leading). Calls in between
+    are merged into the trailing run or dropped if there is none.
+    """
+
+    def __init__(self, wait: float, leading: bool = False,
+                 trailing: bool = True, max_wait: float = None):
+        """
+        :param wait: Seconds without calls before the key is quiet again
+        :param leading: Run on the first call after a quiet period
+        :param trailing: Run after calls stop (with the latest arguments)
+        :param max_wait: If not None the trailing run is not delayed by more
+            than this many seconds after the first call merged into it
+            (max_wait == wait runs a fixed time after the first call)
+        """
+        self.wait = wait
+        self.leading = leading
+        self.trailing = trailing
+        self.max_wait = max_wait
+
+    def admit(self, job: '_Job', now: float):
+        is_quiet = job.state.get('quiet_until', 0) <= now
+        job.state['quiet_until'] = now + self.wait
+        if is_quiet and self.leading:
+            return 0
+        if self.trailing:
+            job.state['first'] = now
+            return self.wait
+        return None
+
+    def reschedule(self, job: '_Job', now: float):
+        job.state['quiet_until'] = now + self.wait
+        delay = self.wait
+        if self.max_wait is not None:
+            delay = min(delay, job.state['first'] + self.max_wait - now)
+        return max(delay, 0)
+
+    def consume(self, job: '_Job', now: float):
+        pass
+
+    def expires_in(self, job: '_Job', now: float) -> float:
+        return job.state.get('quiet_until', 0) - now
+
+
+class Throttle:
+    """
+    Runs at most limit times per fixed window of window seconds. Extra
+    calls are dropped or, if trailing, merged into one run at the start of
+    the next window.
+    """
+
+    def __init__(self, limit: int, window: float, trailing: bool = False):
+        self.limit = limit
+        self.window = window
+        self.trailing = trailing
+
+    def _refresh(self, job: '_Job', now: float):
+        window = int(now // self.window)
+        if job.state.get('window') != window:
+            job.state['window'] = window
+            job.state['count'] = 0
+
+    def admit(self, job: '_Job', now: float):
+        self._refresh(job, now)
+        if job.state['count'] < self.limit:
+            job.state['count'] += 1
+            return 0
+        if self.trailing:
+            return (job.state['window'] + 1) * self.window - now
+        return None
+
+    def reschedule(self, job: '_Job', now: float):
+        return None  # Runs at the start of the next window regardless
+
+    def consume(self, job: '_Job', now: float):
+        self._refresh(job, now)
+        job.state['count'] += 1
+
+    def expires_in(self, job: '_Job', now: float) -> float:
+        return (job.state['window'] + 1) * self.window - now
+
+
+class TokenBucket:
+    """
+    Each run uses a token. Tokens are added at rate per second up to burst.
+    Calls without a token are dropped or, if trailing, merged into one run
+    when the next token is available.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, trailing: bool = False):
+        self.rate = rate
+        self.burst = burst
+        self.trailing = trailing
+
+    def _refill(self, job: '_Job', now: float):
+        tokens = job.state.get('tokens', self.burst)
+        last = job.state.get('last', now)
+        job.state['tokens'] = min(self.burst,
+                                  tokens + (now - last) * self.rate)
+        job.state['last'] = now
+
+    def admit(self, job: '_Job', now: float):
+        self._refill(job, now)
+        if job.state['tokens'] >= 1:
+            job.state['tokens'] -= 1
+            return 0
+        if self.trailing:
+            return (1 - job.state['tokens']) / self.rate
+        return None
+
+    def reschedule(self, job: '_Job', now: float):
+        return None
+
+    def consume(self, job: '_Job', now: float):
+        self._refill(job, now)
+        job.state['tokens'] = max(job.state['tokens'] - 1, 0)
+
+    def expires_in(self, job: '_Job', now: float) -> float:
+        return (self.burst - job.state['tokens']) / self.rate
+
+
+@dataclass
+class SchedulerStats:
+    submitted: int = 0
+    executed: int = 0
+    coalesced: int = 0  # Merged into a run already pending
+    dropped: int = 0  # Rejected by the policy (never run)
+    failed: int = 0
+
+    def __str__(self):
+        return (f'submitted={self.submitted} executed={self.executed} '
+                f'coalesced={self.coalesced} dropped={self.dropped} '
+                f'failed={self.failed}')
+
+
+class _Job:
+    __slots__ = ('key', 'policy', 'function', 'args', 'kwargs', 'intent',
+                 'future', 'timer', 'state')
+
+    def __init__(self, key, policy, function: callable):
+        self.key = key
+        self.policy = policy
+        self.function = function
+        self.args = []
+        self.kwargs = {}
+        self.intent = None
+        self.future = None  # Set while a trailing run is pending
+        self.timer = None  # Trailing run or removal of the idle state
+        self.state = {}  # Used by the policy
+
+
+class KeyedScheduler:
+    """
+    Rate limits calls on the asyncio loop. Calls are grouped by key,
+    (function, *args) unless a key is given (eg. to limit per guild or per
+    user), and each key is limited by the policy it was submitted with
+    (Debounce, Throttle or TokenBucket). Functions run on the loop and may
+    return an awaitable which is awaited. Code not running on the loop can
+    submit with loop.call_soon_threadsafe.
+
+    Counts of calls submitted, executed, coalesced and dropped are kept per
+    function (see stats).
+
+    Calls submitted with an intent (a name for the job) are saved to the db
+    set with persist_to until they run so they can be submitted again after
+    a restart (see load_intents). run_pending runs everything pending
+    immediately (eg. before shutting down).
+
+    Uses a singleton so callers do not need to keep a reference (client
+    classes are serialised and can not hold references to the loop).
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls) -> 'KeyedScheduler':
+        if cls._instance is None:
+            cls._instance = KeyedScheduler()
+        return cls._instance
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        :param loop: The loop to run on (Default: The current event loop
+            when the first call is submitted)
+        """
+        self.loop = loop
+        self.stats = {}  # function name -> SchedulerStats
+        self._jobs = {}  # key -> _Job
+        self._running = set()
+        self._intents = {}  # intent -> time due (seconds since epoch)
+        self._db = None
+        self._db_key = None
+
+    def persist_to(self, db, key: str):
+        """
+        Sets where the intents of pending calls are saved
+        :param db: The db to save to
+        :param key: The key to save under
+        """
+        self._db = db
+        self._db_key = key
+
+    def load_intents(self) -> dict:
+        """
+        :return: Intents saved (by a previous run) as intent -> time due
+            (seconds since epoch)
+        """
+        if self._db is None:
+            return {}
+        saved = self._db.get(self._db_key)
+        return {} if saved is None else json.loads(saved)
+
+    def _save_intents(self):
+        if self._db is not None:
+            self._db[self._db_key] = json.dumps(self._intents)
+
+    def _stats_for(self, function: callable) -> SchedulerStats:
+        name = getattr(function, '__qualname__', repr(function))
+        if name not in self.stats:
+            self.stats[name] = SchedulerStats()
+        return self.stats[name]
+
+    def submit(self, policy, function: callable, args: list = None,
+               kwargs: dict = None, key=None, intent: str = None):
+        """
+        Requests a call to function, subject to the policy for its key
+        :param policy: Debounce, Throttle or TokenBucket. Used if the key
+            has no state yet (ie. the first policy submitted for a key is
+            kept until the key is idle)
+        :param function: The function to be called (may be a coroutine
+            function)
+        :param args: The positional arguments for the function (must be
+            hashable unless key is given)
+        :param kwargs: The key word arguments for the function (not part of
+            the key, the latest used by a merged run)
+        :param key: If not None used instead of (function, *args)
+        :param intent: If not None name saved until the function runs (see
+            class docstring)
+        :return: Future of the result of the run this call was merged into
+            or None if the call was dropped
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        args = [] if args is None else args
+        kwargs = {} if kwargs is None else kwargs
+        if key is None:
+            key = (function, *args)
+        stats = self._stats_for(function)
+        stats.submitted += 1
+        now = self.loop.time()
+
+        job = self._jobs.get(key)
+        if job is None:
+            job = _Job(key, policy, function)
+            self._jobs[key] = job
+        if job.future is not None:
+            # Trailing run already pending, use the latest arguments
+            stats.coalesced += 1
+            job.args, job.kwargs = args, kwargs
+            delay = job.policy.reschedule(job, now)
+            if delay is not None:
+                job.timer.cancel()
+                job.timer = self.loop.call_later(delay, self._fire, job)
+            return job.future
+
+        if job.timer is not None:
+            job.timer.cancel()  # Removal of idle state
+            job.timer = None
+        delay = job.policy.admit(job, now)
+        if delay is None:
+            stats.dropped += 1
+            log(f'[Scheduler] Dropped call to {function}', logging.DEBUG)
+            self._expire_later(job, now)
+            return None
+        if delay <= 0:
+            self._expire_later(job, now)
+            if intent is not None:  # May have been saved by a previous run
+                self._intents.pop(intent, None)
+                self._save_intents()
+            return self._start(function, args, kwargs)
+
+        job.args, job.kwargs = args, kwargs
+        job.future = self.loop.create_future()
+        job.timer = self.loop.call_later(delay, self._fire, job)
+        if intent is not None:
+            job.intent = intent
+            self._intents[intent] = time.time() + delay
+            self._save_intents()
+        log(f'[Scheduler] {function} due in {delay:.1f} seconds',
+            logging.DEBUG)
+        return job.future
+
+    def _expire_later(self, job: _Job, now: float):
+        """
+        Removes the state of job once the policy no longer needs it
+        """
+        delay = job.policy.expires_in(job, now)
+        if delay <= 0:
+            self._jobs.pop(job.key, None)
+        else:
+            job.timer = self.loop.call_later(
+                delay, lambda: self._jobs.pop(job.key, None))
+
+    def _fire(self, job: _Job):
+        """
+        Runs the trailing call of job
+        """
+        now = self.loop.time()
+        job.policy.consume(job, now)
+        future = job.future
+        job.future = None
+        job.timer = None
+        intent = job.intent
+        job.intent = None
+        self._expire_later(job, now)
+        task = self._start(job.function, job.args, job.kwargs)
+        task.add_done_callback(
+            lambda x: None if future.done() else future.set_result(x.result()))
+        if intent is not None:
+            self._intents.pop(intent, None)
+            self._save_intents()
+        job.args, job.kwargs = [], {}
+
+    def _start(self, function: callable, args: list,
+               kwargs: dict) -> asyncio.Task:
+        task = self.loop.create_task(self._invoke(function, args, kwargs))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        return task
+
+    async def _invoke(self, function: callable, args: list, kwargs: dict):
+        stats = self._stats_for(function)
+        stats.executed += 1
+        try:
+            result = function(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception as e:
+            stats.failed += 1
+            log(f'[Scheduler] Exception in {function}: {e}', logging.ERROR)
+            return None
+
+    def is_pending(self, function: callable, args: list = None,
+                   key=None) -> bool:
+        """
+        :return: True if a trailing run is pending for the key
+        """
+        if key is None:
+            key = (function, *([] if args is None else args))
+        job = self._jobs.get(key)
+        return job is not None and job.future is not None
+
+    def cancel(self, function: callable, args: list = None,
+               key=None) -> bool:
+        """
+        Attempts to cancel the pending trailing run for the key
+        :return: True if a run was pending else False
+        """
+        if key is None:
+            key = (function, *([] if args is None else args))
+        job = self._jobs.get(key)
+        if job is None or job.future is None:
+            return False
+        job.timer.cancel()
+        job.future.cancel()
+        self._jobs.pop(key)
+        if job.intent is not None:
+            self._intents.pop(job.intent, None)
+            self._save_intents()
+        log(f'[Scheduler] Canceled {job.function}', logging.DEBUG)
+        return True
+
+    async def run_pending(self) -> list:
+        """
+        Runs every pending trailing call now and waits for all running calls
+        to finish
+        :return: The values returned by the functions
+        """
+        for job in [x for x in self._jobs.values() if x.future is not None]:
+            job.timer.cancel()
+            log(f'[Scheduler] Running {job.function} early', logging.DEBUG)
+            self._fire(job)
+        if len(self._running) == 0:
+            return []
+        return list(await asyncio.gather(*self._running))
+
+    def log_stats(self, log_level=logging.INFO):
+        for name, stats in self.stats.items():
+            log(f'[Scheduler] {name}: {stats}', log_level)
@@ -1,24 +1,3 @@
-import yaml
-
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
-
-
-def export(fn: str, data):
-    """
-    Saves the key value pairs from data to a yaml file with name fn
-    :param fn: Name of the file to export the values to
-    :param data: They dict like object to get the keys from
-    """
-    exp_dict = {}
-    for key in data.keys():
-        exp_dict[key] = data[key]
-    with open(fn, 'w') as f:
-        f.write(yaml.dump(exp_dict, Dumper=Dumper))
-
-
 def is_power_of_2(value):
     """
     Checks if value is a power of the 2
@@ -36,3 +15,27 @@ def is_power_of_2(value):
     # 2 - If we subtract 1 from a number which is power of 2,
     #   then all the bits after the set-bit (there is only one set bit as per
     #   point-1) will become set and the set bit will be unset. i.e:
+
+
+def pack_messages(texts: list, limit: int, separator: str = '\n') -> list:
+    """
+    Groups texts, in order, into as few messages as possible
+    :param texts: The texts to send
+    :param limit: Max length of a message (texts longer than this are
+        truncated)
+    :param separator: Put between the texts in a message
+    :return: List of the groups of texts (each group joined with separator
+        is at most limit characters)
+    """
+    result = []
+    length = 0
+    for text in texts:
+        text = text[:limit]
+        if len(result) > 0 \
+                and length + len(separator) + len(text) <= limit:
+            result[-1].append(text)
+            length += len(separator) + len(text)
+        else:
+            result.append([text])
+            length = len(text)
+    return result
@@ -0,0 +1,202 @@
+import json
+import logging
+
+from conf import Conf
+from utils.codec import SchemaCodec
+from utils.log import log
+
+
+class OpRecorder:
+    """
+    Mixin for cog data that records each change made to it as a compact
+    operation (a tuple of JSON compatible values starting with the operation
+    name) so it can be saved by OpLogState.
+
+    Classes using it must implement apply(op) which makes the change
+    recorded by op again. apply is only called while loading, operations
+    recorded during apply are dropped.
+    """
+
+    def record_op(self, *op):
+        # Not created in __init__ so objects created before it existed work
+        self.__dict__.setdefault('_ops', []).append(op)
+
+    def take_ops(self) -> list:
+        """
+        :return: Operations recorded since the last call
+        """
+        return self.__dict__.pop('_ops', [])
+
+    def apply(self, op):
+        raise NotImplementedError
+
+
+class OpLogState:
+    """
+    Saves an object as an append-only log of the operations applied to it
+    (see OpRecorder) with periodic full snapshots. Each save writes one key
+    holding the operations recorded since the previous save, so the cost of
+    a save follows the size of the change. Loading decodes the latest
+    snapshot and replays the operations after it.
+
+    Keys (seq is shared by operations and snapshots and increases by 1 for
+    each key written):
+        - oplog/<name>/<seq>: JSON list of operations
+        - oplog/<name>/snapshot/<seq>: State after the operations up to seq
+            (encoded with SchemaCodec)
+
+    A snapshot is written every Conf.DB.OPLOG_SNAPSHOT_INTERVAL operations
+    and when a different object is saved (eg. after a reset). Only the last
+    Conf.DB.OPLOG_KEEP_SNAPSHOTS snapshots and the operations after the
+    oldest of them are kept. Any seq within that range can be loaded (see
+    load) which allows changes to be undone.
+
+    ASSUMPTION: Only one OpLogState is used per name
+    """
+    SNAPSHOT = 'snapshot/'
+
+    def __init__(self, db, name: str, cls, fallback=None):
+        """
+        :param db: The DBCache to save to
+        :param name: Name of the log (eg. the cog's db key)
+        :param cls: Class of the object saved (must support SchemaCodec and
+            OpRecorder)
+        :param fallback: Object with a load method used if no snapshot exists
+            yet (eg. a PartitionedState). If None the value under name is
+            decoded with SchemaCodec
+        """
+        self.db = db
+        self.name = name
+        self.cls = cls
+        self.codec = SchemaCodec(cls)
+        self.fallback = fallback
+        self.prefix = f'oplog/{name}/'
+
+        self.seq = 0  # Last seq written
+        self._obj = None  # Object the log belongs to
+        self._ops_since_snapshot = 0
+        self._snapshot_seqs = []
+        self._op_seqs = []
+
+    def _op_key(self, seq: int) -> str:
+        return f'{self.prefix}{seq:010d}'
+
+    def _snapshot_key(self, seq: int) -> str:
+        return f'{self.prefix}{self.SNAPSHOT}{seq:010d}'
+
+    def save(self, obj):
+        """
+        Writes the operations recorded by obj since the last save (or a
+        snapshot if obj is not the object loaded or last saved)
+        :param obj: The object to save
+        """
+        if obj is not self._obj:
+            self._write_snapshot(obj)
+            return
+        ops = obj.take_ops()
+        if len(ops) == 0:
+            return
+        self.seq += 1
+        self.db[self._op_key(self.seq)] = json.dumps(ops,
+                                                     separators=(',', ':'))
+        self._op_seqs.append(self.seq)
+        self._ops_since_snapshot += len(ops)
+        if self._ops_since_snapshot >= Conf.DB.OPLOG_SNAPSHOT_INTERVAL:
+            self._write_snapshot(obj)
+
+    def _write_snapshot(self, obj):
+        obj.take_ops()  # Included in the snapshot
+        self.seq += 1
+        # Snapshot so later changes are not included when encoded
+        self.db[self._snapshot_key(self.seq), self.codec] = obj.snapshot()
+        self._obj = obj
+        self._ops_since_snapshot = 0
+        self._snapshot_seqs.append(self.seq)
+        log(f'[OpLogState] Snapshot of {self.name} at {self.seq}',
+            logging.DEBUG)
+
+        # Drop snapshots and operations no longer needed
+        while len(self._snapshot_seqs) > Conf.DB.OPLOG_KEEP_SNAPSHOTS:
+            self.db.delete(self._snapshot_key(self._snapshot_seqs.pop(0)))
+        while len(self._op_seqs) > 0 \
+                and self._op_seqs[0] < self._snapshot_seqs[0]:
+            self.db.delete(self._op_key(self._op_seqs.pop(0)))
+
+    def _list_seqs(self, db=None):
+        """
+        :param db: Read from this instead of self.db
+        :return: Sorted seqs of the snapshots and operations in the db
+        """
+        db = self.db if db is None else db
+        snapshot_seqs, op_seqs = [], []
+        for key in db.iter_keys(self.prefix):
+            rest = key[len(self.prefix):]
+            if rest.startswith(self.SNAPSHOT):
+                snapshot_seqs.append(int(rest[len(self.SNAPSHOT):]))
+            else:
+                op_seqs.append(int(rest))
+        return sorted(snapshot_seqs), sorted(op_seqs)
+
+    def load(self, seq: int = None, db=None):
+        """
+        Loads the object as it was after seq
+        :param seq: The seq to load up to or None for the latest state (the
+            log then continues from the object returned)
+        :param db: Read from this instead of self.db (eg. a DBCacheReader
+            when loading on another thread)
+        :return: The object or None if nothing was saved
+        """
+        db = self.db if db is None else db
+        snapshot_seqs, op_seqs = self._list_seqs(db)
+        if len(snapshot_seqs) == 0:
+            if self.fallback is not None:
+                return self.fallback.load(db=db)
+            return db.get(self.name, codec=self.codec)
+
+        end = float('inf') if seq is None else seq
+        start = [x for x in snapshot_seqs if x <= end]
+        if len(start) == 0:
+            raise ValueError(f'{seq} is older than the oldest snapshot '
+                             f'({snapshot_seqs[0]})')
+        start = start[-1]
+        key = self._snapshot_key(start)
+        result = db.get(key)
+        if isinstance(result, str):
+            result = self.codec.decode(result)
+        else:
+            # Still waiting to be written, copied as the replay changes it
+            result = self.cls.from_dict(result.to_dict())
+
+        replayed = 0
+        for op_seq in op_seqs:
+            if start < op_seq <= end:
+                for op in json.loads(db.get(self._op_key(op_seq))):
+                    result.apply(op)
+                    replayed += 1
+        result.take_ops()
+
+        if seq is None:
+            self.seq = max(snapshot_seqs + op_seqs)
+            self._obj = result
+            self._ops_since_snapshot = replayed
+            self._snapshot_seqs = snapshot_seqs
+            self._op_seqs = op_seqs
+        log(f'[OpLogState] Loaded {self.name} from snapshot {start} and '
+            f'{replayed} operations')
+        return result
+
+    def history(self, count: int) -> list:
+        """
+        :param count: Max number of entries returned
+        :return: The last count entries as (seq, operations) with operations
+            None for snapshots
+        """
+        snapshot_seqs, op_seqs = self._list_seqs()
+        result = []
+        for seq in sorted(snapshot_seqs + op_seqs)[-count:]:
+            if seq in snapshot_seqs:
+                result.append((seq, None))
+            else:
+                result.append(
+                    (seq, json.loads(self.db.get(self._op_key(seq)))))
+        return result
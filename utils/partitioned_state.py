@@ -0,0 +1,99 @@
+import json
+
+from utils.codec import SchemaCodec
+
+
+class PartitionedState:
+    """
+    Saves an object across several db keys, a small root record under
+    root_key and one key per entity (root_key/<partition name>), so that a
+    change to one entity only rewrites that entity.
+
+    The class of the object must support SchemaCodec (used for values saved
+    whole before partitioning) and provide:
+        - PARTITION_TYPES: dict of partition name prefix -> entity class.
+            Partition names are <prefix>/<id>
+        - partitions(self): dict of partition name -> entity
+        - root_dict(self): Fields not stored in partitions as plain values
+        - from_partitions(cls, root, partitions): Class method that rebuilds
+            the object from root_dict and the decoded entities
+    Entity classes must support SchemaCodec and have a version attribute
+    that is incremented every time the entity is changed.
+
+    ASSUMPTION: Only one PartitionedState is used per root_key
+    """
+    MARKER = '!ps:'
+
+    def __init__(self, db, root_key: str, cls, format_: str = None):
+        """
+        :param db: The DBCache to save to
+        :param root_key: The key for the root record (prefix for the
+            partition keys)
+        :param cls: Class of the object saved (see class docstring)
+        :param format_: Format passed to SchemaCodec
+        """
+        self.db = db
+        self.root_key = root_key
+        self.cls = cls
+        self.codec = SchemaCodec(cls, format_)
+        self._entity_codecs = {
+            prefix: SchemaCodec(entity_cls, format_)
+            for prefix, entity_cls in cls.PARTITION_TYPES.items()}
+
+        # partition name -> (entity, version) as last saved/loaded
+        self._saved = {}
+        self._saved_root = None
+
+    def key(self, name: str) -> str:
+        return f'{self.root_key}/{name}'
+
+    def _codec_for(self, name: str) -> SchemaCodec:
+        return self._entity_codecs[name.split('/', 1)[0]]
+
+    def save(self, obj):
+        """
+        Writes the root record (if changed) and the entities that were
+        changed, added or removed since the last save or load
+        :param obj: The object to save
+        """
+        partitions = obj.partitions()
+        for name, entity in partitions.items():
+            saved = self._saved.get(name)
+            if saved is None or saved[0] is not entity \
+                    or saved[1] != entity.version:
+                self.db[self.key(name), self._codec_for(name)] = entity
+                self._saved[name] = (entity, entity.version)
+        for name in [x for x in self._saved if x not in partitions]:
+            self.db.delete(self.key(name))
+            del self._saved[name]
+
+        root = self.MARKER + json.dumps(obj.root_dict(),
+                                        separators=(',', ':'))
+        if root != self._saved_root:
+            self.db[self.root_key] = root
+            self._saved_root = root
+
+    def load(self, db=None):
+        """
+        :param db: Read from this instead of self.db (eg. a DBCacheReader
+            when loading on another thread)
+        :return: The object saved or None if the root key does not exist
+        """
+        db = self.db if db is None else db
+        root = db.get(self.root_key)
+        if root is None:
+            return None
+        if not root.startswith(self.MARKER):
+            # Saved whole before partitioning. Split by the next save
+            return self.codec.decode(root)
+
+        self._saved_root = root
+        partitions = {}
+        prefix = self.key('')
+        for key in db.iter_keys(prefix):
+            name = key[len(prefix):]
+            entity = db.get(key, codec=self._codec_for(name))
+            partitions[name] = entity
+            self._saved[name] = (entity, entity.version)
+        return self.cls.from_partitions(json.loads(root[len(self.MARKER):]),
+                                        partitions)
@@ -0,0 +1,211 @@
+import http.client
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+from urllib.parse import quote, unquote, urlencode, urlsplit
+
+from conf import Conf
+from utils.log import log
+
+
+class ReplDBClient:
+    """
+    Dict like client for the REPL DB key/value HTTP service. Used in place of
+    the replit library to reuse connections (keep-alive) and to send
+    requests concurrently.
+
+    Protocol (same as the replit library so data stays compatible):
+        - GET <url>/<key>: value (404 if missing)
+        - POST <url>: form encoded key=value pairs (several per request)
+        - DELETE <url>/<key>
+        - GET <url>?encode=true&prefix=<prefix>: url encoded keys, one per
+            line
+    Values are stored JSON encoded.
+
+    Values read are cached as the database is assumed to not be updated
+    elsewhere (see DBCache).
+    """
+
+    def __init__(self, url: str, *, pool_size: int = None,
+                 timeout: float = None):
+        parts = urlsplit(url)
+        self._connection_class = \
+            http.client.HTTPSConnection if parts.scheme == 'https' \
+            else http.client.HTTPConnection
+        self._host = parts.netloc
+        self._path = parts.path.rstrip('/')
+        self.pool_size = \
+            Conf.DB.REPL_POOL_SIZE if pool_size is None else pool_size
+        self.timeout = Conf.DB.REPL_TIMEOUT if timeout is None else timeout
+
+        # Idle connections, LIFO so the most recently used (still open) are
+        # used first. Semaphore limits the total number open.
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                            thread_name_prefix='ReplDB')
+
+        self._cache = {}  # key -> raw (JSON) value
+        self._cache_lock = threading.Lock()
+
+    def __contains__(self, item):
+        return self._get_raw(item) is not None
+
+    def __getitem__(self, item):
+        raw = self._get_raw(item)
+        if raw is None:
+            raise KeyError(item)
+        return json.loads(raw)
+
+    def __setitem__(self, key, value):
+        self.write_many({key: value})
+
+    def get(self, key):
+        raw = self._get_raw(key)
+        return None if raw is None else json.loads(raw)
+
+    def keys(self, prefix: str = ''):
+        query = urlencode({'encode': 'true', 'prefix': prefix})
+        status, body = self._request('GET', f'{self._path}?{query}')
+        self._check(status, 'list keys')
+        if body == '':
+            return []
+        return [unquote(key) for key in body.split('\n')]
+
+    def prefix(self, prefix: str):
+        """
+        :return: Keys starting with prefix (Same as the replit library)
+        """
+        return self.keys(prefix)
+
+    def pop(self, key):
+        result = self[key]
+        status, _ = self._request('DELETE', self._key_path(key))
+        self._check(status, f'delete {key}')
+        with self._cache_lock:
+            self._cache.pop(key, None)
+        return result
+
+    def write_many(self, items: dict, deletes: Iterable[str] = ()):
+        """
+        Sets all the values passed. Values are grouped into as few requests
+        as Conf.DB.REPL_BULK_MAX_BYTES allows and the requests are sent
+        concurrently.
+        NB: Unlike DictSQLite the write is not atomic across requests.
+        :param items: The keys and values to set
+        :param deletes: Keys to remove (a request each, sent concurrently
+            after the values are set)
+        """
+        raw_items = {key: json.dumps(value) for key, value in items.items()}
+        batches = [[]]
+        batch_size = 0
+        for key, raw in raw_items.items():
+            body = urlencode({key: raw})
+            if batch_size + len(body) > Conf.DB.REPL_BULK_MAX_BYTES \
+                    and len(batches[-1]) > 0:
+                batches.append([])
+                batch_size = 0
+            batches[-1].append(body)
+            batch_size += len(body) + 1
+        futures = [self._executor.submit(self._post, '&'.join(batch))
+                   for batch in batches if len(batch) > 0]
+        for future in futures:
+            future.result()  # Raises if any of the requests failed
+        with self._cache_lock:
+            self._cache.update(raw_items)
+        deletes = list(deletes)
+        statuses = self._executor.map(
+            lambda x: self._request('DELETE', self._key_path(x))[0], deletes)
+        for key, status in zip(deletes, statuses):
+            self._check(status, f'delete {key}')
+            with self._cache_lock:
+                self._cache.pop(key, None)
+
+    def prefetch(self, keys=None):
+        """
+        Loads the values for the keys passed concurrently so later reads do
+        not need a round trip
+        :param keys: The keys to load (All keys if None)
+        """
+        if keys is None:
+            keys = self.keys()
+        results = self._executor.map(self._get_raw, keys)
+        count = sum(1 for raw in results if raw is not None)
+        log(f'[ReplDB] Prefetched {count} values')
+
+    def save(self):
+        pass  # Every write is already sent
+
+    def close(self):
+        self._executor.shutdown()
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+    def _get_raw(self, key):
+        with self._cache_lock:
+            if key in self._cache:
+                return self._cache[key]
+        status, body = self._request('GET', self._key_path(key))
+        if status == 404:
+            return None
+        self._check(status, f'get {key}')
+        with self._cache_lock:
+            # Do not replace a value written while this request was running
+            return self._cache.setdefault(key, body)
+
+    def _post(self, body: str):
+        status, _ = self._request(
+            'POST', self._path or '/', body,
+            {'Content-Type': 'application/x-www-form-urlencoded'})
+        self._check(status, 'set')
+
+    def _key_path(self, key: str) -> str:
+        return f'{self._path}/{quote(key, safe="")}'
+
+    def _request(self, method: str, url: str, body: str = None,
+                 headers: dict = None):
+        """
+        Sends a request on a pooled connection. Retries once on a fresh
+        connection if a reused connection had been closed by the server.
+        :return: (status, body)
+        """
+        headers = {} if headers is None else headers
+        payload = None if body is None else body.encode()
+        with self._slots:
+            for attempt in range(2):
+                connection = None
+                if attempt == 0:
+                    try:
+                        connection = self._idle.get_nowait()
+                    except queue.Empty:
+                        pass
+                reused = connection is not None
+                if connection is None:
+                    connection = self._connection_class(
+                        self._host, timeout=self.timeout)
+                try:
+                    connection.request(method, url, payload, headers)
+                    response = connection.getresponse()
+                    data = response.read().decode()
+                except (http.client.HTTPException, ConnectionError,
+                        OSError):
+                    connection.close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                if response.will_close:
+                    connection.close()
+                else:
+                    self._idle.put(connection)
+                return response.status, data
+
+    @staticmethod
+    def _check(status: int, action: str):
+        if status >= 300:
+            log(f'[ReplDB] Failed to {action}. Status: {status}',
+                logging.ERROR)
+            raise IOError(f'REPL DB request to {action} failed with status '
+                          f'{status}')
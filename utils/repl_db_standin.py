@@ -0,0 +1,120 @@
+"""
+Local stand in for the REPL DB key/value HTTP service. Keeps values in memory
+and implements the same protocol as the real service (see ReplDBClient) so
+the client can be tried and benchmarked offline.
+
+Run from the repository root:
+    python -m utils.repl_db_standin --port 8765 --latency 20
+Then set REPLIT_DB_URL=http://127.0.0.1:8765
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+
+class ReplDBStandIn(ThreadingHTTPServer):
+    """
+    In memory REPL DB server. latency seconds are added to every response to
+    simulate a round trip to the real service.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.latency = latency
+        self.data = {}
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self) -> 'ReplDBStandIn':
+        """
+        Serves requests on a background thread
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive
+    # Send headers and body together (flushed after each request) to avoid
+    # Nagle/delayed ACK stalls on kept alive connections
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    server: ReplDBStandIn
+
+    def do_GET(self):
+        self._before_response()
+        parts = urlsplit(self.path)
+        if parts.path in ('', '/'):
+            query = parse_qs(parts.query)
+            prefix = query.get('prefix', [''])[0]
+            encode = query.get('encode', [''])[0] == 'true'
+            with self.server.lock:
+                keys = [key for key in self.server.data
+                        if key.startswith(prefix)]
+            if encode:
+                keys = [quote(key, safe='') for key in keys]
+            self._respond(200, '\n'.join(keys))
+        else:
+            key = unquote(parts.path[1:])
+            with self.server.lock:
+                value = self.server.data.get(key)
+            if value is None:
+                self._respond(404, '')
+            else:
+                self._respond(200, value)
+
+    def do_POST(self):
+        self._before_response()
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode()
+        items = parse_qs(body, keep_blank_values=True)
+        with self.server.lock:
+            for key, values in items.items():
+                self.server.data[key] = values[-1]
+        self._respond(200, '')
+
+    def do_DELETE(self):
+        self._before_response()
+        key = unquote(urlsplit(self.path).path[1:])
+        with self.server.lock:
+            self.server.data.pop(key, None)
+        self._respond(204, '')
+
+    def _before_response(self):
+        with self.server.lock:
+            self.server.request_count += 1
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+
+    def _respond(self, status: int, body: str):
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # Too noisy for benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Milliseconds added to every response')
+    args = parser.parse_args()
+    server = ReplDBStandIn(args.port, args.latency / 1000)
+    print(f'REPL DB stand in listening on {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
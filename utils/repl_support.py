@@ -1,19 +1,65 @@
+import os
 from typing import Union
 
-from utils.dict_persistent import DictPersistent
+from conf import Conf
+from utils.dict_persistent import DictPersistent, DictPersistentJournaled
+from utils.dict_segmented import DictSegmented
+from utils.dict_sqlite import DictSQLite
 from utils.log import log
+from utils.repl_db_client import ReplDBClient
 
 
-def get_db() -> Union[dict, DictPersistent]:
+def get_db() -> Union[dict, DictPersistent, DictSegmented, DictSQLite,
+                      ReplDBClient]:
     """
     Access to REPL DB
     :return:
     """
+    if not Conf.DB.USE_REPL_DB:
+        log(f'Using local db ({Conf.DB.LOCAL_BACKEND})')
+        return get_local_db()
+    url = os.getenv(Conf.ENV.REPL_DB_URL)
+    if Conf.DB.REPL_CLIENT == 'pooled' and url is not None:
+        db = ReplDBClient(url)
+        log("Using pooled client for REPL DB")
+        if Conf.DB.REPL_PREFETCH:
+            db.prefetch()
+        return db
     try:
         # noinspection PyUnresolvedReferences
         from replit import db
         log("Imported access to REPL DB")
     except ModuleNotFoundError:
-        db = DictPersistent()
+        db = get_local_db()
         log("Unable to get REPL DB Using Local dict")
     return db
+
+
+def get_local_db(backend: str = None) -> \
+        Union[DictPersistent, DictSegmented, DictSQLite]:
+    """
+    Creates the local stand in for the REPL DB
+    :param backend: Name of the backend to use. Defaults to
+        Conf.DB.LOCAL_BACKEND
+        - 'yaml': Whole file rewritten on every set
+        - 'journal': Sets appended to a journal that is compacted periodically
+        - 'segment': Indexed segment file, values decoded on first access.
+            Imports the yaml file on first use
+        - 'sqlite': SQLite database with a row per key. Imports the yaml file
+            on first use
+    :return: The local db
+    """
+    if backend is None:
+        backend = Conf.DB.LOCAL_BACKEND
+    if backend == 'yaml':
+        return DictPersistent(Conf.DB.LOCAL_FILE_NAME)
+    elif backend == 'journal':
+        return DictPersistentJournaled(Conf.DB.LOCAL_FILE_NAME)
+    elif backend == 'segment':
+        return DictSegmented(Conf.DB.SEGMENT_FILE_NAME,
+                             import_file_name=Conf.DB.LOCAL_FILE_NAME)
+    elif backend == 'sqlite':
+        return DictSQLite(Conf.DB.SQLITE_FILE_NAME,
+                          import_file_name=Conf.DB.LOCAL_FILE_NAME)
+    else:
+        raise ValueError(f'Unknown local db backend: {backend}')
@@ -1,12 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import logging
 import threading
+import time
+
+from utils.log import log
+
+
+class TimerHandle:
+    """
+    Returned by set_timeout and set_interval. Calling cancel stops the timer
+    (if it has not run yet for set_timeout).
+    """
+    __slots__ = ('function', 'args', 'kwargs', 'interval', 'loop',
+                 'cancelled', 'queued', '_service')
+
+    def __init__(self, service: 'TimerService', function: callable,
+                 args: list, kwargs: dict, interval: float = None,
+                 loop: asyncio.AbstractEventLoop = None):
+        self._service = service
+        self.function = function
+        self.args = [] if args is None else args
+        self.kwargs = {} if kwargs is None else kwargs
+        self.interval = interval
+        self.loop = loop
+        self.cancelled = False
+        self.queued = False  # In the heap (waiting to run)
+
+    def cancel(self):
+        self._service.cancel(self)
+
+    # set_interval used to return a threading.Event that was set to cancel
+    set = cancel
+
+
+class TimerService:
+    """
+    Runs all timers from a min-heap on a single daemon worker thread so the
+    number of threads and the memory per timer stay constant no matter how
+    many timers are pending. Scheduling is O(log n). Cancelling only marks
+    the timer (O(1)), cancelled timers are dropped when they reach the top
+    of the heap or when more than half of the heap is cancelled.
+
+    NB: Functions run one at a time on the worker thread (unless a loop is
+    passed, see schedule) so they should not block for long.
+    """
+    _instance = None
+
+    @classmethod
+    def get_instance(cls) -> 'TimerService':
+        if cls._instance is None:
+            cls._instance = TimerService()
+        return cls._instance
+
+    def __init__(self):
+        self._heap = []  # (time due, seq, handle)
+        self._seq = itertools.count()  # Ties run in the order scheduled
+        self._cancelled_count = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled_count
+
+    def schedule(self, delay: float, function: callable, args: list = None,
+                 kwargs: dict = None, interval: float = None,
+                 loop: asyncio.AbstractEventLoop = None) -> TimerHandle:
+        """
+        :param delay: Number of seconds before function is called
+        :param function: The function to be called
+        :param args: The positional arguments for the function
+        :param kwargs: The key word arguments for the function
+        :param interval: If not None function is called again every interval
+            seconds after the first call
+        :param loop: If not None function is called on this loop instead of
+            the worker thread (for functions that use loop owned state)
+        :return: Handle that can be used to cancel the timer
+        """
+        handle = TimerHandle(self, function, args, kwargs, interval, loop)
+        with self._condition:
+            self._push(time.monotonic() + delay, handle)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='TimerService',
+                                                daemon=True)
+                self._thread.start()
+        return handle
+
+    def cancel(self, handle: TimerHandle):
+        with self._condition:
+            if handle.cancelled:
+                return
+            handle.cancelled = True
+            if not handle.queued:
+                return  # Already ran (not in the heap to be dropped)
+            self._cancelled_count += 1
+            if self._cancelled_count > len(self._heap) // 2:
+                # Rebuild to keep memory proportional to live timers
+                self._heap = [x for x in self._heap if not x[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled_count = 0
+
+    def _push(self, due: float, handle: TimerHandle):
+        """
+        ASSUMPTION: Called while holding self._condition
+        """
+        entry = (due, next(self._seq), handle)
+        handle.queued = True
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._condition.notify()  # Worker may need to wake up earlier
+
+    def _next_due(self) -> TimerHandle:
+        """
+        Waits for the next timer that is due and removes it from the heap
+        (scheduling the next run for intervals)
+        """
+        with self._condition:
+            while True:
+                while len(self._heap) > 0 and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)[2].queued = False
+                    self._cancelled_count -= 1
+                if len(self._heap) == 0:
+                    self._condition.wait()
+                    continue
+                due, _, handle = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                handle.queued = False
+                if handle.interval is not None:
+                    self._push(due + handle.interval, handle)
+                return handle
+
+    def _run(self):
+        while True:
+            handle = self._next_due()
+            if handle.loop is not None:
+                handle.loop.call_soon_threadsafe(
+                    lambda x=handle: x.function(*x.args, **x.kwargs))
+                continue
+            try:
+                handle.function(*handle.args, **handle.kwargs)
+            except Exception as e:
+                log(f'[Timer] Exception in {handle.function}: {e}',
+                    logging.ERROR)
 
 
 def set_timeout(timeout: float, function: callable, args: list = None,
-                kwargs: dict = None) -> threading.Timer:
+                kwargs: dict = None,
+                loop: asyncio.AbstractEventLoop = None) -> TimerHandle:
     """
-    Wrapper for library thread timer. Easy to find for future reference and
-    sets timer to be a daemon so that it will stop if the main thead
-    terminates.
+    Runs function once after timeout seconds (see TimerService). Easy to
+    find for future reference. The worker thread is a daemon so that it
+    will stop if the main thead terminates.
 
     NB: The interval the timer will wait before executing its action may not
     be exactly the same as the interval specified by the user.
@@ -15,21 +165,19 @@ def set_timeout(timeout: float, function: callable, args: list = None,
     :param function: The function to be called
     :param args: The positional arguments for the function
     :param kwargs: The key word arguments for the function
-    :return: The timer object so that calling cancel on it will stop the timer
+    :param loop: If not None function is called on this loop
+    :return: The timer handle so that calling cancel on it will stop the
+        timer
     """
-    timer = threading.Timer(timeout, function, args, kwargs)
-
-    # So it won't prevent program termination because it hasn't run
-    timer.daemon = True
-
-    timer.start()
-    return timer
+    return TimerService.get_instance().schedule(timeout, function, args,
+                                                kwargs, loop=loop)
 
 
 def set_interval(interval: float, function: callable, args: list = None,
-                 kwargs: dict = None) -> threading.Event:
+                 kwargs: dict = None,
+                 loop: asyncio.AbstractEventLoop = None) -> TimerHandle:
     """
-    Repeated timer every interval seconds.
+    Repeated timer every interval seconds (see TimerService).
 
     NB: The interval the timer will wait before executing its action may not
     be exactly the same as the interval specified by the user.
@@ -39,25 +187,10 @@ def set_interval(interval: float, function: callable, args: list = None,
     :param function: The function to be called
     :param args: The positional arguments for the function
     :param kwargs: The key word arguments for the function
-    :return: The a thread event that can be set to cancel the timer (eg
-        result.set())
-    """
-    if args is None:
-        args = []
-    if kwargs is None:
-        kwargs = {}
-
-    class MyThread(threading.Thread):
-        def __init__(self, event):
-            threading.Thread.__init__(self)
-            self.stopped = event
-
-        def run(self):
-            while not self.stopped.wait(interval):
-                function(*args, **kwargs)  # call a function
-
-    stop_event = threading.Event()
-    t = MyThread(stop_event)
-    t.daemon = True
-    t.start()
-    return stop_event
+    :param loop: If not None function is called on this loop
+    :return: The timer handle so that calling cancel on it will stop the
+        timer (set also works as set_interval used to return an event)
+    """
+    return TimerService.get_instance().schedule(interval, function, args,
+                                                kwargs, interval=interval,
+                                                loop=loop)
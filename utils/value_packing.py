@@ -0,0 +1,120 @@
+"""
+Converts string values to the form stored in the db and back. Values above
+Conf.DB.COMPRESS_MIN_BYTES are compressed and stored as base64 and values
+still larger than Conf.DB.MAX_VALUE_BYTES are split across chunk keys with a
+manifest stored under the original key. Sizes are of the utf-8 encoded
+values.
+
+Stored forms:
+    - Anything not starting with MARKER: The value as is
+    - MARKER z:<base64>: zlib compressed value
+    - MARKER x:<base64>: lzma compressed value
+    - MARKER m:<json>: Manifest, value is the concatenation of the chunk keys
+        (see chunk_key) unpacked
+"""
+import base64
+import json
+import lzma
+import re
+import zlib
+from typing import Callable, Dict
+
+from conf import Conf
+
+MARKER = '!dbc:'
+CHUNK_SEP = '#chunk'
+_CHUNK_KEY_PATTERN = re.compile(f'{re.escape(CHUNK_SEP)}[0-9]+$')
+
+_COMPRESSORS = {
+    'zlib': ('z', zlib.compress, zlib.decompress),
+    'lzma': ('x', lzma.compress, lzma.decompress),
+}
+_DECOMPRESSORS = {tag: decompress for tag, _, decompress in
+                  _COMPRESSORS.values()}
+
+
+def chunk_key(key: str, index: int) -> str:
+    return f'{key}{CHUNK_SEP}{index}'
+
+
+def is_chunk_key(key: str) -> bool:
+    """
+    :return: True if key ends with CHUNK_SEP followed by a chunk number
+    """
+    return _CHUNK_KEY_PATTERN.search(key) is not None
+
+
+def pack(key: str, value: str) -> Dict[str, str]:
+    """
+    Converts value to the form to be stored in the db
+    :param key: The key the value is being stored under
+    :param value: The value to be stored
+    :return: Keys and values to write to the db (more than one if the value
+        was split into chunks)
+    """
+    stored, encoded = value, value.encode()
+    if len(encoded) >= Conf.DB.COMPRESS_MIN_BYTES \
+            and Conf.DB.COMPRESSION is not None:
+        tag, compress, _ = _COMPRESSORS[Conf.DB.COMPRESSION]
+        compressed = \
+            f'{MARKER}{tag}:{base64.b64encode(compress(encoded)).decode()}'
+        if len(compressed) < len(encoded):  # Only ascii so chars are bytes
+            stored, encoded = compressed, compressed.encode()
+    if stored is value and value.startswith(MARKER):
+        # Must not be mistaken for a packed value when read
+        stored = f'{MARKER}z:' \
+                 f'{base64.b64encode(zlib.compress(encoded)).decode()}'
+        encoded = stored.encode()
+
+    size = Conf.DB.MAX_VALUE_BYTES
+    if len(encoded) <= size:
+        return {key: stored}
+    chunks = _split_utf8(encoded, size)
+    result = {chunk_key(key, i): chunk for i, chunk in enumerate(chunks)}
+    result[key] = f'{MARKER}m:{json.dumps({"chunks": len(chunks)})}'
+    return result
+
+
+def _split_utf8(encoded: bytes, size: int) -> list:
+    """
+    Splits utf-8 encoded text into strings of at most size bytes without
+    splitting a character
+    """
+    result = []
+    start = 0
+    while start < len(encoded):
+        end = min(start + size, len(encoded))
+        while end < len(encoded) and end > start + 1 \
+                and encoded[end] & 0xC0 == 0x80:
+            end -= 1  # Continuation byte, move back to the character start
+        result.append(encoded[start:end].decode())
+        start = end
+    return result
+
+
+def unpack(value: str, get: Callable[[str], str], key: str) -> str:
+    """
+    Converts a value read from the db back to the value originally packed
+    :param value: The value read from the db
+    :param get: Function to read other keys from the db (for chunks)
+    :param key: The key value was read from
+    :return: The original value
+    """
+    if not value.startswith(MARKER):
+        return value
+    tag, _, data = value[len(MARKER):].partition(':')
+    if tag == 'm':
+        count = chunk_count(value)
+        return unpack(''.join(get(chunk_key(key, i)) for i in range(count)),
+                      get, key)
+    return _DECOMPRESSORS[tag](base64.b64decode(data)).decode()
+
+
+def chunk_count(stored: str) -> int:
+    """
+    :param stored: A value as stored in the db under the original key
+    :return: Number of chunk keys used by the value
+    """
+    if stored.startswith(f'{MARKER}m:'):
+        return json.loads(stored[len(MARKER) + 2:])['chunks']
+    return 0